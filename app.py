@@ -4,12 +4,14 @@ import plotly.express as px
 import plotly.graph_objects as go
 import pandas as pd
 from datetime import datetime
-from ingestion import parse_document
-from chunking import chunk_text
-from embedding import embed_chunks, embed_query
+from embedding import embed_query, max_chunk_tokens, warmup, WARMUP_AT_STARTUP, MODEL_ID
+from ingest_pipeline import IngestionJob, LARGE_DOCUMENT_BYTES, MEMORY_LIMIT_MB
 from vector_store import VectorStore
 from retrieval import retrieve_relevant_chunks
 from rag_pipeline import generate_answer
+from doc_cache import DocumentCache
+from utils import document_id, parse_page_ranges
+from bulk_ingest import DEFAULT_INDEX_PATH
 import requests
 import os
 
@@ -173,6 +175,18 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Fixed questions behind the quick buttons on the document page
+QUICK_QUESTIONS = {
+    'summary': "Please provide a comprehensive summary of this document.",
+    'key_points': "What are the main key points in this document?",
+    'concepts': "Explain the main concepts discussed in this document.",
+}
+
+# Load the embedding model in the background while the first page renders, and
+# pre-embed the quick questions so the buttons never wait for the model
+if WARMUP_AT_STARTUP:
+    warmup(queries=QUICK_QUESTIONS.values())
+
 def get_modern_css(theme='light'):
     if theme == 'dark':
         return """
@@ -545,13 +559,40 @@ def get_modern_css(theme='light'):
         </style>
         """
 
+@st.cache_resource
+def get_document_cache():
+    """Process-wide document cache shared by all sessions"""
+    return DocumentCache()
+
+document_cache = get_document_cache()
+
+def load_vector_store():
+    """Start from the bulk-ingested index (see bulk_ingest.py) when one exists"""
+    if VectorStore.exists(DEFAULT_INDEX_PATH):
+        try:
+            return VectorStore.load(DEFAULT_INDEX_PATH, model_id=MODEL_ID)
+        except ValueError as e:
+            # Vectors from another model are not comparable with this model's queries
+            st.warning(f"⚠️ Not using the bulk-ingested index: {e}")
+    return VectorStore(model_id=MODEL_ID)
+
 # Initialize session state
 if 'vector_store' not in st.session_state:
-    st.session_state.vector_store = VectorStore()
+    st.session_state.vector_store = load_vector_store()
 if 'chat_history' not in st.session_state:
     st.session_state.chat_history = []
 if 'uploaded_document' not in st.session_state:
     st.session_state.uploaded_document = None
+    if st.session_state.vector_store.chunks:
+        st.session_state.uploaded_document = {
+            'name': f"{len(st.session_state.vector_store.documents)} documents from {DEFAULT_INDEX_PATH}",
+            'doc_id': None,
+            'size': 0,
+            'chunks': len(st.session_state.vector_store.chunks),
+            'upload_time': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+if 'ingestion_job' not in st.session_state:
+    st.session_state.ingestion_job = None
 if 'current_page' not in st.session_state:
     st.session_state.current_page = 'home'
 if 'theme' not in st.session_state:
@@ -608,8 +649,12 @@ with st.sidebar:
     )
     
     # Advanced settings
-    chunk_size = st.slider("Chunk Size", 100, 1000, 500, help="Size of text chunks for processing")
-    overlap = st.slider("Chunk Overlap", 0, 200, 50, help="Overlap between chunks")
+    # Chunks are measured in embedding-model tokens, so the largest chunk still fits the model window.
+    # The configured window is used until the model has loaded, so the sidebar never waits for it.
+    model_window = max_chunk_tokens(load=False)
+    chunk_size = st.slider("Chunk Size (tokens)", 32, model_window, model_window,
+                           help="Tokens per chunk; the maximum is the embedding model's window")
+    overlap = st.slider("Chunk Overlap (tokens)", 0, 128, 32, help="Tokens shared by consecutive chunks")
     top_k = st.slider("Top K Results", 1, 10, 3, help="Number of relevant chunks to retrieve")
 
 def home_page():
@@ -673,25 +718,69 @@ def home_page():
     if uploaded_file:
         st.success(f"✅ File uploaded: {uploaded_file.name}")
         
+        # Record a job that finished since the last rerun, so only a running one blocks the upload
+        job = st.session_state.ingestion_job
+        if job is not None and job.done:
+            finish_ingestion()
+        
+        # The uploader keeps its value across reruns; don't index the same document twice
+        doc_key = document_id(uploaded_file.getvalue(), chunk_size, overlap, chunk_unit='tokens')
+        if st.session_state.vector_store.has_document(doc_key):
+            st.info("ℹ️ This document is already indexed. Open the Document View to ask questions.")
+            return
+        
+        # One background job at a time; a second would index alongside the first and orphan its chunks
+        if st.session_state.ingestion_job is not None:
+            st.info("⏳ A document is still being indexed. New uploads and chunk settings apply once it finishes.")
+            return
+        
+        # Same document with new chunk settings: re-chunk from cached sentence vectors
+        doc = st.session_state.uploaded_document
+        if doc and doc.get('source') == uploaded_file.getvalue():
+            apply_chunk_settings(doc)
+            st.session_state.current_page = 'document'
+            st.rerun()
+        
+        # Identical bytes with identical chunk settings hit the on-disk cache
+        cached = document_cache.get(doc_key)
+        if not cached:
+            # Index in the background; questions can be asked as soon as the first batch lands.
+            # Large uploads spill to disk instead of holding the extracted text in memory.
+            large = uploaded_file.size > LARGE_DOCUMENT_BYTES
+            st.session_state.ingestion_job = IngestionJob(
+                uploaded_file, st.session_state.vector_store,
+                chunk_size=chunk_size, overlap=overlap, chunk_unit='tokens', doc_id=doc_key,
+                parallel=True, keep_text=not large, sentence_vectors=not large,
+                memory_limit_mb=MEMORY_LIMIT_MB if large else None
+            )
+            st.session_state.uploaded_document = {
+                'name': uploaded_file.name,
+                'doc_id': doc_key,
+                'size': 0,
+                'chunks': 0,
+                'upload_time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                # Kept to re-chunk when the sliders change; spilled large uploads cannot be
+                'source': None if large else uploaded_file.getvalue(),
+                'chunking': (chunk_size, overlap)
+            }
+            st.session_state.current_page = 'document'
+            st.rerun()
+        
         with st.spinner("🔄 Processing your document..."):
-            # Parse document
-            text = parse_document(uploaded_file)
-            
-            # Chunk text with custom settings
-            chunks = chunk_text(text, chunk_size=chunk_size, overlap=overlap)
-            
-            # Generate embeddings
-            embeddings = embed_chunks(chunks)
-            
-            # Add to vector store
-            st.session_state.vector_store.add_embeddings(chunks, embeddings)
+            text, chunks, embeddings, sentence_vectors = cached
+            st.session_state.vector_store.add_embeddings(chunks, embeddings, doc_id=doc_key)
             
             # Store document info
             st.session_state.uploaded_document = {
                 'name': uploaded_file.name,
+                'doc_id': doc_key,
                 'size': len(text),
                 'chunks': len(chunks),
-                'upload_time': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                'duplicates': sum(len(locations) for locations in chunks.sources.values()),
+                'upload_time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                'source': uploaded_file.getvalue(),
+                'sentence_vectors': sentence_vectors,
+                'chunking': (chunk_size, overlap)
             }
         
         st.success("✅ Document processed successfully!")
@@ -712,6 +801,55 @@ def home_page():
         st.session_state.current_page = 'document'
         st.rerun()
 
+def finish_ingestion():
+    """Record the result of a finished background indexing job"""
+    job = st.session_state.ingestion_job
+    st.session_state.ingestion_job = None
+    doc = st.session_state.uploaded_document
+    if job.error:
+        st.session_state.vector_store.remove_document(doc['doc_id'])
+        doc['error'] = str(job.error)
+        return
+    if 'text' in job.stats:
+        # Cache the embeddings the pipeline computed; the store may hold reduced vectors
+        chunks, _ = st.session_state.vector_store.get_document(doc['doc_id'])
+        document_cache.put(doc['doc_id'], job.stats['text'], chunks, job.stats['embeddings'],
+                           job.stats.get('sentence_vectors'))
+    # Built by the job after indexing, so chunk settings can change without re-embedding
+    doc['sentence_vectors'] = job.stats.get('sentence_vectors')
+    doc['size'] = job.stats['characters']
+    doc['chunks'] = job.stats['chunks']
+    doc['duplicates'] = job.stats['duplicates']
+
+def apply_chunk_settings(doc):
+    """Re-chunk the loaded document for the current sliders by pooling its sentence vectors, without re-embedding"""
+    vectors = doc.get('sentence_vectors')
+    if vectors is None or doc.get('chunking') == (chunk_size, overlap):
+        return
+    chunks, embeddings = vectors.assemble(chunk_size, overlap)
+    # Pooled vectors are not what embedding token chunks gives, so they never share its identity
+    new_id = document_id(doc['source'], chunk_size, overlap, chunk_unit='pooled-tokens')
+    vector_store = st.session_state.vector_store
+    vector_store.remove_document(doc['doc_id'])
+    vector_store.add_embeddings(chunks, embeddings, doc_id=new_id, replace=True)
+    doc.update(doc_id=new_id, chunks=len(chunks), chunking=(chunk_size, overlap),
+               duplicates=sum(len(locations) for locations in chunks.sources.values()))
+
+@st.fragment(run_every=1.0)
+def indexing_status():
+    """Show background indexing progress until the document is fully indexed"""
+    job = st.session_state.ingestion_job
+    if job is None:
+        return
+    if job.done:
+        finish_ingestion()
+        st.rerun()
+    total_pages = job.total_pages or 0
+    st.progress(
+        job.pages_indexed / total_pages if total_pages else 0.0,
+        text=f"📖 Indexed {job.pages_indexed} of {total_pages} pages. You can already ask questions about the indexed part."
+    )
+
 def document_page():
     """Display the document analysis page"""
     if not st.session_state.uploaded_document:
@@ -724,7 +862,17 @@ def document_page():
     
     # Document info
     doc = st.session_state.uploaded_document
-    st.info(f"📄 **Document:** {doc['name']} | 📝 **Chunks:** {doc['chunks']} | 📏 **Size:** {doc['size']:,} chars")
+    if doc.get('error'):
+        st.error(f"❌ Failed to process document: {doc['error']}")
+    if (doc.get('source') is not None and doc.get('chunking') != (chunk_size, overlap)
+            and st.session_state.ingestion_job is None and not doc.get('error')):
+        apply_chunk_settings(doc)
+    chunk_count = st.session_state.vector_store.documents.get(doc['doc_id'], doc['chunks'])
+    st.info(f"📄 **Document:** {doc['name']} | 📝 **Chunks:** {chunk_count} | 📏 **Size:** {doc['size']:,} chars")
+    if doc.get('duplicates'):
+        st.caption(f"♻️ {doc['duplicates']} near-duplicate chunks were collapsed into earlier ones "
+                   f"({doc['duplicates']} embeddings saved)")
+    indexing_status()
     
     # Quick question buttons
     st.markdown("### 🚀 Quick Questions")
@@ -732,15 +880,15 @@ def document_page():
     
     with col1:
         if st.button("📋 Summarize Document", use_container_width=True):
-            ask_question("Please provide a comprehensive summary of this document.")
+            ask_question(QUICK_QUESTIONS['summary'])
     
     with col2:
         if st.button("🔍 Key Points", use_container_width=True):
-            ask_question("What are the main key points in this document?")
+            ask_question(QUICK_QUESTIONS['key_points'])
     
     with col3:
         if st.button("❓ Explain Concepts", use_container_width=True):
-            ask_question("Explain the main concepts discussed in this document.")
+            ask_question(QUICK_QUESTIONS['concepts'])
     
     # Custom question input
     st.markdown("### 💬 Ask a Custom Question")
@@ -751,6 +899,14 @@ def document_page():
         label_visibility="collapsed"
     )
     
+    # Narrow the vector scan to part of the document by chunk metadata
+    with st.expander("🎯 Search within a section or pages"):
+        col1, col2 = st.columns(2)
+        with col1:
+            st.text_input("Section heading contains", placeholder="e.g. Section 4", key="filter_heading")
+        with col2:
+            st.text_input("Pages", placeholder="e.g. 3-5, 8", key="filter_pages")
+    
     col1, col2, col3 = st.columns([1, 2, 1])
     with col2:
         if st.button("🔍 Get Answer", use_container_width=True):
@@ -772,14 +928,34 @@ def document_page():
             </div>
             """, unsafe_allow_html=True)
 
+def search_filters():
+    """Metadata filters chosen under "Search within a section or pages" """
+    filters = {}
+    heading = st.session_state.get('filter_heading', '').strip()
+    if heading:
+        filters['heading'] = heading
+    pages = st.session_state.get('filter_pages', '').strip()
+    if pages:
+        try:
+            filters['pages'] = parse_page_ranges(pages)
+        except ValueError:
+            st.warning(f"⚠️ Ignoring page filter \"{pages}\"; use numbers and ranges like 3-5, 8")
+    return filters
+
 def ask_question(question):
     """Ask a question and get an answer"""
-    with st.spinner("🧠 AI is thinking..."):
+    job = st.session_state.ingestion_job
+    if job is not None and not job.done:
+        spinner_text = f"🧠 AI is thinking... (searching {job.pages_indexed} of {job.total_pages or 0} pages indexed so far)"
+    else:
+        spinner_text = "🧠 AI is thinking..."
+    with st.spinner(spinner_text):
         # Generate query embedding
         query_embedding = embed_query(question)
         
         # Retrieve relevant chunks
-        top_chunks = retrieve_relevant_chunks(query_embedding, st.session_state.vector_store, top_k=top_k)
+        top_chunks = retrieve_relevant_chunks(query_embedding, st.session_state.vector_store, top_k=top_k,
+                                              **search_filters())
         
         # Create context from chunks
         context = "\n\n".join(top_chunks) if top_chunks else "No relevant context found."
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the Document Q&A ingestion pipeline.
+Run all benchmarks with `python benchmark.py`, or name the ones to run.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+def generate_pdf_corpus(num_docs=5, pages_per_doc=40, lines_per_page=40):
+    """
+    Generate synthetic text PDFs in memory with PyMuPDF.
+    Returns:
+        List[bytes]: Raw PDF documents
+    """
+    import pymupdf
+
+    corpus = []
+    for d in range(num_docs):
+        doc = pymupdf.open()
+        for p in range(pages_per_doc):
+            page = doc.new_page()
+            text = '\n'.join(
+                f"Document {d} page {p} line {i}: the quick brown fox jumps over the lazy dog."
+                for i in range(lines_per_page)
+            )
+            page.insert_textbox(page.rect + (36, 36, -36, -36), text, fontsize=9)
+        corpus.append(doc.tobytes())
+        doc.close()
+    return corpus
+
+def benchmark_pdf_backends():
+    """Compare pages/sec of every registered PDF backend on a generated corpus."""
+    print("\nBenchmarking PDF backends...")
+    from ingestion import PDF_BACKENDS, parse_pdf
+
+    corpus = generate_pdf_corpus()
+    total_pages = sum(PDF_BACKENDS['pdfplumber'][0](data) for data in corpus)
+    results = {}
+    for backend in PDF_BACKENDS:
+        start = time.perf_counter()
+        for data in corpus:
+            parse_pdf(data, backend=backend)
+        elapsed = time.perf_counter() - start
+        results[backend] = total_pages / elapsed
+        print(f"   {backend:<12} {results[backend]:8.1f} pages/sec")
+    return results
+
+def generate_markup_corpus(target_mb=4):
+    """
+    Generate a large HTML export and a large Markdown file.
+    Returns:
+        Tuple[str, str]: (html, markdown)
+    """
+    html_sections, md_sections = [], []
+    size, i = 0, 0
+    while size < target_mb * 1024 * 1024:
+        paragraph = f"Section {i} explains <b>topic {i}</b> with a <a href='#s{i}'>link</a> and more detail. " * 4
+        html_sections.append(f"<h2>Section {i}</h2><p>{paragraph}</p><ul><li>Point {i}</li><li>Note {i}</li></ul>")
+        md_sections.append(f"## Section {i}\n\nSection {i} explains **topic {i}** with a [link](#s{i}) "
+                           f"and more detail. " * 4 + f"\n\n- Point {i}\n- Note {i}\n")
+        size += len(html_sections[-1])
+        i += 1
+    html = "<html><head><style>p {}</style></head><body>" + ''.join(html_sections) + "</body></html>"
+    return html, '\n'.join(md_sections)
+
+def benchmark_text_extractors():
+    """Compare MB/sec of the fast HTML/Markdown extractors against the BeautifulSoup path."""
+    print("\nBenchmarking HTML/Markdown extraction...")
+    from ingestion import _html_to_text, _markdown_to_text
+
+    html, markdown = generate_markup_corpus()
+    results = {}
+    for label, extract, text in (('html', _html_to_text, html), ('markdown', _markdown_to_text, markdown)):
+        megabytes = len(text.encode('utf-8')) / (1024 * 1024)
+        for mode, fast in (('bs4', False), ('fast', True)):
+            start = time.perf_counter()
+            extract(text, fast)
+            elapsed = time.perf_counter() - start
+            results[f"{label}_{mode}"] = megabytes / elapsed
+            print(f"   {label:<9} {mode:<5} {megabytes / elapsed:8.2f} MB/sec")
+    return results
+
+def generate_page_texts(target_mb=8, page_chars=3000):
+    """
+    Generate raw PDF-like page texts: short lines, some ragged spacing,
+    words hyphenated across lines, ligatures and stray control characters.
+    Returns:
+        List[str]: Page texts
+    """
+    lines = (
+        "The final report covers shipping volumes and supply chains over the quarter.\n"
+        "Freight costs rose in most regions while average delivery times fell by a day.\n"
+        "Carriers cited port congestion and inter-\nnational routing as the main risks.\n"
+        "Section 4  summarizes the \ufb01ndings\tby region \x0c and lists open actions.\n"
+    )
+    pages = []
+    size = 0
+    while size < target_mb * 1024 * 1024:
+        page = f"Page {len(pages) + 1}\n\n" + lines * (page_chars // len(lines))
+        pages.append(page)
+        size += len(page)
+    return pages
+
+def _clean_text_two_pass(text):
+    """utils.clean_text as it was before the streaming normalizer, for comparison."""
+    import re
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'[\x00-\x1f\x7f-\x9f]', '', text)
+    return text.strip()
+
+def benchmark_normalizer():
+    """Compare MB/sec and peak memory of the streaming normalizer against whole-document cleaning."""
+    print("\nBenchmarking text normalization...")
+    import tracemalloc
+    from utils import TextNormalizer, clean_text
+
+    pages = generate_page_texts()
+    megabytes = sum(len(page) for page in pages) / (1024 * 1024)
+
+    def streaming():
+        normalizer = TextNormalizer()
+        for page in pages:
+            normalizer.feed(page)
+        normalizer.finish()
+
+    results = {}
+    for label, run in (('two-pass', lambda: _clean_text_two_pass('\n'.join(pages))),
+                       ('clean_text', lambda: clean_text('\n'.join(pages))),
+                       ('streaming', streaming)):
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        tracemalloc.start()
+        run()
+        peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        tracemalloc.stop()
+        results[label] = megabytes / elapsed
+        print(f"   {label:<11} {megabytes / elapsed:8.2f} MB/sec, peak {peak:7.2f} MB for {megabytes:.1f} MB of text")
+    return results
+
+def generate_mixed_chunks(num_chunks=2048, min_words=16, max_words=250, seed=0):
+    """
+    Generate chunks of widely varying length, like the tail chunks and
+    short sections of a real corpus mixed with full-size chunks.
+    Returns:
+        List[str]: Chunk texts
+    """
+    import random
+
+    rng = random.Random(seed)
+    vocabulary = ("shipping freight carrier port congestion quarter region delivery report risk "
+                  "supply chain volume cost average route contract customer invoice warehouse").split()
+    return [' '.join(rng.choices(vocabulary, k=rng.randint(min_words, max_words))) for _ in range(num_chunks)]
+
+# Core counts the embedding engine is benchmarked on, where the machine has them
+BENCHMARK_CORES = (8, 16, 32)
+
+def benchmark_embedding_engine():
+    """Compare chunks/sec of plain model.encode against length-bucketed and multi-process embedding."""
+    print("\nBenchmarking embedding engine...")
+    import torch
+    from embedding import get_model
+    from embedding_engine import EMBED_THREADS_PER_PROCESS, EmbeddingPool, encode_bucketed
+
+    model = get_model()
+    chunks = generate_mixed_chunks()
+    available = os.cpu_count() or 1
+    default_threads = torch.get_num_threads()
+    results = {}
+    for cores in BENCHMARK_CORES:
+        if cores > available:
+            print(f"   {cores:>2} cores: skipped, only {available} available")
+            continue
+        torch.set_num_threads(cores)
+        processes = max(1, cores // EMBED_THREADS_PER_PROCESS)
+        pool = EmbeddingPool(processes, threads_per_process=cores // processes)
+        # Warm the pool up so process start and model load are not timed
+        pool.encode(model, chunks[:processes * 8])
+        runs = (('encode', lambda: model.encode(chunks, show_progress_bar=False)),
+                ('bucketed', lambda: encode_bucketed(model, chunks)),
+                (f'pool x{processes}', lambda: pool.encode(model, chunks)))
+        try:
+            for label, run in runs:
+                start = time.perf_counter()
+                run()
+                elapsed = time.perf_counter() - start
+                results[f"{cores}_{label}"] = len(chunks) / elapsed
+                print(f"   {cores:>2} cores {label:<10} {len(chunks) / elapsed:8.1f} chunks/sec")
+        finally:
+            pool.shutdown()
+    torch.set_num_threads(default_threads)
+    return results
+
+def benchmark_onnx_backend():
+    """Compare chunks/sec and cosine drift of the torch model against its int8 ONNX Runtime export."""
+    print("\nBenchmarking ONNX backend...")
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+    from embedding import MODEL_NAME
+    from embedding_engine import encode_bucketed
+    from onnx_backend import load_onnx_model
+
+    chunks = generate_mixed_chunks()
+    cores = os.cpu_count() or 1
+    backends = {'torch': SentenceTransformer(MODEL_NAME, device='cpu'),
+                'onnx int8': load_onnx_model(MODEL_NAME, threads=cores)}
+    results = {}
+    vectors = {}
+    for label, model in backends.items():
+        # Warm up so graph optimization and allocator growth are not timed
+        encode_bucketed(model, chunks[:32])
+        start = time.perf_counter()
+        vectors[label] = encode_bucketed(model, chunks)
+        elapsed = time.perf_counter() - start
+        results[label] = len(chunks) / elapsed
+        print(f"   {label:<10} {results[label]:8.1f} chunks/sec on {cores} cores")
+    reference, quantized = vectors['torch'], vectors['onnx int8']
+    cosine = (reference * quantized).sum(axis=1) / (
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(quantized, axis=1))
+    results['speedup'] = results['onnx int8'] / results['torch']
+    results['min_cosine'] = float(cosine.min())
+    print(f"   ONNX int8 is {results['speedup']:.2f}x torch, cosine min {cosine.min():.4f}, mean {cosine.mean():.4f}")
+    return results
+
+# Target dimensions the reduction benchmark tries
+BENCHMARK_REDUCE_DIMS = (64, 128, 192)
+
+def benchmark_dimension_reduction(k=10):
+    """Compare recall@k and search time of PCA- and truncation-reduced indexes against full-dimension vectors."""
+    print("\nBenchmarking dimension reduction...")
+    from embedding import embed_chunks
+    from vector_store import VectorStore, recall_at_k
+
+    chunks = generate_mixed_chunks(num_chunks=8192)
+    queries = embed_chunks(generate_mixed_chunks(num_chunks=256, min_words=4, max_words=16, seed=1))
+    embeddings = embed_chunks(chunks)
+    baseline = VectorStore(reduce_dim=0)
+    baseline.add_embeddings(chunks, embeddings)
+
+    def search_time(store):
+        start = time.perf_counter()
+        store.index.search(queries, k)
+        return (time.perf_counter() - start) / len(queries) * 1e6
+
+    results = {'full': {'recall': 1.0, 'us_per_query': search_time(baseline)}}
+    print(f"   full  {embeddings.shape[1]:>3} dims: recall@{k} 1.000, {results['full']['us_per_query']:7.1f} µs/query")
+    for method in ('pca', 'truncate'):
+        for dim in BENCHMARK_REDUCE_DIMS:
+            if dim >= embeddings.shape[1]:
+                continue
+            store = VectorStore(reduce_dim=dim, reduction=method)
+            store.add_embeddings(chunks, embeddings)
+            store.fit_reduction()
+            recall = recall_at_k(baseline.index, store.index, queries, k)
+            results[f"{method}_{dim}"] = {'recall': recall, 'us_per_query': search_time(store)}
+            print(f"   {method:<8} {dim:>3} dims: recall@{k} {recall:.3f}, "
+                  f"{results[f'{method}_{dim}']['us_per_query']:7.1f} µs/query")
+    return results
+
+BENCHMARKS = {
+    'pdf_backends': benchmark_pdf_backends,
+    'text_extractors': benchmark_text_extractors,
+    'normalizer': benchmark_normalizer,
+    'embedding_engine': benchmark_embedding_engine,
+    'onnx_backend': benchmark_onnx_backend,
+    'dimension_reduction': benchmark_dimension_reduction,
+}
+
+def main():
+    """Run the selected benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('benchmarks', nargs='*',
+                        help=f"Benchmarks to run (default: all): {', '.join(BENCHMARKS)}")
+    args = parser.parse_args()
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    print("⏱️  Document Q&A Benchmarks")
+    print("=" * 50)
+    for name in args.benchmarks or BENCHMARKS:
+        BENCHMARKS[name]()
+    return True
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Bulk ingestion CLI for DocuMind AI.
+Parses a directory or zip of PDF/Markdown/HTML files in a process pool,
+embeds the chunks in large batches and writes a persisted index that
+the app loads at startup. Re-running after a crash resumes where the
+last checkpoint left off. Near-duplicate chunks within a document are
+collapsed before embedding.
+
+Usage: python bulk_ingest.py <directory-or-zip> [--output documind_index]
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from utils import document_id
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.md', '.markdown', '.html', '.htm', '.txt')
+DEFAULT_INDEX_PATH = os.getenv('DOCUMIND_INDEX_PATH', 'documind_index')
+
+# Set in each worker by _init_worker
+_indexed_ids = frozenset()
+
+def find_sources(source):
+    """
+    List the supported files in a directory or zip archive.
+    Returns:
+        List[Tuple[str, str]]: (container, member) pairs; container is the zip path or None
+    """
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            return sorted(
+                (source, name) for name in archive.namelist()
+                if name.lower().endswith(SUPPORTED_EXTENSIONS) and not name.endswith('/')
+            )
+    sources = []
+    for root, _, files in os.walk(source):
+        for name in files:
+            if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                sources.append((None, os.path.join(root, name)))
+    return sorted(sources)
+
+def _init_worker(indexed_ids, tokenizer=None):
+    global _indexed_ids, _tokenizer
+    _indexed_ids = indexed_ids
+    # Only the tokenizer: parse workers never embed, so they never load the model
+    if tokenizer is None:
+        from embedding import load_tokenizer
+        tokenizer = load_tokenizer()
+    _tokenizer = tokenizer
+
+def _parse_source(container, member, chunk_size, overlap):
+    """
+    Read, parse and chunk one file inside a worker process.
+    Returns:
+        Tuple[str, ChunkTable, int]: (doc_id, chunks, near-duplicate chunks collapsed);
+            chunks is None if already indexed
+    """
+    from ingestion import iter_document_sections
+    from chunking import ChunkTable
+    from dedup import collapse_near_duplicates
+
+    if container:
+        with zipfile.ZipFile(container) as archive:
+            data = archive.read(member)
+    else:
+        with open(member, 'rb') as f:
+            data = f.read()
+    doc_id = document_id(data, chunk_size, overlap, chunk_unit='tokens')
+    if doc_id in _indexed_ids:
+        return doc_id, None, 0
+    file = io.BytesIO(data)
+    file.name = os.path.basename(member)
+    # Offsets into the parsed text avoid pickling an overlapping copy of every chunk
+    _, sections = iter_document_sections(file)
+    # Chunked by model tokens, like uploads in the app, so no chunk is truncated when embedded
+    table = ChunkTable.from_sections(sections, chunk_size=chunk_size, overlap=overlap, tokenizer=_tokenizer)
+    chunks, duplicates = collapse_near_duplicates(table)
+    for position, locations in duplicates.items():
+        chunks.add_sources(position, locations)
+    return doc_id, chunks, len(table) - len(chunks)
+
+def _flush(vector_store, pending, embed_processes=None):
+    """Embed all pending chunks in one batch and index them per document."""
+    from embedding import embed_chunks
+
+    all_chunks = [chunk for _, chunks in pending for chunk in chunks]
+    embeddings = embed_chunks(all_chunks, processes=embed_processes) if all_chunks else []
+    offset = 0
+    for doc_id, chunks in pending:
+        vector_store.add_embeddings(chunks, embeddings[offset:offset + len(chunks)], doc_id=doc_id)
+        offset += len(chunks)
+    pending.clear()
+
+def ingest(source, output=DEFAULT_INDEX_PATH, workers=None, chunk_size=None, overlap=32,
+           batch_size=512, checkpoint_every=50, embed_processes=None, fit_reduction=False, tokenizer=None):
+    """
+    Ingest every supported file under source into the index at output.
+    Documents are chunked by model tokens; chunk_size defaults to the
+    embedding model's window (see embedding.max_chunk_tokens), as in the app.
+    Each parser process loads the model's tokenizer (or is sent tokenizer)
+    but not the model, which only this process loads, once parsing has started.
+    embed_processes spreads each embedding batch over that many model
+    processes (defaults to DOCUMIND_EMBED_PROCESSES; see embedding_engine.py).
+    With DOCUMIND_REDUCE_DIM set, the dimension reduction is fitted once
+    DOCUMIND_REDUCE_TRAIN_SIZE vectors are indexed; fit_reduction=True fits
+    it on a smaller corpus before the final save (see VectorStore.fit_reduction).
+    Returns:
+        dict: Counts of documents, skipped documents, failures, chunks and collapsed
+            duplicates (embeddings saved), elapsed seconds and the reduction's
+            recall@k (None when vectors are kept whole)
+    Raises:
+        ValueError: If the index at output was built with another embedding model
+    """
+    from embedding import MODEL_ID, max_chunk_tokens
+    from vector_store import VectorStore
+
+    chunk_size = chunk_size or max_chunk_tokens(load=False)
+    if VectorStore.exists(output):
+        vector_store = VectorStore.load(output, model_id=MODEL_ID)
+        print(f"♻️  Resuming: {len(vector_store.documents)} documents already indexed in {output}")
+    else:
+        vector_store = VectorStore(model_id=MODEL_ID)
+
+    sources = find_sources(source)
+    print(f"📚 Found {len(sources)} files in {source}")
+
+    stats = {'documents': 0, 'skipped': 0, 'failed': 0, 'chunks': 0, 'duplicates': 0}
+    pending = []
+    queued = set()
+    pending_chunks = 0
+    since_checkpoint = 0
+    start = time.perf_counter()
+    indexed_ids = frozenset(vector_store.documents)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(indexed_ids, tokenizer)) as pool:
+        futures = {
+            pool.submit(_parse_source, container, member, chunk_size, overlap): member
+            for container, member in sources
+        }
+        for future in as_completed(futures):
+            try:
+                doc_id, chunks, duplicates = future.result()
+            except Exception as e:
+                stats['failed'] += 1
+                print(f"❌ Failed to parse {futures[future]}: {e}")
+                continue
+            if chunks is None or doc_id in queued or vector_store.has_document(doc_id):
+                stats['skipped'] += 1
+                continue
+            queued.add(doc_id)
+            pending.append((doc_id, chunks))
+            pending_chunks += len(chunks)
+            stats['documents'] += 1
+            stats['chunks'] += len(chunks)
+            stats['duplicates'] += duplicates
+            if duplicates:
+                print(f"♻️  {futures[future]}: {duplicates} near-duplicate chunks collapsed")
+            since_checkpoint += 1
+
+            if pending_chunks >= batch_size:
+                _flush(vector_store, pending, embed_processes)
+                pending_chunks = 0
+            if since_checkpoint >= checkpoint_every:
+                _flush(vector_store, pending, embed_processes)
+                pending_chunks = 0
+                vector_store.save(output)
+                since_checkpoint = 0
+                elapsed = time.perf_counter() - start
+                print(f"💾 Checkpoint: {stats['documents']} docs, {stats['chunks']} chunks "
+                      f"({stats['documents'] / elapsed:.1f} docs/sec, {stats['chunks'] / elapsed:.1f} chunks/sec)")
+
+    _flush(vector_store, pending, embed_processes)
+    if fit_reduction:
+        vector_store.fit_reduction()
+    vector_store.save(output)
+    stats['reduction_recall'] = vector_store.reduction_recall if vector_store.reduced else None
+    stats['elapsed'] = time.perf_counter() - start
+    return stats
+
+def main():
+    """Main function to run bulk ingestion"""
+    parser = argparse.ArgumentParser(description="Bulk-ingest a directory or zip of documents into a DocuMind AI index")
+    parser.add_argument('source', help="Directory or .zip file of PDF, Markdown, HTML or text files")
+    parser.add_argument('--output', default=DEFAULT_INDEX_PATH, help="Index directory (default: %(default)s)")
+    parser.add_argument('--workers', type=int, default=None, help="Parser processes (default: number of CPUs)")
+    parser.add_argument('--chunk-size', type=int, default=None,
+                        help="Tokens per chunk (default: the embedding model's window)")
+    parser.add_argument('--overlap', type=int, default=32, help="Tokens shared by consecutive chunks (default: %(default)s)")
+    parser.add_argument('--batch-size', type=int, default=512, help="Chunks per embedding batch (default: %(default)s)")
+    parser.add_argument('--checkpoint-every', type=int, default=50,
+                        help="Save the index after this many documents (default: %(default)s)")
+    parser.add_argument('--embed-processes', type=int, default=None,
+                        help="Embedding model processes (default: $DOCUMIND_EMBED_PROCESSES, or 1)")
+    parser.add_argument('--fit-reduction', action='store_true',
+                        help="Fit the dimension reduction before saving even below $DOCUMIND_REDUCE_TRAIN_SIZE vectors")
+    args = parser.parse_args()
+    from vector_store import RECALL_K
+
+    if not os.path.exists(args.source):
+        print(f"❌ Source not found: {args.source}")
+        return False
+
+    print("🚀 Starting bulk ingestion...")
+    try:
+        stats = ingest(args.source, args.output, args.workers, args.chunk_size, args.overlap,
+                       args.batch_size, args.checkpoint_every, args.embed_processes, args.fit_reduction)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return False
+    elapsed = stats['elapsed'] or 1e-9
+    print("-" * 50)
+    print(f"✅ Indexed {stats['documents']} documents ({stats['chunks']} chunks) into {args.output}")
+    print(f"♻️  Collapsed {stats['duplicates']} near-duplicate chunks ({stats['duplicates']} embeddings saved)")
+    if stats['reduction_recall'] is not None:
+        print(f"📉 Vectors reduced: recall@{RECALL_K} {stats['reduction_recall']:.3f} against full dimension")
+    print(f"⏭️  Skipped {stats['skipped']} already indexed, ❌ {stats['failed']} failed")
+    print(f"⏱️  {elapsed:.1f}s: {stats['documents'] / elapsed:.2f} docs/sec, {stats['chunks'] / elapsed:.1f} chunks/sec")
+    return stats['failed'] == 0
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -3,6 +3,18 @@ Text chunking module.
 Splits extracted text into manageable chunks for embedding.
 """
 
+import mmap
+import os
+import re
+import sys
+from array import array
+import numpy as np
+
+_WORD = re.compile(r'\S+')
+
+# Sentence breaks: whitespace after terminal punctuation, or a blank line
+_SENTENCE_BREAK = re.compile(r'(?<=[.!?])\s+|\n\s*\n')
+
 def chunk_text(text, chunk_size=500, overlap=50):
     """
     Splits text into overlapping chunks.
@@ -24,3 +36,594 @@ def chunk_text(text, chunk_size=500, overlap=50):
             break
         start += chunk_size - overlap
     return chunks
+
+def iter_chunks(pages, chunk_size=500, overlap=50):
+    """
+    Incrementally chunk a stream of page texts.
+    Produces the same chunks as chunk_text('\n'.join(pages)) while only
+    buffering the words of the chunk currently being assembled.
+    Args:
+        pages (Iterable[str]): Page texts in order
+        chunk_size (int): Number of tokens/words per chunk
+        overlap (int): Overlap between chunks
+    Yields:
+        str: Text chunks
+    """
+    step = max(1, chunk_size - overlap)
+    words = []
+    emitted = False
+    for page in pages:
+        words.extend(page.split())
+        while len(words) >= chunk_size:
+            yield ' '.join(words[:chunk_size])
+            emitted = True
+            del words[:step]
+    # The tail is a new chunk only if it holds words the last chunk did not cover
+    if words and (not emitted or len(words) > chunk_size - step):
+        yield ' '.join(words)
+
+def iter_sentence_spans(text, max_words=64):
+    """
+    Split text into sentences, cutting any sentence longer than max_words
+    (tables, lists without punctuation) into max_words-word pieces.
+    Args:
+        text (str): Input text
+        max_words (int): Longest sentence kept whole
+    Yields:
+        Tuple[int, int]: (start, end) of each sentence, trimmed of surrounding whitespace
+    """
+    start = 0
+    for match in (*_SENTENCE_BREAK.finditer(text), None):
+        end = match.start() if match else len(text)
+        words = [word.span() for word in _WORD.finditer(text, start, end)]
+        for first in range(0, len(words), max_words):
+            piece = words[first:first + max_words]
+            yield piece[0][0], piece[-1][1]
+        if match:
+            start = match.end()
+
+def iter_chunks_from_reader(reader, chunk_size=500, overlap=50, block_chars=1024 * 1024):
+    """
+    Chunk a text file through a buffered reader, holding at most one block of text
+    and one chunk of words in memory.
+    Args:
+        reader: Text file object
+        chunk_size (int): Number of tokens/words per chunk
+        overlap (int): Overlap between chunks
+        block_chars (int): Characters read at a time
+    Yields:
+        str: Text chunks
+    """
+    return iter_chunks(iter_word_blocks(reader, block_chars), chunk_size, overlap)
+
+def iter_word_blocks(reader, block_chars):
+    """Read blocks of text, moving any word cut off at the end of a block into the next."""
+    carry = ''
+    while True:
+        block = reader.read(block_chars)
+        if not block:
+            if carry:
+                yield carry
+            return
+        block = carry + block
+        end = len(block)
+        while end and not block[end - 1].isspace():
+            end -= 1
+        if end:
+            yield block[:end]
+            carry = block[end:]
+        else:
+            carry = block
+
+def iter_chunk_spans(pages, chunk_size=500, overlap=50, page_breaks=False):
+    """
+    Incrementally chunk a stream of page texts into character spans.
+    Chunks cover the same words as iter_chunks, but are reported as offsets
+    into '\n'.join(pages) instead of being copied into new strings.
+    Args:
+        pages (Iterable[str]): Page texts in order
+        chunk_size (int): Number of tokens/words per chunk
+        overlap (int): Overlap between chunks
+        page_breaks (bool): Never let a chunk straddle two pages
+    Yields:
+        Tuple[int, int, int]: (start, end, page) of each chunk; page is the
+            index of the page the chunk starts on
+    """
+    step = max(1, chunk_size - overlap)
+    starts, ends, word_pages = [], [], []
+    emitted = False
+    offset = 0
+    for page_number, page in enumerate(pages):
+        for match in _WORD.finditer(page):
+            starts.append(offset + match.start())
+            ends.append(offset + match.end())
+            word_pages.append(page_number)
+        offset += len(page) + 1
+        while len(starts) >= chunk_size:
+            yield starts[0], ends[chunk_size - 1], word_pages[0]
+            emitted = True
+            del starts[:step], ends[:step], word_pages[:step]
+        if page_breaks:
+            if starts and (not emitted or len(starts) > chunk_size - step):
+                yield starts[0], ends[-1], word_pages[0]
+            starts, ends, word_pages = [], [], []
+            emitted = False
+    # The tail is a new chunk only if it holds words the last chunk did not cover
+    if starts and (not emitted or len(starts) > chunk_size - step):
+        yield starts[0], ends[-1], word_pages[0]
+
+# Long pages are cut at line breaks into pieces of about this many characters,
+# so a batched tokenizer call can spread one long page across threads
+TOKENIZE_PIECE_CHARS = 64 * 1024
+
+def _tokenizer_pieces(page, offset, page_number):
+    """Split a page at line breaks into (offset, piece, page) tuples."""
+    start = 0
+    while start < len(page):
+        end = page.find('\n', start + TOKENIZE_PIECE_CHARS) + 1 or len(page)
+        yield offset + start, page[start:end], page_number
+        start = end
+
+def iter_token_chunk_spans(pages, tokenizer, chunk_size=256, overlap=32, pages_per_call=None,
+                           page_breaks=False):
+    """
+    Chunk a stream of page texts by the embedding model's tokens, so every
+    chunk fits the model window instead of being truncated when embedded.
+    Pages are tokenized in batched calls and the tokenizer's offset mapping
+    turns token windows back into character spans. Chunks end and start on
+    word boundaries unless a single word is longer than the window.
+    Args:
+        pages (Iterable[str]): Page texts in order
+        tokenizer: Fast (Rust-backed) Hugging Face tokenizer
+        chunk_size (int): Tokens per chunk, excluding special tokens
+        overlap (int): Tokens shared by consecutive chunks
+        pages_per_call (int): Pages tokenized per call; None tokenizes the whole document in one call
+        page_breaks (bool): Never let a chunk straddle two pages
+    Yields:
+        Tuple[int, int, int]: (start, end, page) of each chunk, as in iter_chunk_spans
+    """
+    chunk_size = max(1, chunk_size)
+    overlap = min(max(0, overlap), chunk_size - 1)
+    starts, ends, words, token_pages = [], [], [], []
+    pos = 0          # First token of the next chunk
+    covered = 0      # Tokens up to here are in an emitted chunk
+    next_word = 0
+
+    def tokenize(pieces):
+        nonlocal next_word
+        encoding = tokenizer([piece for _, piece, _ in pieces], add_special_tokens=False,
+                             return_offsets_mapping=True, return_attention_mask=False,
+                             return_token_type_ids=False)
+        current_page = token_pages[-1] if token_pages else None
+        for i, (offset, _, page_number) in enumerate(pieces):
+            if page_breaks and page_number != current_page:
+                # Close off the previous page's chunks before its tokens mix with the next page's
+                yield from emit(final=True)
+                current_page = page_number
+            word_ids = encoding.word_ids(i)
+            for (start, end), word in zip(encoding['offset_mapping'][i], word_ids):
+                starts.append(offset + start)
+                ends.append(offset + end)
+                words.append(next_word + word)
+                token_pages.append(page_number)
+            # Word ids restart at 0 in every piece
+            next_word += max(word_ids, default=-1) + 1
+
+    def emit(final):
+        nonlocal pos, covered
+        # Until the last page, a window needs the token after it to tell whether it splits a word
+        while len(starts) - pos > chunk_size or (final and covered < len(starts)):
+            cut = min(pos + chunk_size, len(starts))
+            if cut < len(starts):
+                boundary = cut
+                while boundary > pos + 1 and words[boundary] == words[boundary - 1]:
+                    boundary -= 1
+                if words[boundary] != words[boundary - 1]:
+                    cut = boundary
+            yield starts[pos], ends[cut - 1], token_pages[pos]
+            covered = cut
+            if cut == len(starts):
+                pos = cut
+                break
+            following = max(cut - overlap, pos + 1)
+            while following < cut and words[following] == words[following - 1]:
+                following += 1
+            pos = following
+        if pos:
+            del starts[:pos], ends[:pos], words[:pos], token_pages[:pos]
+            covered -= pos
+            pos = 0
+
+    pieces = []
+    grouped = 0
+    offset = 0
+    for page_number, page in enumerate(pages):
+        pieces.extend(_tokenizer_pieces(page, offset, page_number))
+        offset += len(page) + 1
+        grouped += 1
+        if pages_per_call and grouped >= pages_per_call:
+            if pieces:
+                yield from tokenize(pieces)
+            pieces, grouped = [], 0
+            yield from emit(final=False)
+    if pieces:
+        yield from tokenize(pieces)
+    yield from emit(final=True)
+
+def iter_section_chunk_spans(sections, chunk_size=500, overlap=50, tokenizer=None, pages_per_call=None):
+    """
+    Chunk structural sections (see ingestion.iter_document_sections) so that
+    no chunk straddles a page or heading boundary.
+    Args:
+        sections (Iterable[Tuple[str, int, Tuple[str, ...]]]): (text, page, heading path) in order
+        chunk_size (int): Words per chunk, or tokens with a tokenizer
+        overlap (int): Overlap between chunks within a section
+        tokenizer: Chunk by this tokenizer's tokens instead of words
+        pages_per_call (int): Sections tokenized per call; None tokenizes them all in one call
+    Yields:
+        Tuple[int, int, int, Tuple[str, ...]]: (start, end, page, heading path) of each
+            chunk, with offsets into '\n'.join(section texts)
+    """
+    metadata = []
+
+    def texts():
+        for text, page, path in sections:
+            metadata.append((page, path))
+            yield text
+
+    if tokenizer is not None:
+        spans = iter_token_chunk_spans(texts(), tokenizer, chunk_size, overlap, pages_per_call, page_breaks=True)
+    else:
+        spans = iter_chunk_spans(texts(), chunk_size, overlap, page_breaks=True)
+    for start, end, section in spans:
+        page, path = metadata[section]
+        yield start, end, page, path
+
+class EncodedText:
+    """
+    A read-only UTF-8 text buffer, typically a region of a memory-mapped file.
+    Chunks address it by byte offsets, and slicing it decodes just those
+    bytes, so a table read from disk pages in only the chunks that are read.
+    """
+    __slots__ = ('data', 'offset', 'size')
+
+    def __init__(self, data, offset=0, size=None):
+        """
+        Args:
+            data: bytes or mmap.mmap holding the text
+            offset (int): Byte offset of this buffer in data
+            size (int): Bytes in this buffer (default: to the end of data)
+        """
+        self.data = data
+        self.offset = offset
+        self.size = len(data) - offset if size is None else size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        start, stop, _ = key.indices(self.size)
+        return self.data[self.offset + start:self.offset + stop].decode('utf-8')
+
+    def encode(self):
+        """The buffer's UTF-8 bytes."""
+        return self.data[self.offset:self.offset + self.size]
+
+def _byte_offsets(text, offsets):
+    """Map character offsets into text to UTF-8 byte offsets, in one pass over the text."""
+    mapping = {}
+    position = 0
+    byte = 0
+    for offset in sorted(set(offsets)):
+        byte += len(text[position:offset].encode('utf-8'))
+        position = offset
+        mapping[offset] = byte
+    return mapping
+
+class ChunkTable:
+    """
+    Compact chunk storage. Each chunk is a row of (buffer, start, end, page,
+    heading, doc) in typed arrays, pointing into a shared text buffer; the
+    chunk's string is only sliced out when it is read. Chunk IDs are row positions.
+    A chunk that stands in for collapsed near-duplicates (see dedup.py) also
+    lists where those duplicates were found.
+    """
+    __slots__ = ('buffers', 'doc_ids', '_doc_index', 'headings', '_heading_index',
+                 '_buffer', '_start', '_end', '_page', '_heading', '_doc', 'sources')
+
+    def __init__(self):
+        self.buffers = []       # Shared text buffers the rows point into
+        self.doc_ids = []       # Distinct doc_ids; the doc column indexes this list
+        self._doc_index = {}
+        self.headings = []      # Distinct heading paths; the heading column indexes this list
+        self._heading_index = {}
+        self._buffer = array('i')
+        self._start = array('q')
+        self._end = array('q')
+        self._page = array('i')  # -1 when the page is unknown
+        self._heading = array('i')
+        self._doc = array('i')
+        self.sources = {}       # chunk ID -> [(page, heading path)] of collapsed duplicates
+
+    @classmethod
+    def from_text(cls, text, chunk_size=500, overlap=50, tokenizer=None):
+        """
+        Chunk a whole text into a table over that single buffer.
+        With a tokenizer, chunk_size and overlap count its tokens instead of words.
+        """
+        table = cls()
+        if tokenizer is not None:
+            spans = iter_token_chunk_spans([text], tokenizer, chunk_size, overlap)
+        else:
+            spans = iter_chunk_spans([text], chunk_size, overlap)
+        table.add_buffer(text, spans)
+        return table
+
+    @classmethod
+    def from_sections(cls, sections, chunk_size=500, overlap=50, tokenizer=None):
+        """
+        Chunk structural sections into a table over one buffer joining their texts,
+        keeping each chunk's page and heading path.
+        """
+        sections = list(sections)
+        table = cls()
+        table.add_buffer('\n'.join(text for text, _, _ in sections),
+                         iter_section_chunk_spans(sections, chunk_size, overlap, tokenizer))
+        return table
+
+    @classmethod
+    def from_strings(cls, chunks):
+        """Build a table from already materialized chunk strings."""
+        table = cls()
+        table.add_strings(chunks)
+        return table
+
+    def __len__(self):
+        return len(self._start)
+
+    def __getitem__(self, chunk_id):
+        if isinstance(chunk_id, slice):
+            return [self[i] for i in range(*chunk_id.indices(len(self)))]
+        return self.buffers[self._buffer[chunk_id]][self._start[chunk_id]:self._end[chunk_id]]
+
+    def __iter__(self):
+        for chunk_id in range(len(self)):
+            yield self[chunk_id]
+
+    def __eq__(self, other):
+        try:
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        except TypeError:
+            return NotImplemented
+
+    __hash__ = None
+
+    def _columns(self):
+        return self._buffer, self._start, self._end, self._page, self._heading, self._doc
+
+    def write(self, directory):
+        """
+        Write the table to text.bin (every buffer as UTF-8, back to back) and
+        rows.bin (the row columns, with offsets in bytes) for ChunkTable.read.
+        Returns:
+            dict: JSON-serializable metadata that read needs alongside the files
+        """
+        start, end = array('q', self._start), array('q', self._end)
+        rows_of = {}
+        for row, number in enumerate(self._buffer):
+            rows_of.setdefault(number, []).append(row)
+        sizes = []
+        with open(os.path.join(directory, 'text.bin'), 'wb') as f:
+            for number, buffer in enumerate(self.buffers):
+                if isinstance(buffer, EncodedText):
+                    data = buffer.encode()
+                else:
+                    data = buffer.encode('utf-8')
+                if len(data) != len(buffer):
+                    # Non-ASCII text: character offsets become byte offsets
+                    rows = rows_of.get(number, [])
+                    to_bytes = _byte_offsets(buffer, [self._start[r] for r in rows] + [self._end[r] for r in rows])
+                    for r in rows:
+                        start[r] = to_bytes[self._start[r]]
+                        end[r] = to_bytes[self._end[r]]
+                f.write(data)
+                sizes.append(len(data))
+        with open(os.path.join(directory, 'rows.bin'), 'wb') as f:
+            for column in (self._buffer, start, end, self._page, self._heading, self._doc):
+                column.tofile(f)
+        return {'rows': len(self), 'byteorder': sys.byteorder, 'buffers': sizes, 'doc_ids': self.doc_ids,
+                'headings': self.headings,
+                'sources': {str(i): locations for i, locations in self.sources.items()}}
+
+    @classmethod
+    def read(cls, directory, meta, mmap_text=True):
+        """
+        Read a table written by write(). Buffers become EncodedText views of
+        text.bin, memory-mapped with mmap_text=True (pages load as chunks are
+        read) or read into memory otherwise. Rows added later get ordinary
+        str buffers as usual.
+        Args:
+            directory (str): Directory holding text.bin and rows.bin
+            meta (dict): What write() returned
+        """
+        table = cls()
+        with open(os.path.join(directory, 'rows.bin'), 'rb') as f:
+            for column in table._columns():
+                column.fromfile(f, meta['rows'])
+                if meta['byteorder'] != sys.byteorder:
+                    column.byteswap()
+        with open(os.path.join(directory, 'text.bin'), 'rb') as f:
+            if mmap_text and sum(meta['buffers']):
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                data = f.read()
+        offset = 0
+        for size in meta['buffers']:
+            table.buffers.append(EncodedText(data, offset, size))
+            offset += size
+        for doc_id in meta['doc_ids']:
+            table._doc_number(doc_id)
+        for path in meta['headings']:
+            table._heading_number(path)
+        for chunk_id, locations in meta['sources'].items():
+            table.add_sources(int(chunk_id), locations)
+        return table
+
+    def _doc_number(self, doc_id):
+        number = self._doc_index.get(doc_id)
+        if number is None:
+            number = self._doc_index[doc_id] = len(self.doc_ids)
+            self.doc_ids.append(doc_id)
+        return number
+
+    def _heading_number(self, path):
+        path = tuple(path)
+        number = self._heading_index.get(path)
+        if number is None:
+            number = self._heading_index[path] = len(self.headings)
+            self.headings.append(path)
+        return number
+
+    def add_buffer(self, buffer, spans, doc_id=None):
+        """
+        Add chunks that are (start, end, page) or (start, end, page, heading path)
+        spans of one text buffer.
+        Returns:
+            range: IDs of the added chunks
+        """
+        first = len(self)
+        number = len(self.buffers)
+        doc = self._doc_number(doc_id)
+        for start, end, page, *path in spans:
+            self._buffer.append(number)
+            self._start.append(start)
+            self._end.append(end)
+            self._page.append(-1 if page is None else page)
+            self._heading.append(self._heading_number(path[0] if path else ()))
+            self._doc.append(doc)
+        if len(self) > first:
+            self.buffers.append(buffer)
+        return range(first, len(self))
+
+    def add_strings(self, chunks, doc_id=None, pages=None, headings=None):
+        """
+        Add materialized chunk strings, packed into one new buffer, with
+        optional per-chunk pages and heading paths.
+        Returns:
+            range: IDs of the added chunks
+        """
+        spans = []
+        offset = 0
+        for i, chunk in enumerate(chunks):
+            spans.append((offset, offset + len(chunk), pages[i] if pages else None,
+                          headings[i] if headings else ()))
+            offset += len(chunk) + 1
+        return self.add_buffer('\n'.join(chunks), spans, doc_id)
+
+    def extend(self, chunks, doc_id=None):
+        """
+        Append another table's rows, or a list of strings, under doc_id.
+        Buffers are shared with the other table, not copied.
+        Returns:
+            range: IDs of the added chunks
+        """
+        if not isinstance(chunks, ChunkTable):
+            return self.add_strings(list(chunks), doc_id)
+        first = len(self)
+        base = len(self.buffers)
+        self.buffers.extend(chunks.buffers)
+        self._buffer.extend(base + b for b in chunks._buffer)
+        self._start.extend(chunks._start)
+        self._end.extend(chunks._end)
+        self._page.extend(chunks._page)
+        self._heading.extend(self._heading_number(chunks.headings[h]) for h in chunks._heading)
+        doc = self._doc_number(doc_id)
+        self._doc.extend(array('i', [doc]) * len(chunks))
+        for chunk_id, locations in chunks.sources.items():
+            self.sources[first + chunk_id] = list(locations)
+        return range(first, len(self))
+
+    def location(self, chunk_id):
+        """
+        Returns:
+            Tuple[int, int, int, str]: (start, end, page, doc_id) of a chunk; page is -1 if unknown
+        """
+        return (self._start[chunk_id], self._end[chunk_id], self._page[chunk_id],
+                self.doc_ids[self._doc[chunk_id]])
+
+    def doc_id(self, chunk_id):
+        return self.doc_ids[self._doc[chunk_id]]
+
+    def page(self, chunk_id):
+        """Page the chunk starts on (counting from 0), or None if unknown."""
+        page = self._page[chunk_id]
+        return None if page < 0 else page
+
+    def heading(self, chunk_id):
+        """Heading path of the section the chunk is in, outermost first."""
+        return self.headings[self._heading[chunk_id]]
+
+    def add_sources(self, chunk_id, locations):
+        """Record (page, heading path) locations of duplicates collapsed into a chunk."""
+        self.sources.setdefault(chunk_id, []).extend(
+            (page, tuple(path)) for page, path in locations
+        )
+
+    def locations(self, chunk_id):
+        """
+        Every place the chunk's text occurs: its own (page, heading path) first,
+        then those of the near-duplicates collapsed into it.
+        """
+        return [(self.page(chunk_id), self.heading(chunk_id))] + self.sources.get(chunk_id, [])
+
+    def rows(self, doc_id):
+        """IDs of every chunk of a document."""
+        number = self._doc_index.get(doc_id)
+        if number is None:
+            return []
+        return [i for i, d in enumerate(self._doc) if d == number]
+
+    def filter_rows(self, doc_id=None, pages=None, heading=None):
+        """
+        IDs of the chunks matching every given metadata filter.
+        Args:
+            doc_id (str): Only chunks of this document
+            pages (Iterable[int]): Only chunks starting on one of these pages (from 0)
+            heading (str): Only chunks under a heading containing this text (case-insensitive)
+        Returns:
+            np.ndarray: Matching chunk IDs (int64), in order
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if doc_id is not None:
+            mask &= np.frombuffer(self._doc, dtype=np.int32) == self._doc_index.get(doc_id, -1)
+        if pages is not None:
+            mask &= np.isin(np.frombuffer(self._page, dtype=np.int32), list(pages))
+        if heading is not None:
+            # Match the few distinct heading paths first, then the column against them
+            needle = heading.casefold()
+            matching = [number for number, path in enumerate(self.headings)
+                        if any(needle in title.casefold() for title in path)]
+            mask &= np.isin(np.frombuffer(self._heading, dtype=np.int32), matching)
+        return np.flatnonzero(mask).astype(np.int64)
+
+    def take(self, chunk_ids):
+        """
+        Return a new table holding only the given rows, in order.
+        Buffers no longer referenced by any row are dropped.
+        """
+        table = ChunkTable()
+        remap = {}
+        for i in chunk_ids:
+            if i in self.sources:
+                table.sources[len(table)] = list(self.sources[i])
+            buffer = self._buffer[i]
+            if buffer not in remap:
+                remap[buffer] = len(table.buffers)
+                table.buffers.append(self.buffers[buffer])
+            table._buffer.append(remap[buffer])
+            table._start.append(self._start[i])
+            table._end.append(self._end[i])
+            table._page.append(self._page[i])
+            table._heading.append(table._heading_number(self.headings[self._heading[i]]))
+            table._doc.append(table._doc_number(self.doc_ids[self._doc[i]]))
+        return table
@@ -0,0 +1,148 @@
+"""
+Near-duplicate chunk elimination.
+MinHash signatures over word shingles, bucketed with LSH, find chunks that
+repeat earlier ones (page headers and footers, disclaimers, copied
+sections) so each is embedded and indexed once.
+"""
+
+import os
+import zlib
+import numpy as np
+
+# Estimated Jaccard similarity of word shingles above which chunks are collapsed
+DEDUP_THRESHOLD = float(os.getenv('DOCUMIND_DEDUP_THRESHOLD', '0.9'))
+SHINGLE_WORDS = 3
+NUM_PERM = 128
+
+_PRIME = (1 << 31) - 1
+
+def _lsh_shape(num_perm, threshold):
+    """
+    Split num_perm signature values into bands of rows so that the LSH
+    S-curve, which rises around (1 / bands) ** (1 / rows), is closest to threshold.
+    Returns:
+        Tuple[int, int]: (bands, rows)
+    """
+    shapes = [(bands, num_perm // bands) for bands in range(1, num_perm + 1) if num_perm % bands == 0]
+    return min(shapes, key=lambda shape: abs((1 / shape[0]) ** (1 / shape[1]) - threshold))
+
+class NearDuplicateIndex:
+    def __init__(self, threshold=DEDUP_THRESHOLD, num_perm=NUM_PERM, seed=1, max_items=None):
+        """
+        LSH index of MinHash signatures.
+        Args:
+            threshold (float): Minimum estimated Jaccard similarity of a near-duplicate
+            num_perm (int): Hash functions per signature
+            seed (int): Seed of the hash functions, so signatures are reproducible
+            max_items (int): Keep only the most recently added items, so memory stays
+                bounded; older ones are no longer found. None keeps every item
+        """
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _PRIME, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _PRIME, num_perm, dtype=np.uint64)
+        self.threshold = threshold
+        self.max_items = max_items
+        self.bands, self.rows = _lsh_shape(num_perm, threshold)
+        self._buckets = [{} for _ in range(self.bands)]
+        # (key, signature) by item number, in the order added
+        self._items = {}
+        self._added = 0
+
+    def __len__(self):
+        """Items added so far, including any dropped past max_items."""
+        return self._added
+
+    def signature(self, text):
+        """
+        MinHash signature of the text's lower-cased word shingles.
+        Returns:
+            np.ndarray: num_perm uint64 values
+        """
+        words = text.lower().split()
+        shingles = {' '.join(words[i:i + SHINGLE_WORDS])
+                    for i in range(max(1, len(words) - SHINGLE_WORDS + 1))}
+        hashes = np.fromiter((zlib.crc32(shingle.encode('utf-8')) % _PRIME for shingle in shingles),
+                             dtype=np.uint64, count=len(shingles))
+        # (a * h + b) mod p stays below 2**63 for 31-bit a, b and h
+        return ((np.outer(hashes, self._a) + self._b) % _PRIME).min(axis=0)
+
+    def _band_keys(self, signature):
+        for band in range(self.bands):
+            yield signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def query(self, signature):
+        """
+        Key of the most similar indexed item at or above the threshold, or None.
+        Only items sharing at least one LSH band with the signature are compared.
+        """
+        candidates = set()
+        for buckets, band_key in zip(self._buckets, self._band_keys(signature)):
+            candidates.update(buckets.get(band_key, ()))
+        best, best_score = None, self.threshold
+        for item in sorted(candidates):
+            score = float(np.mean(self._items[item][1] == signature))
+            if score >= best_score and (best is None or score > best_score):
+                best, best_score = item, score
+        return None if best is None else self._items[best][0]
+
+    def add(self, key, signature):
+        """Index a signature under key, dropping the oldest item past max_items."""
+        item = self._added
+        self._added += 1
+        self._items[item] = (key, signature)
+        for buckets, band_key in zip(self._buckets, self._band_keys(signature)):
+            buckets.setdefault(band_key, []).append(item)
+        if self.max_items is not None and len(self._items) > self.max_items:
+            oldest = item - self.max_items
+            _, old_signature = self._items.pop(oldest)
+            for buckets, band_key in zip(self._buckets, self._band_keys(old_signature)):
+                # Items are appended in order, so the oldest leads its bucket
+                bucket = buckets[band_key]
+                del bucket[0]
+                if not bucket:
+                    del buckets[band_key]
+
+def find_near_duplicates(table, index=None, threshold=DEDUP_THRESHOLD):
+    """
+    Find the chunks that near-duplicate an earlier kept chunk, without building
+    a new table (e.g. to pick the matching rows of an embedding array too).
+    Args:
+        table (ChunkTable): Chunks in document order
+        index (NearDuplicateIndex): Chunks kept so far; a new one when None
+        threshold (float): Similarity threshold for a new index
+    Returns:
+        Tuple[List[int], Dict[int, List[Tuple[int, Tuple[str, ...]]]]]: (rows kept,
+            (page, heading path) of the duplicates collapsed into each kept chunk, by position)
+    """
+    if index is None:
+        index = NearDuplicateIndex(threshold)
+    keep = []
+    duplicates = {}
+    for i in range(len(table)):
+        signature = index.signature(table[i])
+        original = index.query(signature)
+        if original is None:
+            index.add(len(index), signature)
+            keep.append(i)
+        else:
+            duplicates.setdefault(original, []).append((table.page(i), table.heading(i)))
+    return keep, duplicates
+
+def collapse_near_duplicates(table, index=None, threshold=DEDUP_THRESHOLD):
+    """
+    Drop chunks that near-duplicate an earlier kept chunk.
+    Pass the same index to successive calls to also catch duplicates of
+    chunks from earlier batches of the same document. Kept chunks are
+    keyed by their position among all chunks kept through that index.
+    Args:
+        table (ChunkTable): Chunks in document order
+        index (NearDuplicateIndex): Chunks kept so far; a new one when None
+        threshold (float): Similarity threshold for a new index
+    Returns:
+        Tuple[ChunkTable, Dict[int, List[Tuple[int, Tuple[str, ...]]]]]: (kept chunks,
+            (page, heading path) of the duplicates collapsed into each kept chunk, by position)
+    """
+    keep, duplicates = find_near_duplicates(table, index, threshold)
+    if len(keep) == len(table):
+        return table, duplicates
+    return table.take(keep), duplicates
@@ -0,0 +1,119 @@
+"""
+Document cache module.
+Content-addressed on-disk cache of parsed text, chunks and embeddings,
+so re-uploading an identical file skips parsing, chunking and embedding.
+"""
+
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import numpy as np
+from chunking import ChunkTable
+from rechunk import SentenceVectors
+
+DEFAULT_CACHE_DIR = os.getenv(
+    'DOCUMIND_CACHE_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'documind', 'documents')
+)
+DEFAULT_MAX_BYTES = int(os.getenv('DOCUMIND_CACHE_MAX_MB', '1024')) * 1024 * 1024
+
+class DocumentCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Initialize the cache directory.
+        Args:
+            cache_dir (str): Directory holding one sub-directory per cached document
+            max_bytes (int): Size cap; least recently used entries are evicted past it
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key):
+        """
+        Look up a document by key (see utils.document_id).
+        Returns:
+            Tuple[str, ChunkTable, np.ndarray, SentenceVectors] or None: (text, chunks,
+                float32 embeddings, sentence vectors or None when none were stored)
+        """
+        entry = self._entry_dir(key)
+        try:
+            with open(os.path.join(entry, 'text.txt'), encoding='utf-8') as f:
+                text = f.read()
+            with open(os.path.join(entry, 'chunks.json'), encoding='utf-8') as f:
+                data = json.load(f)
+            chunks = ChunkTable()
+            chunks.add_strings(data['chunks'], pages=data['pages'], headings=data['headings'])
+            for chunk_id, locations in data['sources'].items():
+                chunks.add_sources(int(chunk_id), locations)
+            embeddings = np.load(os.path.join(entry, 'embeddings.npy'))
+            sentence_vectors = None
+            if os.path.exists(os.path.join(entry, 'sentence_vectors.npy')):
+                sentence_vectors = SentenceVectors.load(entry, text)
+        except (OSError, ValueError, KeyError):
+            return None
+        # Touch the entry so eviction sees it as recently used
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        return text, chunks, embeddings, sentence_vectors
+
+    def put(self, key, text, chunks, embeddings, sentence_vectors=None):
+        """
+        Store a processed document (chunks is a ChunkTable) under key and evict
+        old entries past the size cap. sentence_vectors (see rechunk.SentenceVectors) must be over the same text.
+        """
+        entry = self._entry_dir(key)
+        if os.path.isdir(entry):
+            return
+        # Write into a temporary directory and rename, so readers never see a partial entry
+        tmp = tempfile.mkdtemp(prefix='.tmp-', dir=self.cache_dir)
+        try:
+            with open(os.path.join(tmp, 'text.txt'), 'w', encoding='utf-8') as f:
+                f.write(text)
+            with open(os.path.join(tmp, 'chunks.json'), 'w', encoding='utf-8') as f:
+                json.dump({
+                    'chunks': list(chunks),
+                    'pages': [chunks.page(i) for i in range(len(chunks))],
+                    'headings': [chunks.heading(i) for i in range(len(chunks))],
+                    'sources': {str(i): locations for i, locations in chunks.sources.items()},
+                }, f)
+            np.save(os.path.join(tmp, 'embeddings.npy'), np.asarray(embeddings, dtype='float32'))
+            if sentence_vectors is not None:
+                sentence_vectors.save(tmp)
+            os.rename(tmp, entry)
+        except OSError:
+            # Another process stored the same key first, or the disk is full
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        self._evict()
+
+    def _evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        with self._lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.cache_dir):
+                path = os.path.join(self.cache_dir, name)
+                if name.startswith('.tmp-') or not os.path.isdir(path):
+                    continue
+                try:
+                    size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                    entries.append((os.path.getmtime(path), size, path))
+                except OSError:
+                    continue
+                total += size
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
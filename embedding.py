@@ -1,31 +1,278 @@
 """
 Embedding module.
 Handles embedding generation for text chunks and queries.
+The model is loaded on first use, not at import, so importing this module
+(and everything that imports it) never waits for torch.
 """
 
 
-from sentence_transformers import SentenceTransformer
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+from embedding_cache import get_embedding_cache, query_cache
+from embedding_engine import encode
 
-# Load the model once (you can change the model name as needed)
-_model = SentenceTransformer('all-MiniLM-L6-v2')
+# Embedding model (you can change the model name as needed)
+MODEL_NAME = 'all-MiniLM-L6-v2'
 
-def embed_chunks(chunks):
+# Token window of MODEL_NAME and the special tokens it adds, so chunk sizes
+# can be offered before the model has loaded (see max_chunk_tokens)
+MODEL_MAX_SEQ_LENGTH = 256
+MODEL_SPECIAL_TOKENS = 2
+
+# 'torch' runs MODEL_NAME with sentence-transformers; 'onnx' runs its int8
+# ONNX Runtime export (see onnx_backend.py)
+EMBEDDING_BACKEND = os.getenv('DOCUMIND_EMBEDDING_BACKEND', 'torch')
+# Caches are keyed by this, so vectors from the two backends never mix
+MODEL_ID = MODEL_NAME if EMBEDDING_BACKEND == 'torch' else f"{MODEL_NAME}@{EMBEDDING_BACKEND}-int8"
+
+# Whether the app starts loading the model in the background at startup
+WARMUP_AT_STARTUP = os.getenv('DOCUMIND_WARMUP_MODEL', '1') != '0'
+
+# Queries from every session are embedded together in micro-batches of up to
+# QUERY_MAX_BATCH, collected for at most QUERY_BATCH_WAIT_MS (see QueryBatcher)
+QUERY_BATCHING = os.getenv('DOCUMIND_QUERY_BATCHING', '1') != '0'
+QUERY_MAX_BATCH = int(os.getenv('DOCUMIND_QUERY_MAX_BATCH', '64'))
+QUERY_BATCH_WAIT_MS = float(os.getenv('DOCUMIND_QUERY_BATCH_WAIT_MS', '2'))
+
+_model = None
+_model_lock = threading.Lock()
+_warmup_thread = None
+_warmup_lock = threading.Lock()
+
+def get_model():
+    """
+    The process-wide SentenceTransformer (or, with DOCUMIND_EMBEDDING_BACKEND=onnx,
+    its ONNX Runtime equivalent), loaded on first call.
+    Safe to call from several threads at once; the model is loaded only once.
+    Raises:
+        ValueError: If DOCUMIND_EMBEDDING_BACKEND is not 'torch' or 'onnx'
+    """
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                if EMBEDDING_BACKEND == 'onnx':
+                    from onnx_backend import load_onnx_model
+                    _model = load_onnx_model(MODEL_NAME)
+                elif EMBEDDING_BACKEND == 'torch':
+                    from sentence_transformers import SentenceTransformer
+                    _model = SentenceTransformer(MODEL_NAME)
+                else:
+                    raise ValueError(f"Unknown embedding backend: {EMBEDDING_BACKEND}")
+    return _model
+
+def model_loaded():
+    """True once the model is in memory, so embedding calls will not block on loading it."""
+    return _model is not None
+
+def warmup(background=True, queries=()):
+    """
+    Load the model ahead of the first embedding call, then embed and pin
+    queries in the query cache so they never reach the model again.
+    With background=True this runs on a daemon thread and returns at once;
+    calling it again once the model is loaded and the queries are cached,
+    or while that thread runs, is a no-op. A failed background load is
+    retried (and raises) on the next embedding call.
+    Returns:
+        threading.Thread: The loading thread, or None if nothing was started
+    """
+    global _warmup_thread
+    queries = [query for query in queries if not query_cache.has(MODEL_ID, query, pinned=True)]
+    if _model is not None and not queries:
+        return None
+    if not background:
+        _warmup(queries)
+        return None
+    with _warmup_lock:
+        if _warmup_thread is not None and _warmup_thread.is_alive():
+            return None
+        _warmup_thread = threading.Thread(target=_warmup_in_background, args=(queries,),
+                                          name='embedding-warmup', daemon=True)
+        _warmup_thread.start()
+        return _warmup_thread
+
+def _warmup(queries):
+    model = get_model()
+    if queries:
+        for query, vector in zip(queries, model.encode(list(queries))):
+            query_cache.put(MODEL_ID, query, vector, pin=True)
+
+def _warmup_in_background(queries):
+    try:
+        _warmup(queries)
+    except Exception:
+        pass
+
+def get_tokenizer():
+    """
+    The embedding model's fast tokenizer, for chunking by model tokens.
+    """
+    return get_model().tokenizer
+
+def load_tokenizer():
+    """
+    MODEL_NAME's fast tokenizer on its own, for processes that only chunk
+    and never embed; unlike get_tokenizer it does not load the model.
+    """
+    from transformers import AutoTokenizer
+
+    name = MODEL_NAME
+    if '/' not in name and not os.path.isdir(name):
+        # sentence-transformers looks bare model names up under its own organization
+        name = f"sentence-transformers/{name}"
+    return AutoTokenizer.from_pretrained(name)
+
+def max_chunk_tokens(load=True):
+    """
+    Largest chunk, in tokens, the model embeds without truncation
+    (its max sequence length minus the special tokens it adds).
+    With load=False and the model not loaded yet, the configured window
+    of MODEL_NAME is returned instead of waiting for the model.
+    """
+    if _model is None and not load:
+        return MODEL_MAX_SEQ_LENGTH - MODEL_SPECIAL_TOKENS
+    model = get_model()
+    return model.max_seq_length - model.tokenizer.num_special_tokens_to_add()
+
+class QueryBatcher:
+    def __init__(self, max_batch=QUERY_MAX_BATCH, max_wait=QUERY_BATCH_WAIT_MS / 1000):
+        """
+        Shared service that embeds queries from many threads in one forward pass.
+        submit() queues a query and returns a future; a single worker thread
+        takes the first waiting query, keeps collecting until max_batch queries
+        or max_wait seconds, embeds them together (identical queries once) and
+        resolves the futures. Queries that arrive while a batch is running
+        wait for the next one, so batches grow with load.
+        Args:
+            max_batch (int): Most queries in one forward pass
+            max_wait (float): Seconds to wait for more queries after the first
+        """
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+        self.max_batch_size = 0
+        self.max_queue_depth = 0
+
+    def submit(self, query):
+        """
+        Queue a query for embedding.
+        Returns:
+            concurrent.futures.Future: Resolves to the float32 embedding
+        """
+        future = Future()
+        self._queue.put((query, future))
+        with self._lock:
+            self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='query-batcher', daemon=True)
+                self._thread.start()
+        return future
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                remaining = deadline - time.monotonic()
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            texts = list(dict.fromkeys(query for query, _ in batch))
+            try:
+                vectors = get_model().encode(texts, batch_size=len(texts), show_progress_bar=False)
+                vectors = dict(zip(texts, np.asarray(vectors, dtype=np.float32)))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for query, future in batch:
+                    future.set_result(vectors[query])
+            with self._lock:
+                self.batches += 1
+                self.requests += len(batch)
+                self.max_batch_size = max(self.max_batch_size, len(batch))
+
+    def stats(self):
+        """
+        Returns:
+            dict: 'queue_depth' (queries waiting now), 'max_queue_depth', 'batches',
+                'requests', 'mean_batch_size' and 'max_batch_size'
+        """
+        with self._lock:
+            return {'queue_depth': self._queue.qsize(), 'max_queue_depth': self.max_queue_depth,
+                    'batches': self.batches, 'requests': self.requests,
+                    'mean_batch_size': self.requests / self.batches if self.batches else 0.0,
+                    'max_batch_size': self.max_batch_size}
+
+# Shared by every Streamlit session in the process
+query_batcher = QueryBatcher()
+
+def embed_chunks(chunks, processes=None, as_list=False):
     """
     Generate embeddings for a list of text chunks.
+    Chunks already in the persistent embedding cache (see embedding_cache.py)
+    are read from it; only the misses are sent to the model, in length-sorted
+    batches and, for large batches, across processes (see embedding_engine.py).
     Args:
         chunks (List[str]): List of text chunks
+        processes (int): Embedding processes (defaults to DOCUMIND_EMBED_PROCESSES)
+        as_list (bool): Return nested lists of floats instead of an array, for older callers
     Returns:
-        List[List[float]]: List of embeddings
+        np.ndarray: Contiguous float32 embeddings, one row per chunk
     """
-    return _model.encode(chunks, show_progress_bar=False).tolist()
+    chunks = list(chunks)
+    cache = get_embedding_cache(MODEL_ID)
+    vectors = cache.get_many(chunks) if cache is not None else [None] * len(chunks)
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if len(missing) == len(chunks):
+        # Nothing cached: the engine's array is returned as is
+        embeddings = encode(get_model(), chunks, processes)
+        if cache is not None and chunks:
+            cache.put_many(chunks, embeddings)
+    else:
+        dimension = len(next(vector for vector in vectors if vector is not None))
+        embeddings = np.empty((len(chunks), dimension), dtype=np.float32)
+        for i, vector in enumerate(vectors):
+            if vector is not None:
+                embeddings[i] = vector
+        if missing:
+            texts = [chunks[i] for i in missing]
+            computed = encode(get_model(), texts, processes)
+            cache.put_many(texts, computed)
+            embeddings[missing] = computed
+    return embeddings.tolist() if as_list else embeddings
 
 
-def embed_query(query):
+def embed_query(query, as_list=False):
     """
     Generate embedding for a user query.
+    Repeated queries are served from the process-wide query cache
+    (see embedding_cache.QueryEmbeddingCache); the rest are embedded
+    together with concurrent queries from other sessions by query_batcher.
     Args:
         query (str): User's question
+        as_list (bool): Return a list of floats instead of an array, for older callers
     Returns:
-        List[float]: Query embedding
+        np.ndarray: Read-only float32 query embedding, shared with the cache
     """
-    return _model.encode([query])[0].tolist()
+    vector = query_cache.get(MODEL_ID, query)
+    if vector is None:
+        if QUERY_BATCHING:
+            vector = query_batcher.submit(query).result()
+        else:
+            vector = get_model().encode([query])[0]
+        vector = query_cache.put(MODEL_ID, query, vector)
+    return vector.tolist() if as_list else vector
@@ -0,0 +1,368 @@
+"""
+Embedding cache module.
+Persistent cache of chunk embeddings keyed by (model name, hash of the
+whitespace-normalized chunk text), so re-embedding a revised document only
+computes the chunks that changed, and an in-process LRU of query embeddings
+shared by every session.
+"""
+
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, one writer at a time is assumed
+    fcntl = None
+
+DEFAULT_CACHE_DIR = os.getenv(
+    'DOCUMIND_EMBEDDING_CACHE_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'documind', 'embeddings')
+)
+DEFAULT_MAX_BYTES = int(os.getenv('DOCUMIND_EMBEDDING_CACHE_MB', '512')) * 1024 * 1024
+EMBEDDING_CACHE_ENABLED = os.getenv('DOCUMIND_EMBEDDING_CACHE', '1') != '0'
+QUERY_CACHE_SIZE = int(os.getenv('DOCUMIND_QUERY_CACHE_SIZE', '1024'))
+# Seconds a cached query embedding stays valid; 0 keeps it until evicted
+QUERY_CACHE_TTL = float(os.getenv('DOCUMIND_QUERY_CACHE_TTL', '0'))
+
+# Version of the on-disk layout
+CACHE_VERSION = 1
+KEY_BYTES = 16
+# Fraction of max_bytes kept, most recently used first, when the cache is compacted
+EVICT_TO = 0.75
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def chunk_key(text):
+    """Hash of a chunk's text with whitespace runs collapsed."""
+    return hashlib.blake2b(' '.join(text.split()).encode('utf-8'), digest_size=KEY_BYTES).digest()
+
+class EmbeddingCache:
+    def __init__(self, model_name, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Open (or create) the cache of one model's embeddings.
+        The directory holds vectors.f32, an append-only file of float32 rows,
+        and keys.bin, the chunk key of each row in the same order. Rows are
+        read through a memory map; nothing but the key index is held in memory.
+        Several processes may share the cache: every read and write holds a
+        file lock beside the directory, and picks up rows other processes
+        appended (or reopens the cache after another process compacted it).
+        Args:
+            model_name (str): Embedding model the vectors come from
+            cache_dir (str): Directory holding one sub-directory per model
+            max_bytes (int): Size cap; least recently used rows are evicted past it
+        """
+        self.model_name = model_name
+        self.path = os.path.join(cache_dir, re.sub(r'[^\w.-]', '_', model_name))
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+        # Outside the directory, which _evict swaps for a compacted copy
+        self._lock_file = open(self.path + '.lock', 'a+b')
+        with self._locked(exclusive=True):
+            self._open()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    @contextmanager
+    def _locked(self, exclusive=False):
+        """Hold the thread lock and the cross-process file lock (shared for reads)."""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _identity(self):
+        """Generation of the files, a token that changes when the cache is compacted or recreated."""
+        try:
+            with open(self._file('meta.json'), encoding='utf-8') as f:
+                return json.load(f).get('generation')
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, directory):
+        with open(os.path.join(directory, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'version': CACHE_VERSION, 'model': self.model_name, 'dim': self.dim,
+                       'generation': os.urandom(8).hex()}, f)
+
+    def _open(self):
+        """Read the key index and drop rows left half-written by a crash."""
+        self.dim = None
+        self._rows = {}
+        self._last_used = []
+        self._clock = 0
+        self._mapped = None
+        self._opened = None
+        try:
+            with open(self._file('meta.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('version') != CACHE_VERSION or meta.get('model') != self.model_name:
+                raise ValueError(f"Incompatible embedding cache in {self.path}")
+            self.dim = meta['dim']
+            with open(self._file('keys.bin'), 'rb') as f:
+                keys = f.read()
+            rows = min(len(keys) // KEY_BYTES, os.path.getsize(self._file('vectors.f32')) // (4 * self.dim))
+        except (OSError, ValueError, KeyError):
+            # Missing or unreadable: start over
+            self.dim = None
+            for name in ('meta.json', 'keys.bin', 'vectors.f32'):
+                if os.path.exists(self._file(name)):
+                    os.remove(self._file(name))
+            return
+        self._truncate(rows)
+        self._opened = meta.get('generation')
+        # Until rows are used, older rows count as less recently used
+        self._rows = {keys[row * KEY_BYTES:(row + 1) * KEY_BYTES]: row for row in range(rows)}
+        self._last_used = list(range(rows))
+        self._clock = rows
+
+    def _truncate(self, rows):
+        """Cut both files to rows, dropping a torn append."""
+        for name, size in (('keys.bin', rows * KEY_BYTES), ('vectors.f32', rows * 4 * self.dim)):
+            if os.path.getsize(self._file(name)) > size:
+                with open(self._file(name), 'r+b') as f:
+                    f.truncate(size)
+
+    def _sync(self):
+        """
+        Catch up with other processes; call with the file lock held.
+        Keys they appended are added to the index; if the files were
+        replaced (compacted or recreated), the cache is reopened.
+        """
+        if self._identity() != self._opened:
+            self._open()
+            return
+        if self.dim is None:
+            return
+        rows = min(os.path.getsize(self._file('keys.bin')) // KEY_BYTES,
+                   os.path.getsize(self._file('vectors.f32')) // (4 * self.dim))
+        if rows <= len(self):
+            return
+        with open(self._file('keys.bin'), 'rb') as f:
+            f.seek(len(self) * KEY_BYTES)
+            keys = f.read((rows - len(self)) * KEY_BYTES)
+        for i in range(len(keys) // KEY_BYTES):
+            self._rows.setdefault(keys[i * KEY_BYTES:(i + 1) * KEY_BYTES], len(self))
+            self._clock += 1
+            self._last_used.append(self._clock)
+
+    def __len__(self):
+        return len(self._last_used)
+
+    def _vectors(self):
+        """Memory map of every row, re-mapped after appends."""
+        if self._mapped is None or len(self._mapped) < len(self):
+            self._mapped = np.memmap(self._file('vectors.f32'), dtype=np.float32, mode='r',
+                                     shape=(len(self), self.dim))
+        return self._mapped
+
+    def get_many(self, texts):
+        """
+        Look up the embedding of each text.
+        Returns:
+            List[np.ndarray]: float32 vector per text, or None where it is not cached
+        """
+        keys = [chunk_key(text) for text in texts]
+        with self._locked():
+            self._sync()
+            rows = [self._rows.get(key) for key in keys]
+            found = [row for row in rows if row is not None]
+            self.hits += len(found)
+            self.misses += len(rows) - len(found)
+            if not found:
+                return [None] * len(rows)
+            vectors = np.array(self._vectors()[found])
+            for row in found:
+                self._clock += 1
+                self._last_used[row] = self._clock
+        found = iter(vectors)
+        return [None if row is None else next(found) for row in rows]
+
+    def put_many(self, texts, vectors):
+        """
+        Append embeddings for texts that are not cached yet, evicting past max_bytes.
+        Row numbers come from the files as they are under the lock, so
+        appends from several processes never overlap.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._locked(exclusive=True):
+            self._sync()
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                for name in ('keys.bin', 'vectors.f32'):
+                    open(self._file(name), 'wb').close()
+                self._write_meta(self.path)
+                self._opened = self._identity()
+            else:
+                # Rows a crashed writer left half-written would shift every row appended after them
+                self._truncate(len(self))
+            new_keys, new_rows = [], []
+            for i, text in enumerate(texts):
+                key = chunk_key(text)
+                if key not in self._rows:
+                    self._rows[key] = len(self) + len(new_keys)
+                    new_keys.append(key)
+                    new_rows.append(i)
+            if not new_keys:
+                return
+            # Vectors first: a crash between the writes leaves extra rows without keys, dropped on open
+            with open(self._file('vectors.f32'), 'ab') as f:
+                f.write(vectors[new_rows].tobytes())
+            with open(self._file('keys.bin'), 'ab') as f:
+                f.write(b''.join(new_keys))
+            for _ in new_keys:
+                self._clock += 1
+                self._last_used.append(self._clock)
+            if len(self) * (4 * self.dim + KEY_BYTES) > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """
+        Rewrite the cache with only the most recently used rows that fit in
+        EVICT_TO of max_bytes; call with the exclusive file lock held.
+        """
+        keep_count = int(self.max_bytes * EVICT_TO) // (4 * self.dim + KEY_BYTES)
+        keep = np.sort(np.argsort(np.asarray(self._last_used))[len(self) - keep_count:])
+        with open(self._file('keys.bin'), 'rb') as f:
+            data = f.read(len(self) * KEY_BYTES)
+        keys = {row: data[row * KEY_BYTES:(row + 1) * KEY_BYTES] for row in keep.tolist()}
+        # Write the compacted copy beside the cache and swap directories, so a crash leaves one intact
+        tmp = self.path + '.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        self._vectors()[keep].tofile(os.path.join(tmp, 'vectors.f32'))
+        with open(os.path.join(tmp, 'keys.bin'), 'wb') as f:
+            f.write(b''.join(keys[row] for row in keep.tolist()))
+        self._write_meta(tmp)
+        self._mapped = None
+        old = self.path + '.old'
+        shutil.rmtree(old, ignore_errors=True)
+        os.rename(self.path, old)
+        os.rename(tmp, self.path)
+        shutil.rmtree(old, ignore_errors=True)
+        last_used = self._last_used
+        self._rows = {}
+        for i, row in enumerate(keep.tolist()):
+            self._rows.setdefault(keys[row], i)
+        self._last_used = [last_used[row] for row in keep.tolist()]
+        self._opened = self._identity()
+
+def get_embedding_cache(model_name):
+    """
+    The process-wide cache of a model's embeddings, or None when disabled
+    with DOCUMIND_EMBEDDING_CACHE=0.
+    """
+    if not EMBEDDING_CACHE_ENABLED:
+        return None
+    with _caches_lock:
+        cache = _caches.get(model_name)
+        if cache is None:
+            cache = _caches[model_name] = EmbeddingCache(model_name)
+        return cache
+
+class QueryEmbeddingCache:
+    def __init__(self, max_entries=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL):
+        """
+        Thread-safe LRU of query embeddings keyed by (model name, query with
+        whitespace collapsed), with an optional time to live.
+        Args:
+            max_entries (int): Entries kept before the least recently used is evicted
+            ttl (float): Seconds an entry stays valid; 0 or None for no expiry
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()   # key -> (stored at, vector)
+        self._pinned = {}               # key -> vector, never evicted or expired
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(model_name, query):
+        return model_name, ' '.join(query.split())
+
+    def get(self, model_name, query):
+        """
+        Returns:
+            np.ndarray: The cached float32 embedding (read-only), or None on a miss
+        """
+        key = self._key(model_name, query)
+        with self._lock:
+            vector = self._pinned.get(key)
+            if vector is None:
+                entry = self._entries.get(key)
+                if entry is not None and self.ttl and time.monotonic() - entry[0] > self.ttl:
+                    del self._entries[key]
+                    entry = None
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    vector = entry[1]
+            if vector is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return vector
+
+    def has(self, model_name, query, pinned=False):
+        """
+        True if a query is cached and unexpired (or, with pinned=True, pinned),
+        without counting a hit or miss.
+        """
+        key = self._key(model_name, query)
+        with self._lock:
+            if key in self._pinned or pinned:
+                return key in self._pinned
+            entry = self._entries.get(key)
+            return entry is not None and not (self.ttl and time.monotonic() - entry[0] > self.ttl)
+
+    def put(self, model_name, query, vector, pin=False):
+        """
+        Cache a query embedding. Pinned entries (fixed questions such as the
+        app's quick buttons) are never evicted or expired.
+        Returns:
+            np.ndarray: The cached copy of the embedding, float32 and read-only
+        """
+        key = self._key(model_name, query)
+        vector = np.array(vector, dtype=np.float32)
+        vector.setflags(write=False)
+        with self._lock:
+            if pin:
+                self._pinned[key] = vector
+                self._entries.pop(key, None)
+                return vector
+            if key in self._pinned:
+                return self._pinned[key]
+            self._entries[key] = (time.monotonic(), vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return vector
+
+    def stats(self):
+        """
+        Returns:
+            dict: 'hits', 'misses' and 'entries' (including pinned ones)
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'entries': len(self._entries) + len(self._pinned)}
+
+# Shared by every Streamlit session in the process
+query_cache = QueryEmbeddingCache()
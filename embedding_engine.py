@@ -0,0 +1,158 @@
+"""
+Embedding engine.
+Sorts texts by token length, packs them into batches sized to a token
+budget so little compute goes to padding, and optionally spreads the
+batches over a pool of processes, each with its own copy of the model.
+Results come back in the order of the input texts.
+"""
+
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# Padded tokens per batch; short texts get large batches, long texts small ones
+EMBED_TOKENS_PER_BATCH = int(os.getenv('DOCUMIND_EMBED_TOKENS_PER_BATCH', '8192'))
+EMBED_MAX_BATCH = 256
+# Characters of each text tokenized to measure it; past this a text is assumed to fill the window
+CHARS_PER_TOKEN_BOUND = 16
+
+# Embedding processes for large batches (0 or 1 embeds in this process) and torch threads in each
+EMBED_PROCESSES = int(os.getenv('DOCUMIND_EMBED_PROCESSES', '0'))
+EMBED_THREADS_PER_PROCESS = int(os.getenv('DOCUMIND_EMBED_THREADS_PER_PROCESS', '4'))
+
+# Below this many texts the pool costs more in transfer than it saves
+EMBED_POOL_MIN_TEXTS = 256
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def token_lengths(model, texts):
+    """Tokens the model sees for each text, special tokens included, capped at its window."""
+    # Tokenizing only a prefix keeps long texts from costing more to measure than their clipped length
+    prefix = model.max_seq_length * CHARS_PER_TOKEN_BOUND
+    encoded = model.tokenizer([text[:prefix] for text in texts], truncation=True, max_length=model.max_seq_length,
+                              return_attention_mask=False, return_token_type_ids=False)
+    return [len(ids) for ids in encoded['input_ids']]
+
+def plan_batches(lengths, token_budget=EMBED_TOKENS_PER_BATCH, max_batch=EMBED_MAX_BATCH):
+    """
+    Group texts of similar length, longest first, into batches whose padded
+    size (batch size times its longest text) stays within token_budget.
+    Args:
+        lengths (List[int]): Token length of each text
+    Returns:
+        List[np.ndarray]: Indexes of the texts in each batch
+    """
+    order = np.argsort(-np.asarray(lengths, dtype=np.int64), kind='stable')
+    batches = []
+    start = 0
+    while start < len(order):
+        longest = max(int(lengths[order[start]]), 1)
+        size = max(1, min(max_batch, token_budget // longest))
+        batches.append(order[start:start + size])
+        start += size
+    return batches
+
+def encode_bucketed(model, texts, token_budget=EMBED_TOKENS_PER_BATCH):
+    """
+    Embed texts in length-sorted, token-budgeted batches on this process.
+    Returns:
+        np.ndarray: float32 embeddings, one row per text in input order
+    """
+    if not texts:
+        return np.zeros((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
+    embeddings = None
+    for batch in plan_batches(token_lengths(model, texts), token_budget):
+        vectors = _encode_batch(model, [texts[i] for i in batch])
+        if embeddings is None:
+            embeddings = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+        embeddings[batch] = vectors
+    return embeddings
+
+def _encode_batch(model, texts):
+    return np.asarray(model.encode(texts, batch_size=len(texts), show_progress_bar=False), dtype=np.float32)
+
+# Set in each pool process by _init_worker
+_worker_model = None
+
+def _init_worker(threads):
+    global _worker_model
+    import embedding
+
+    if embedding.EMBEDDING_BACKEND == 'onnx':
+        import onnx_backend
+        onnx_backend.ONNX_THREADS = threads
+    else:
+        import torch
+        torch.set_num_threads(threads)
+    _worker_model = embedding.get_model()
+
+def _encode_in_worker(texts):
+    return _encode_batch(_worker_model, texts)
+
+class EmbeddingPool:
+    def __init__(self, processes, threads_per_process=EMBED_THREADS_PER_PROCESS):
+        """
+        A pool of processes that each load the embedding model once.
+        Processes are spawned rather than forked, so they never inherit a
+        half-initialized torch thread pool from the parent.
+        Args:
+            processes (int): Worker processes
+            threads_per_process (int): torch or ONNX Runtime intra-op threads in each worker
+        """
+        self.processes = processes
+        self._executor = ProcessPoolExecutor(
+            max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker, initargs=(threads_per_process,)
+        )
+
+    def encode(self, model, texts, token_budget=EMBED_TOKENS_PER_BATCH):
+        """
+        Embed texts across the pool. Batches are planned here, with model's
+        tokenizer, and handed out longest first so the slowest start earliest.
+        Returns:
+            np.ndarray: float32 embeddings, one row per text in input order
+        """
+        if not texts:
+            return np.zeros((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
+        batches = plan_batches(token_lengths(model, texts), token_budget)
+        futures = [self._executor.submit(_encode_in_worker, [texts[i] for i in batch]) for batch in batches]
+        embeddings = None
+        for batch, future in zip(batches, futures):
+            vectors = future.result()
+            if embeddings is None:
+                embeddings = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            embeddings[batch] = vectors
+        return embeddings
+
+    def shutdown(self):
+        self._executor.shutdown(cancel_futures=True)
+
+def get_embedding_pool(processes=None):
+    """
+    The process-wide pool with the given number of processes (default
+    DOCUMIND_EMBED_PROCESSES), started on first use; None for one process.
+    """
+    processes = EMBED_PROCESSES if processes is None else processes
+    if processes <= 1:
+        return None
+    with _pools_lock:
+        pool = _pools.get(processes)
+        if pool is None:
+            pool = _pools[processes] = EmbeddingPool(processes)
+            atexit.register(pool.shutdown)
+        return pool
+
+def encode(model, texts, processes=None):
+    """
+    Embed texts with the pool when there are enough of them, otherwise on this process.
+    Returns:
+        np.ndarray: float32 embeddings, one row per text in input order
+    """
+    pool = get_embedding_pool(processes) if len(texts) >= EMBED_POOL_MIN_TEXTS else None
+    if pool is not None:
+        return pool.encode(model, texts)
+    return encode_bucketed(model, texts)
@@ -0,0 +1,275 @@
+"""
+Streaming ingestion pipeline.
+Pages and heading sections feed an incremental chunker, chunks are embedded in fixed-size
+batches on a worker thread, and each batch is indexed as soon as it is
+ready, so parsing overlaps with embedding. Near-duplicate chunks are
+collapsed before they reach the embedder.
+"""
+
+import os
+import queue
+import time
+import threading
+from collections import deque
+import numpy as np
+from ingestion import iter_document_sections, spill_document, block_chars_for_memory
+from chunking import (ChunkTable, iter_chunk_spans, iter_section_chunk_spans,
+                      iter_token_chunk_spans, iter_word_blocks)
+from embedding import embed_chunks, get_tokenizer
+from dedup import DEDUP_THRESHOLD, NearDuplicateIndex, collapse_near_duplicates
+from rechunk import SentenceVectors
+
+EMBED_BATCH_SIZE = 64
+
+# Uploads larger than this are ingested in bounded-memory mode under MEMORY_LIMIT_MB
+LARGE_DOCUMENT_BYTES = int(os.getenv('DOCUMIND_LARGE_DOCUMENT_MB', '50')) * 1024 * 1024
+MEMORY_LIMIT_MB = int(os.getenv('DOCUMIND_MEMORY_LIMIT_MB', '256'))
+
+# Pages or sections per batched tokenizer call when chunking by tokens
+TOKENIZE_PAGES_PER_CALL = 32
+
+# Rough working memory of embedding one chunk (tokens, activations, vector)
+EMBED_BYTES_PER_CHUNK = 4 * 1024 * 1024
+# Rough memory of one chunk's MinHash signature and LSH band keys in the dedup index
+DEDUP_BYTES_PER_CHUNK = 4 * 1024
+
+_DONE = object()
+
+def ingest_document(file, vector_store, chunk_size=500, overlap=50, doc_id=None,
+                    batch_size=EMBED_BATCH_SIZE, max_pending_batches=2,
+                    parallel=False, progress_callback=None, keep_text=False,
+                    memory_limit_mb=None, chunk_unit='words', dedup_threshold=DEDUP_THRESHOLD,
+                    sentence_vectors=False):
+    """
+    Parse, chunk, embed and index a document as a stream of batches.
+    Each batch is a ChunkTable over a single buffer sliced from the pages,
+    so chunk text is never copied once per (overlapping) chunk. Chunks do
+    not straddle pages or headings and carry both as metadata.
+    Peak memory is bounded by batch_size * max_pending_batches chunks
+    rather than by the size of the document. With memory_limit_mb set, the
+    extracted text is first spilled to a temporary file and read back in
+    blocks, so not even one page or the raw upload is held in memory whole,
+    and near-duplicates are only looked for among the chunks kept most recently.
+    Args:
+        file: Uploaded file object
+        vector_store (VectorStore): Store the batches are added to
+        chunk_size (int): Number of words (or tokens) per chunk
+        overlap (int): Overlap between chunks
+        doc_id (str): Document identity (see utils.document_id)
+        batch_size (int): Chunks per embedding batch
+        max_pending_batches (int): Batches allowed to queue ahead of the embedder
+        parallel (bool): Extract PDF pages in a process pool
+        progress_callback (callable): Called on the calling thread as
+            progress_callback(pages_indexed, total_pages)
+        keep_text (bool): Also return the full extracted text and the embeddings
+            computed for it (full dimension, even once the store is reduced)
+        memory_limit_mb (int): Ceiling on ingestion working memory (excluding
+            the loaded model); shrinks read blocks, embedding batches and the
+            near-duplicate window to fit
+        chunk_unit (str): 'words', or 'tokens' to chunk by the embedding
+            model's tokenizer so every chunk fits the model window
+        dedup_threshold (float): Similarity at which a chunk is collapsed into an
+            earlier near-duplicate (see dedup.py) instead of embedded; None disables
+        sentence_vectors (bool): Once the document is indexed, also embed its sentences
+            (see rechunk.SentenceVectors) so other chunk settings need no re-embedding
+    Returns:
+        dict: 'pages', 'chunks' (indexed), 'duplicates' (collapsed, i.e. embeddings
+            saved) and 'characters' counts, plus 'text' and 'embeddings' when keep_text=True
+            and 'sentence_vectors' when sentence_vectors=True
+    """
+    if chunk_unit not in ('words', 'tokens'):
+        raise ValueError(f"Unknown chunk unit {chunk_unit!r}; expected 'words' or 'tokens'")
+    if memory_limit_mb:
+        if keep_text or sentence_vectors:
+            raise ValueError("keep_text and sentence_vectors need the whole text in memory "
+                             "and cannot be used with memory_limit_mb")
+        block_chars = block_chars_for_memory(memory_limit_mb)
+        batch_size = max(1, min(batch_size, memory_limit_mb * 1024 * 1024 // 2 // EMBED_BYTES_PER_CHUNK
+                                // max_pending_batches))
+        # An eighth of the ceiling holds the dedup index, as a sliding window of kept chunks
+        dedup_window = max(1, memory_limit_mb * 1024 * 1024 // 8 // DEDUP_BYTES_PER_CHUNK)
+        spill_path, total_pages, total_characters = spill_document(file, block_chars, parallel=parallel)
+        reader = open(spill_path, encoding='utf-8')
+    else:
+        total_pages, sections = iter_document_sections(file, parallel=parallel)
+        spill_path = reader = dedup_window = None
+    stats = {'pages': total_pages, 'chunks': 0, 'duplicates': 0, 'characters': 0}
+    texts = [] if keep_text else None
+    embedded = [] if keep_text else None
+    kept_sections = [] if sentence_vectors else None
+    pages_read = 0
+    # (offset, text) of the sections a chunk may still start in, offsets into '\n'.join(sections)
+    window = deque()
+    window_end = 0
+
+    def track(text):
+        nonlocal window_end
+        window.append((window_end, text))
+        window_end += len(text) + 1
+        return text
+
+    def read_sections():
+        nonlocal pages_read
+        for text, page, path in sections:
+            pages_read = page + 1
+            stats['characters'] += len(text)
+            if texts is not None:
+                texts.append(text)
+            if kept_sections is not None:
+                kept_sections.append((text, page, path))
+            yield track(text), page, path
+
+    def read_spill():
+        # Page boundaries are gone from the spill file; estimate them from characters read
+        nonlocal pages_read
+        for block in iter_word_blocks(reader, block_chars):
+            stats['characters'] += len(block)
+            pages_read = total_pages * stats['characters'] // max(total_characters, 1)
+            yield track(block)
+
+    def batch_table(spans):
+        # One buffer covers the whole batch, sliced from the sections in the window
+        start, end = spans[0][0], spans[-1][1]
+        pieces = [(offset, text) for offset, text in window if offset + len(text) >= start and offset <= end]
+        base = pieces[0][0]
+        buffer = '\n'.join(text for _, text in pieces)[start - base:end - base]
+        table = ChunkTable()
+        table.add_buffer(buffer, [(s - start, e - start, *metadata) for s, e, *metadata in spans])
+        # Later chunks start no earlier than the last one in this batch
+        while window and window[0][0] + len(window[0][1]) < spans[-1][0]:
+            window.popleft()
+        if dedup_index is not None:
+            table, collapsed = collapse_near_duplicates(table, dedup_index)
+            for original, locations in collapsed.items():
+                duplicates.setdefault(original, []).extend(locations)
+            stats['duplicates'] += len(spans) - len(table)
+        stats['chunks'] += len(table)
+        return table
+
+    # Keyed by position among the document's kept chunks, i.e. its rows in the store
+    dedup_index = NearDuplicateIndex(dedup_threshold, max_items=dedup_window) if dedup_threshold else None
+    duplicates = {}
+
+    tokenizer = get_tokenizer() if chunk_unit == 'tokens' else None
+    if reader is None:
+        spans = iter_section_chunk_spans(read_sections(), chunk_size=chunk_size, overlap=overlap,
+                                         tokenizer=tokenizer, pages_per_call=TOKENIZE_PAGES_PER_CALL)
+    else:
+        # Spill blocks are neither pages nor sections, so these chunks carry no page number
+        if tokenizer is not None:
+            spans = iter_token_chunk_spans(read_spill(), tokenizer, chunk_size=chunk_size, overlap=overlap,
+                                           pages_per_call=TOKENIZE_PAGES_PER_CALL)
+        else:
+            spans = iter_chunk_spans(read_spill(), chunk_size=chunk_size, overlap=overlap)
+        spans = ((start, end, None) for start, end, _ in spans)
+
+    batches = queue.Queue(maxsize=max_pending_batches)
+    errors = []
+    pages_indexed = 0
+    pages_reported = -1
+
+    def report_progress():
+        # Runs on the calling thread, so UI callbacks never fire from the worker
+        nonlocal pages_reported
+        if progress_callback and pages_indexed != pages_reported:
+            pages_reported = pages_indexed
+            progress_callback(pages_indexed, total_pages)
+
+    def index_batches():
+        nonlocal pages_indexed
+        while True:
+            item = batches.get()
+            if item is _DONE:
+                return
+            if errors:
+                # Keep draining so the producer never blocks on a dead worker
+                continue
+            batch, pages_done = item
+            try:
+                embeddings = embed_chunks(list(batch)) if len(batch) else []
+                vector_store.add_embeddings(batch, embeddings, doc_id=doc_id, append=True)
+                if embedded is not None and len(batch):
+                    embedded.append(embeddings)
+                pages_indexed = pages_done
+            except Exception as e:
+                errors.append(e)
+
+    worker = threading.Thread(target=index_batches, name='ingest-embedder', daemon=True)
+    worker.start()
+    report_progress()
+    try:
+        batch = []
+        for span in spans:
+            batch.append(span)
+            if len(batch) == batch_size:
+                # The last page read may still have words waiting in the chunker
+                batches.put((batch_table(batch), max(pages_read - 1, 0)))
+                batch = []
+                if errors:
+                    break
+                report_progress()
+        else:
+            batches.put((batch_table(batch) if batch else ChunkTable(), total_pages))
+    finally:
+        batches.put(_DONE)
+        worker.join()
+        if reader is not None:
+            reader.close()
+            os.remove(spill_path)
+    if errors:
+        raise errors[0]
+    if duplicates:
+        vector_store.add_chunk_sources(doc_id, duplicates)
+    report_progress()
+    if kept_sections is not None:
+        # The document is fully indexed and searchable while this runs
+        stats['sentence_vectors'] = SentenceVectors.build(kept_sections, embed_chunks, tokenizer=tokenizer)
+
+    if texts is not None:
+        stats['text'] = '\n'.join(texts)
+        stats['embeddings'] = np.concatenate(embedded) if embedded else np.zeros((0, 0), dtype=np.float32)
+    return stats
+
+class IngestionJob:
+    def __init__(self, file, vector_store, **kwargs):
+        """
+        Run ingest_document on a background thread so the vector store can be
+        queried while the document is still being indexed.
+        Args:
+            file: Uploaded file object
+            vector_store (VectorStore): Store the document is indexed into
+            **kwargs: Passed through to ingest_document
+        """
+        self.pages_indexed = 0
+        self.total_pages = None
+        self.stats = None
+        self.error = None
+        self.started_at = time.time()
+        self.finished_at = None
+        self._thread = threading.Thread(
+            target=self._run, args=(file, vector_store), kwargs=kwargs,
+            name='ingest-job', daemon=True
+        )
+        self._thread.start()
+
+    def _run(self, file, vector_store, **kwargs):
+        try:
+            self.stats = ingest_document(file, vector_store, progress_callback=self._update, **kwargs)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished_at = time.time()
+
+    def _update(self, pages_indexed, total_pages):
+        self.pages_indexed = pages_indexed
+        self.total_pages = total_pages
+
+    @property
+    def done(self):
+        """True once the document is fully indexed or ingestion failed."""
+        return not self._thread.is_alive()
+
+    def wait(self, timeout=None):
+        """Block until the job finishes. Returns True if it did."""
+        self._thread.join(timeout)
+        return self.done
@@ -4,52 +4,625 @@ Supports PDF, Markdown, and HTML extraction.
 """
 
 
+import codecs
+import html
 import io
+import os
+import re
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 import pdfplumber
 import markdown as md
 from bs4 import BeautifulSoup
+from utils import normalize_sections
 
-def parse_document(file):
+try:
+    import pymupdf
+except ImportError:
+    pymupdf = None
+
+try:
+    from pdfminer.high_level import extract_pages as pdfminer_extract_pages
+    from pdfminer.layout import LTTextContainer
+    from pdfminer.pdfpage import PDFPage
+except ImportError:
+    pdfminer_extract_pages = None
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+# Below this many pages the process pool costs more than it saves
+PARALLEL_MIN_PAGES = 16
+
+# Default PDF backend; 'auto' picks PyMuPDF for plain text and pdfplumber for layout
+PDF_BACKEND = os.getenv('DOCUMIND_PDF_BACKEND', 'auto')
+
+# HTML/Markdown extraction: 'fast' (lxml, direct Markdown stripping), 'bs4', or 'auto'
+TEXT_EXTRACTOR = os.getenv('DOCUMIND_TEXT_EXTRACTOR', 'auto')
+
+def _binary_stream(data):
+    """Backends take raw PDF bytes or, for documents spilled to disk, a file path."""
+    return open(data, 'rb') if isinstance(data, str) else io.BytesIO(data)
+
+def _pdfplumber_open(data):
+    return pdfplumber.open(data if isinstance(data, str) else io.BytesIO(data))
+
+def _pdfplumber_count(data):
+    with _pdfplumber_open(data) as pdf:
+        return len(pdf.pages)
+
+def _pdfplumber_pages(data, start, end, layout=False):
+    with _pdfplumber_open(data) as pdf:
+        for i in range(start, end):
+            yield pdf.pages[i].extract_text(layout=layout) or ''
+
+def _pymupdf_open(data):
+    if isinstance(data, str):
+        return pymupdf.open(data, filetype='pdf')
+    return pymupdf.open(stream=data, filetype='pdf')
+
+def _pymupdf_count(data):
+    with _pymupdf_open(data) as doc:
+        return doc.page_count
+
+def _pymupdf_pages(data, start, end, layout=False):
+    with _pymupdf_open(data) as doc:
+        for i in range(start, end):
+            yield doc[i].get_text(sort=layout)
+
+def _pdfminer_count(data):
+    with _binary_stream(data) as fp:
+        return sum(1 for _ in PDFPage.get_pages(fp))
+
+def _pdfminer_pages(data, start, end, layout=False):
+    with _binary_stream(data) as fp:
+        for page in pdfminer_extract_pages(fp, page_numbers=range(start, end)):
+            yield ''.join(element.get_text() for element in page if isinstance(element, LTTextContainer))
+
+# name -> (count_pages(data), iter_pages(data, start, end, layout)); data is bytes or a path
+PDF_BACKENDS = {
+    'pdfplumber': (_pdfplumber_count, _pdfplumber_pages),
+}
+if pymupdf is not None:
+    PDF_BACKENDS['pymupdf'] = (_pymupdf_count, _pymupdf_pages)
+if pdfminer_extract_pages is not None:
+    PDF_BACKENDS['pdfminer'] = (_pdfminer_count, _pdfminer_pages)
+
+def register_pdf_backend(name, count_pages, iter_pages):
+    """
+    Register a PDF text extraction backend.
+    Args:
+        name (str): Backend name, selectable through parse_document(backend=...)
+        count_pages (callable): count_pages(data) -> int
+        iter_pages (callable): iter_pages(data, start, end, layout) yielding one string per page
+    """
+    PDF_BACKENDS[name] = (count_pages, iter_pages)
+
+def resolve_pdf_backend(backend=None, layout=False):
+    """
+    Resolve a backend name, expanding 'auto' to the fastest suitable backend.
+    """
+    backend = backend or PDF_BACKEND
+    if backend == 'auto':
+        if layout or 'pymupdf' not in PDF_BACKENDS:
+            return 'pdfplumber'
+        return 'pymupdf'
+    if backend not in PDF_BACKENDS:
+        raise ValueError(f"Unknown PDF backend '{backend}'. Available: {', '.join(PDF_BACKENDS)}")
+    return backend
+
+# The PDF a page-extraction worker reads from, sent once per worker by _init_page_worker
+_worker_data = None
+
+def _init_page_worker(data):
+    global _worker_data
+    _worker_data = data
+
+def _extract_page_range(start, end, backend, layout):
+    """
+    Extract the text of pages [start, end) of the worker's PDF.
+    Runs inside a worker process, so it opens its own copy of the PDF.
+    """
+    return list(PDF_BACKENDS[backend][1](_worker_data, start, end, layout))
+
+def _page_ranges(num_pages, num_ranges):
+    """Split [0, num_pages) into at most num_ranges contiguous ranges."""
+    step = max(1, -(-num_pages // num_ranges))
+    return [(start, min(start + step, num_pages)) for start in range(0, num_pages, step)]
+
+def _iter_parallel_pages(data, num_pages, backend, layout, workers):
+    """Yield page texts in order while page ranges are extracted in a process pool."""
+    # Several ranges per worker keeps the pool busy and progress fine-grained
+    ranges = _page_ranges(num_pages, workers * 4)
+    # The PDF goes to each worker once, not with every range
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_page_worker, initargs=(data,)) as pool:
+        futures = [
+            pool.submit(_extract_page_range, start, end, backend, layout)
+            for start, end in ranges
+        ]
+        for future in futures:
+            yield from future.result()
+
+def iter_pdf_pages(data, parallel=False, max_workers=None, backend=None, layout=False):
+    """
+    Stream the pages of a PDF, optionally fanning page ranges out to a process pool.
+    Args:
+        data (bytes): Raw PDF file contents
+        parallel (bool): Extract page ranges in worker processes
+        max_workers (int): Pool size (defaults to the number of CPUs)
+        backend (str): 'auto', 'pdfplumber', 'pymupdf', 'pdfminer' or a registered name
+        layout (bool): Preserve the visual layout of the text (slower)
+    Returns:
+        Tuple[int, Iterator[str]]: (total_pages, page texts in page order)
+    """
+    backend = resolve_pdf_backend(backend, layout)
+    count_pages, iter_pages = PDF_BACKENDS[backend]
+    num_pages = count_pages(data)
+    workers = max_workers or os.cpu_count() or 1
+    if not parallel or workers < 2 or num_pages < PARALLEL_MIN_PAGES:
+        return num_pages, iter_pages(data, 0, num_pages, layout)
+    return num_pages, _iter_parallel_pages(data, num_pages, backend, layout, workers)
+
+def parse_pdf(data, parallel=False, max_workers=None, progress_callback=None, backend=None, layout=False):
+    """
+    Extract text from PDF bytes, optionally fanning page ranges out to a process pool.
+    Args:
+        data (bytes): Raw PDF file contents
+        parallel (bool): Extract page ranges in worker processes
+        max_workers (int): Pool size (defaults to the number of CPUs)
+        progress_callback (callable): Called as progress_callback(pages_done, total_pages)
+        backend (str): 'auto', 'pdfplumber', 'pymupdf', 'pdfminer' or a registered name
+        layout (bool): Preserve the visual layout of the text (slower)
+    Returns:
+        str: Extracted text, pages joined in order
+    """
+    num_pages, pages = iter_pdf_pages(data, parallel, max_workers, backend, layout)
+    texts = []
+    for text in pages:
+        texts.append(text)
+        if progress_callback:
+            progress_callback(len(texts), num_pages)
+    return '\n'.join(texts)
+
+# How many leading bytes detect_format looks at
+SNIFF_BYTES = 1024
+
+# Extension -> format; anything else is sniffed from its leading bytes
+FORMAT_EXTENSIONS = {
+    '.pdf': 'pdf',
+    '.md': 'markdown',
+    '.markdown': 'markdown',
+    '.html': 'html',
+    '.htm': 'html',
+    '.txt': 'text',
+}
+
+# Control bytes that never occur in text files (tab, newlines, form feed and escape excluded)
+_BINARY_BYTES = re.compile(rb'[\x00-\x08\x0e-\x1a\x1c-\x1f]')
+
+# Markdown block syntax (headings, fences, lists, quotes) or inline links in sniffed text
+_MARKDOWN_HINT = re.compile(r'^ {0,3}(#{1,6}[ \t]|```|~~~|[-*+][ \t]|\d+[.)][ \t]|>)|\]\(', re.M)
+
+def _text_encoding(head):
+    """Pick the text encoding from a byte-order mark, defaulting to UTF-8."""
+    if head[:3] == codecs.BOM_UTF8:
+        return 'utf-8-sig'
+    if head[:2] in (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE):
+        return 'utf-16'
+    return 'utf-8'
+
+def detect_format(filename, head):
+    """
+    Decide which parser handles a file, so only one parser ever runs.
+    Args:
+        filename (str): File name; a known extension wins
+        head (bytes or memoryview): Leading bytes of the file
+    Returns:
+        str: 'pdf', 'html', 'markdown', or 'text' (kept as is, never stripped of markup)
+    """
+    ext = os.path.splitext(filename.lower())[1]
+    if ext in FORMAT_EXTENSIONS:
+        return FORMAT_EXTENSIONS[ext]
+    head = bytes(head[:SNIFF_BYTES])
+    # The PDF spec allows junk before the header within the first 1024 bytes; accept
+    # whitespace or binary bytes there, but not text that merely mentions '%PDF-'
+    start = head.find(b'%PDF-')
+    if start >= 0 and (not head[:start].strip() or _BINARY_BYTES.search(head[:start])):
+        return 'pdf'
+    text = head.decode(_text_encoding(head), errors='ignore').lstrip().lower()
+    if text.startswith('<!doctype html') or '<html' in text:
+        return 'html'
+    if _MARKDOWN_HINT.search(text):
+        return 'markdown'
+    return 'text'
+
+def _decode(data):
+    """Decode text straight from the shared buffer, honouring any byte-order mark."""
+    return str(data, _text_encoding(data[:3]))
+
+# Elements whose text is not document content (BeautifulSoup's get_text skips these too)
+_SKIP_TAGS = frozenset(['script', 'style', 'template'])
+
+# Characters fed to the streaming HTML parser at a time
+HTML_FEED_CHARS = 64 * 1024
+
+def _text_before(node, parent):
+    """Text between the previous element sibling (or the parent's start tag) and node."""
+    parts = []
+    prev = node.getprevious()
+    # Comments and processing instructions are siblings too; their tails are content
+    while prev is not None and not isinstance(prev.tag, str):
+        parts.append(prev.tail)
+        prev = prev.getprevious()
+    parts.append(prev.tail if prev is not None else parent.text)
+    return [part for part in reversed(parts) if part]
+
+def _text_before_end(element):
+    """Text of a leaf element: its own text plus the tails of any comments inside it."""
+    parts = [element.text] if element.text else []
+    parts.extend(node.tail for node in element if node.tail)
+    return parts
+
+# Heading elements and their level, for sectioning HTML
+_HEADING_TAGS = {f'h{level}': level for level in range(1, 7)}
+
+def _drain_html_events(parser, parts, skip_depth, headings=False):
+    """
+    Collect text from pending parser events in document order, freeing finished elements.
+    With headings=True, each heading's text is bracketed in parts by its level
+    (an int) before it and None after it.
+    """
+    for event, element in parser.read_events():
+        if not isinstance(element.tag, str):
+            continue
+        if event == 'start':
+            parent = element.getparent()
+            if parent is not None and not skip_depth:
+                parts.extend(_text_before(element, parent))
+                if headings and element.tag in _HEADING_TAGS:
+                    parts.append(_HEADING_TAGS[element.tag])
+            if element.tag in _SKIP_TAGS:
+                skip_depth += 1
+        else:
+            if element.tag in _SKIP_TAGS:
+                skip_depth -= 1
+            elif not skip_depth:
+                children = [child for child in element if isinstance(child.tag, str)]
+                if children:
+                    # Tails after the last child element, including any trailing comments
+                    last = children[-1]
+                    parts.extend(node.tail for node in (last, *last.itersiblings()) if node.tail)
+                else:
+                    parts.extend(_text_before_end(element))
+                if headings and element.tag in _HEADING_TAGS and element.getparent() is not None:
+                    parts.append(None)
+            # Drop what has been emitted; the element's tail is still needed by its parent
+            element.clear(keep_tail=True)
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+    return skip_depth
+
+def _iter_html_text(blocks):
+    """Feed HTML blocks to lxml's streaming parser, yielding the text found so far after each."""
+    parser = etree.HTMLPullParser(events=('start', 'end'))
+    skip_depth = 0
+    for block in blocks:
+        parts = []
+        parser.feed(block)
+        skip_depth = _drain_html_events(parser, parts, skip_depth)
+        if parts:
+            yield ' '.join(parts)
+    parts = []
+    parser.close()
+    _drain_html_events(parser, parts, skip_depth)
+    if parts:
+        yield ' '.join(parts)
+
+def _iter_html_sections(text):
+    """
+    Split HTML into sections at h1-h6 elements in one streaming pass.
+    Yields:
+        Tuple[str, Tuple[str, ...]]: (section text, heading path); the text starts with its heading
+    """
+    parser = etree.HTMLPullParser(events=('start', 'end'))
+    skip_depth = 0
+    path = ()
+    body, title, level = [], None, None
+    for offset in range(0, len(text) + 1, HTML_FEED_CHARS):
+        parts = []
+        if offset < len(text):
+            parser.feed(text[offset:offset + HTML_FEED_CHARS])
+            skip_depth = _drain_html_events(parser, parts, skip_depth, headings=True)
+        else:
+            parser.close()
+            _drain_html_events(parser, parts, skip_depth, headings=True)
+        for part in parts:
+            if isinstance(part, int) and title is None:
+                if body:
+                    yield ' '.join(body), path
+                body, title, level = [], [], part
+            elif part is None and title is not None:
+                heading = ' '.join(' '.join(title).split())
+                path = path[:level - 1] + (heading,)
+                body, title = [heading] if heading else [], None
+            elif isinstance(part, str):
+                (title if title is not None else body).append(part)
+    if body:
+        yield ' '.join(body), path
+
+def _html_to_text_fast(text):
+    """Extract text from HTML with lxml's streaming parser, never building the full tree."""
+    blocks = (text[offset:offset + HTML_FEED_CHARS] for offset in range(0, len(text), HTML_FEED_CHARS))
+    return ' '.join(_iter_html_text(blocks))
+
+# Markdown syntax stripped in place, in order, without rendering to HTML
+_MARKDOWN_RULES = [
+    (re.compile(r'^\s*(```|~~~).*$', re.M), ''),                    # code fences (code is kept)
+    (re.compile(r'^\s{0,3}\[[^\]]+\]:\s*\S+.*$', re.M), ''),          # reference definitions
+    (re.compile(r'!\[([^\]]*)\]\([^)]*\)'), r'\1'),                   # images -> alt text
+    (re.compile(r'\[([^\]]*)\](\([^)]*\)|\[[^\]]*\])'), r'\1'),        # links -> link text
+    (re.compile(r'^\s{0,3}#{1,6}\s+|\s+#+\s*$', re.M), ''),           # ATX headings
+    (re.compile(r'^\s*(=+|-+)\s*$', re.M), ''),                      # setext underlines, rules
+    (re.compile(r'^\s*([-*_]\s*){3,}$', re.M), ''),                   # horizontal rules
+    (re.compile(r'^\s{0,3}(>\s?)+', re.M), ''),                       # blockquotes
+    (re.compile(r'^\s*([-*+]|\d+[.)])\s+', re.M), ''),                # list markers
+    (re.compile(r'^\s*\|?(\s*:?-+:?\s*\|)+\s*(:?-+:?)?\s*$', re.M), ''),  # table separators
+    (re.compile(r'\|'), ' '),                                         # table cells
+    (re.compile(r'(\*\*|__)(?=\S)(.+?)(?<=\S)\1'), r'\2'),             # strong
+    (re.compile(r'(?<!\w)([*_])(?=\S)(.+?)(?<=\S)\1(?!\w)'), r'\2'),     # emphasis
+    (re.compile(r'~~(.+?)~~'), r'\1'),                                # strikethrough
+    (re.compile(r'`+([^`]*)`+'), r'\1'),                              # inline code
+    (re.compile(r'<((?:https?|ftp)://[^<>\s]+|mailto:[^<>\s]+|[^<>\s@]+@[^<>\s]+)>'), r'\1'),  # autolinks -> URL
+    (re.compile(r'</?[A-Za-z][\w-]*(\s[^<>]*)?/?>'), ''),               # inline HTML tags (not bare < or >)
+]
+
+def _markdown_to_text_fast(text):
+    """Strip Markdown syntax straight to text, skipping the HTML rendering roundtrip."""
+    for pattern, replacement in _MARKDOWN_RULES:
+        text = pattern.sub(replacement, text)
+    return html.unescape(text)
+
+# ATX headings and code fences, scanned in document order to section Markdown
+_MARKDOWN_STRUCTURE = re.compile(
+    r'^ {0,3}(?:(?P<fence>```|~~~)|(?P<hashes>#{1,6})[ \t]+(?P<title>.*?)(?:[ \t]+#+)?[ \t]*$)', re.M
+)
+
+def _iter_markdown_sections(text, fast=None):
+    """
+    Split Markdown into sections at ATX headings, ignoring '#' lines inside code fences.
+    Yields:
+        Tuple[str, Tuple[str, ...]]: (section text, heading path); the text starts with its heading
+    """
+    path = ()
+    start = 0
+    fence = None
+    for match in _MARKDOWN_STRUCTURE.finditer(text):
+        if match.group('fence'):
+            if fence is None:
+                fence = match.group('fence')
+            elif match.group('fence') == fence:
+                fence = None
+            continue
+        if fence is not None:
+            continue
+        body = _markdown_to_text(text[start:match.start()], fast)
+        if body.strip():
+            yield body, path
+        level = len(match.group('hashes'))
+        heading = ' '.join(_markdown_to_text_fast(match.group('title')).split())
+        path = path[:level - 1] + (heading,)
+        # The heading line itself stays in the section text so it is searchable
+        start = match.start('title')
+    body = _markdown_to_text(text[start:], fast)
+    if body.strip():
+        yield body, path
+
+def _use_fast_extractor(fast):
+    if fast is None:
+        fast = TEXT_EXTRACTOR != 'bs4'
+    if fast and etree is None:
+        if TEXT_EXTRACTOR == 'fast':
+            raise ImportError("lxml is required for the fast text extractor")
+        return False
+    return fast
+
+def _html_to_text(text, fast=None):
+    if _use_fast_extractor(fast):
+        return _html_to_text_fast(text)
+    soup = BeautifulSoup(text, 'html.parser')
+    return soup.get_text(separator=' ')
+
+def _markdown_to_text(text, fast=None):
+    if _use_fast_extractor(fast):
+        return _markdown_to_text_fast(text)
+    html_text = md.markdown(text)
+    soup = BeautifulSoup(html_text, 'html.parser')
+    return soup.get_text(separator=' ')
+
+def _read(file):
+    """Read a file once. Returns (format, bytes, memoryview over the same bytes)."""
+    data = file.read()
+    view = memoryview(data)
+    return detect_format(file.name, view), data, view
+
+def iter_document_pages(file, parallel=False, backend=None, layout=False, fast=None):
+    """
+    Stream a document page by page. Markdown, HTML and plain text are a single page.
+    Args:
+        file: Uploaded file object
+        parallel (bool): Extract PDF pages in a process pool
+        backend (str): PDF backend name (defaults to DOCUMIND_PDF_BACKEND, then 'auto')
+        layout (bool): Preserve PDF layout
+        fast (bool): Use the lxml/direct-Markdown extractors (defaults to DOCUMIND_TEXT_EXTRACTOR)
+    Returns:
+        Tuple[int, Iterator[str]]: (total_pages, page texts in page order)
+    """
+    fmt, data, view = _read(file)
+    if fmt == 'pdf':
+        return iter_pdf_pages(data, parallel=parallel, backend=backend, layout=layout)
+    if fmt == 'html':
+        return 1, iter([_html_to_text(_decode(view), fast)])
+    if fmt == 'text':
+        return 1, iter([_decode(view)])
+    return 1, iter([_markdown_to_text(_decode(view), fast)])
+
+def iter_document_sections(file, parallel=False, backend=None, layout=False, fast=None, normalize=True):
+    """
+    Stream a document as structural sections that chunks should not straddle:
+    PDF pages, or the spans between Markdown/HTML headings.
+    Args:
+        file: Uploaded file object
+        parallel (bool): Extract PDF pages in a process pool
+        backend (str): PDF backend name (defaults to DOCUMIND_PDF_BACKEND, then 'auto')
+        layout (bool): Preserve PDF layout
+        fast (bool): Use the lxml/direct-Markdown extractors (defaults to DOCUMIND_TEXT_EXTRACTOR)
+        normalize (bool): Normalize each section as it streams (see utils.TextNormalizer)
+    Returns:
+        Tuple[int, Iterator[Tuple[str, int, Tuple[str, ...]]]]:
+            (total_pages, (text, page, heading path) per section in document order).
+            Pages count from 0; PDF sections have an empty heading path.
+    """
+    fmt, data, view = _read(file)
+    if fmt == 'pdf':
+        num_pages, pages = iter_pdf_pages(data, parallel=parallel, backend=backend, layout=layout)
+        sections = ((text, page, ()) for page, text in enumerate(pages))
+    elif fmt == 'html':
+        if not _use_fast_extractor(fast):
+            # Headings need the streaming parser; BeautifulSoup yields one untitled section
+            num_pages, sections = 1, iter([(_html_to_text(_decode(view), fast), 0, ())])
+        else:
+            num_pages, sections = 1, ((text, 0, path) for text, path in _iter_html_sections(_decode(view)))
+    elif fmt == 'text':
+        num_pages, sections = 1, iter([(_decode(view), 0, ())])
+    else:
+        num_pages, sections = 1, ((text, 0, path) for text, path in _iter_markdown_sections(_decode(view), fast))
+    return num_pages, normalize_sections(sections) if normalize else sections
+
+def parse_document(file, parallel=False, progress_callback=None, backend=None, layout=False, fast=None):
     """
     Detects file type and extracts clean text from PDF, Markdown, or HTML.
+    Files without a known extension are identified by their leading bytes.
     Args:
         file: Uploaded file object
+        parallel (bool): Extract PDF pages in a process pool
+        progress_callback (callable): Called as progress_callback(pages_done, total_pages)
+        backend (str): PDF backend name (defaults to DOCUMIND_PDF_BACKEND, then 'auto')
+        layout (bool): Preserve PDF layout, which selects pdfplumber under 'auto'
+        fast (bool): Use the lxml/direct-Markdown extractors (defaults to DOCUMIND_TEXT_EXTRACTOR)
     Returns:
         str: Extracted text
     """
-    filename = file.name.lower()
-    if filename.endswith('.pdf'):
+    fmt, data, view = _read(file)
+    if fmt == 'pdf':
         # PDF extraction
-        with pdfplumber.open(io.BytesIO(file.read())) as pdf:
-            text = '\n'.join(page.extract_text() or '' for page in pdf.pages)
-        return text
-    elif filename.endswith('.md') or filename.endswith('.markdown'):
-        # Markdown extraction
-        text = file.read().decode('utf-8')
-        # Optionally convert markdown to plain text
-        html = md.markdown(text)
-        soup = BeautifulSoup(html, 'html.parser')
-        return soup.get_text(separator=' ')
-    elif filename.endswith('.html') or filename.endswith('.htm'):
+        return parse_pdf(data, parallel=parallel, progress_callback=progress_callback,
+                         backend=backend, layout=layout)
+    elif fmt == 'html':
         # HTML extraction
-        text = file.read().decode('utf-8')
-        soup = BeautifulSoup(text, 'html.parser')
-        return soup.get_text(separator=' ')
+        return _html_to_text(_decode(view), fast)
+    elif fmt == 'text':
+        # Plain text is already text
+        return _decode(view)
     else:
-        # Try to guess by content if extension is missing
+        # Markdown extraction
+        return _markdown_to_text(_decode(view), fast)
+
+# Memory-bounded ingestion: the document is streamed to a spill file in blocks
+# and never held in memory as a whole.
+
+def block_chars_for_memory(memory_limit_mb):
+    """
+    Size of the text blocks read, parsed and chunked at once under a memory ceiling.
+    A block costs roughly 40 bytes per character once decoded and split into words.
+    """
+    return max(16 * 1024, min(4 * 1024 * 1024, memory_limit_mb * 1024 * 1024 // 40))
+
+def _iter_decoded_blocks(file, head, encoding, block_chars):
+    """Decode a file incrementally, yielding blocks that end on a line (or word) boundary."""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = decoder.decode(head)
+    while True:
+        raw = file.read(block_chars)
+        pending += decoder.decode(raw, final=not raw)
+        if not raw:
+            if pending:
+                yield pending
+            return
+        cut = pending.rfind('\n') + 1
+        if not cut and len(pending) >= block_chars:
+            # A very long line: fall back to the last space so the buffer stays bounded
+            cut = pending.rfind(' ') + 1 or len(pending)
+        if cut:
+            yield pending[:cut]
+            pending = pending[cut:]
+
+def _remove_after(pages, path):
+    """Yield from pages, deleting the temporary file once they are exhausted."""
+    try:
+        yield from pages
+    finally:
+        os.remove(path)
+
+def iter_document_blocks(file, block_chars, parallel=False, backend=None, layout=False, normalize=True):
+    """
+    Stream a document as text blocks without reading it into memory whole.
+    PDFs are copied to a temporary file and opened by path; HTML and
+    Markdown are decoded and parsed block by block. With normalize, each
+    block is normalized as it streams (see utils.TextNormalizer).
+    Returns:
+        Tuple[int, Iterator[str]]: (total_pages, text blocks in order)
+    """
+    num_pages, blocks = _iter_raw_blocks(file, block_chars, parallel, backend, layout)
+    if normalize:
+        blocks = (text for text, in normalize_sections((block,) for block in blocks))
+    return num_pages, blocks
+
+def _iter_raw_blocks(file, block_chars, parallel, backend, layout):
+    head = file.read(SNIFF_BYTES)
+    fmt = detect_format(file.name, head)
+    if fmt == 'pdf':
+        # PDF parsers need random access, which a path gives without loading the file
+        fd, path = tempfile.mkstemp(suffix='.pdf')
         try:
-            # Try PDF
-            with pdfplumber.open(io.BytesIO(file.read())) as pdf:
-                text = '\n'.join(page.extract_text() or '' for page in pdf.pages)
-            return text
-        except Exception:
-            file.seek(0)
-            text = file.read().decode('utf-8')
-            # Try HTML
-            if '<html' in text.lower():
-                soup = BeautifulSoup(text, 'html.parser')
-                return soup.get_text(separator=' ')
-            # Try Markdown
-            html = md.markdown(text)
-            soup = BeautifulSoup(html, 'html.parser')
-            return soup.get_text(separator=' ')
+            with open(fd, 'wb') as copy:
+                copy.write(head)
+                shutil.copyfileobj(file, copy, block_chars)
+            num_pages, pages = iter_pdf_pages(path, parallel=parallel, backend=backend, layout=layout)
+        except BaseException:
+            # A corrupt or encrypted PDF must not leave its (large) copy behind
+            os.remove(path)
+            raise
+        return num_pages, _remove_after(pages, path)
+    blocks = _iter_decoded_blocks(file, head, _text_encoding(head), block_chars)
+    if fmt == 'html':
+        if etree is None:
+            return 1, iter([_html_to_text(''.join(blocks), fast=False)])
+        return 1, _iter_html_text(blocks)
+    if fmt == 'text':
+        return 1, blocks
+    return 1, (_markdown_to_text_fast(block) for block in blocks)
+
+def spill_document(file, block_chars, directory=None, parallel=False, backend=None, layout=False,
+                   normalize=True):
+    """
+    Extract a document into a temporary UTF-8 text file, one block at a time.
+    The caller owns the returned file and should delete it when done.
+    Returns:
+        Tuple[str, int, int]: (spill file path, total_pages, characters)
+    """
+    total_pages, blocks = iter_document_blocks(file, block_chars, parallel, backend, layout, normalize)
+    fd, path = tempfile.mkstemp(suffix='.txt', dir=directory)
+    characters = 0
+    try:
+        with open(fd, 'w', encoding='utf-8') as spill:
+            for block in blocks:
+                spill.write(block)
+                spill.write('\n')
+                characters += len(block)
+    except Exception:
+        os.remove(path)
+        raise
+    return path, total_pages, characters
@@ -0,0 +1,187 @@
+"""
+ONNX Runtime embedding backend.
+Exports the SentenceTransformer's transformer to ONNX once, quantizes its
+weights to int8, and runs it on CPU through ONNX Runtime with the pooling
+and normalization of the original model done in NumPy. The exported model
+is cached on disk; torch is only needed for the one-time export.
+onnxruntime and onnx are optional: pip install -r requirements-onnx.txt
+"""
+
+import importlib.util
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import numpy as np
+
+DEFAULT_ONNX_DIR = os.getenv(
+    'DOCUMIND_ONNX_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'documind', 'onnx')
+)
+# ONNX Runtime intra-op threads; 0 lets it use every core
+ONNX_THREADS = int(os.getenv('DOCUMIND_ONNX_THREADS', '0'))
+
+# Version of the exported layout; bump to re-export cached models
+EXPORT_VERSION = 1
+QUANTIZED_FILE = 'model_int8.onnx'
+
+_export_lock = threading.Lock()
+
+def _require(*modules):
+    missing = [name for name in modules if importlib.util.find_spec(name) is None]
+    if missing:
+        raise ImportError(f"The ONNX backend needs {' and '.join(missing)}: "
+                          "pip install -r requirements-onnx.txt")
+
+def export_onnx_model(model_name, directory):
+    """
+    Export a SentenceTransformer to an int8-quantized ONNX model plus its tokenizer.
+    The export is written beside directory and renamed into place, so a
+    crash never leaves a partial model behind; if another process renamed
+    its export into place first, that one is kept.
+    Args:
+        model_name (str): SentenceTransformer model name or path
+        directory (str): Where the exported model is stored
+    Raises:
+        ImportError: If onnxruntime or onnx is not installed
+        ValueError: If the model pools other than by mean or CLS token
+    """
+    _require('onnxruntime', 'onnx')
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name, device='cpu')
+    transformer, pooling = model[0], model[1]
+    mode = getattr(pooling, 'pooling_mode', None)
+    if mode is None:
+        mode = pooling.get_pooling_mode_str()
+    if mode not in ('mean', 'cls'):
+        raise ValueError(f"Unsupported pooling mode {mode!r} for the ONNX backend")
+
+    class LastHiddenState(torch.nn.Module):
+        def __init__(self, auto_model):
+            super().__init__()
+            self.auto_model = auto_model
+
+        def forward(self, *inputs):
+            return self.auto_model(**dict(zip(input_names, inputs))).last_hidden_state
+
+    sample = model.tokenizer(["an example sentence", "another"], padding=True, return_tensors='pt')
+    input_names = list(sample.keys())
+    tmp = tempfile.mkdtemp(prefix='.tmp-', dir=os.path.dirname(directory))
+    try:
+        full = os.path.join(tmp, 'model.onnx')
+        torch.onnx.export(
+            LastHiddenState(transformer.auto_model.eval()), tuple(sample[name] for name in input_names), full,
+            input_names=input_names, output_names=['last_hidden_state'],
+            dynamic_axes={name: {0: 'batch', 1: 'sequence'} for name in input_names + ['last_hidden_state']},
+            opset_version=17, dynamo=False,
+        )
+        quantize_dynamic(full, os.path.join(tmp, QUANTIZED_FILE), weight_type=QuantType.QInt8)
+        os.remove(full)
+        model.tokenizer.save_pretrained(os.path.join(tmp, 'tokenizer'))
+        with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': EXPORT_VERSION,
+                'model': model_name,
+                'max_seq_length': model.max_seq_length,
+                'dimension': model.get_sentence_embedding_dimension(),
+                'pooling': mode,
+                'normalize': any(type(module).__name__ == 'Normalize' for module in model),
+                'inputs': input_names,
+            }, f)
+        try:
+            os.rename(tmp, directory)
+        except OSError:
+            # Another process exported the same model at the same time
+            if not os.path.exists(os.path.join(directory, 'meta.json')):
+                raise
+            shutil.rmtree(tmp, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+class OnnxEmbedder:
+    def __init__(self, directory, threads=ONNX_THREADS):
+        """
+        Load a model exported by export_onnx_model.
+        Offers the parts of the SentenceTransformer API the pipeline uses:
+        encode, tokenizer, max_seq_length and get_sentence_embedding_dimension.
+        Args:
+            directory (str): Exported model directory
+            threads (int): ONNX Runtime intra-op threads (0 for every core)
+        Raises:
+            ImportError: If onnxruntime is not installed
+        """
+        _require('onnxruntime')
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(directory, 'meta.json'), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.max_seq_length = self.meta['max_seq_length']
+        self.tokenizer = AutoTokenizer.from_pretrained(os.path.join(directory, 'tokenizer'))
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(directory, QUANTIZED_FILE), options, providers=['CPUExecutionProvider']
+        )
+
+    def get_sentence_embedding_dimension(self):
+        return self.meta['dimension']
+
+    def encode(self, sentences, batch_size=32, show_progress_bar=False, **kwargs):
+        """
+        Embed sentences like SentenceTransformer.encode.
+        Returns:
+            np.ndarray: float32 embeddings, one row per sentence
+        """
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        batches = []
+        for start in range(0, len(sentences), batch_size):
+            batches.append(self._encode_batch(list(sentences[start:start + batch_size])))
+        if not batches:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+        embeddings = np.concatenate(batches)
+        return embeddings[0] if single else embeddings
+
+    def _encode_batch(self, sentences):
+        features = self.tokenizer(sentences, padding=True, truncation=True,
+                                  max_length=self.max_seq_length, return_tensors='np')
+        inputs = {name: features[name].astype(np.int64) for name in self.meta['inputs']}
+        hidden = self.session.run(None, inputs)[0]
+        if self.meta['pooling'] == 'cls':
+            pooled = hidden[:, 0]
+        else:
+            mask = features['attention_mask'][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        if self.meta['normalize']:
+            pooled = pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+        return pooled.astype(np.float32)
+
+def load_onnx_model(model_name, onnx_dir=DEFAULT_ONNX_DIR, threads=None):
+    """
+    The int8 ONNX version of a model, exported on first use and cached under onnx_dir.
+    threads defaults to ONNX_THREADS as it is when the model is loaded.
+    Raises:
+        ImportError: If onnxruntime or onnx is not installed
+    """
+    _require('onnxruntime', 'onnx')
+    directory = os.path.join(onnx_dir, re.sub(r'[^\w.-]', '_', model_name))
+    with _export_lock:
+        meta_path = os.path.join(directory, 'meta.json')
+        stale = True
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding='utf-8') as f:
+                stale = json.load(f).get('version') != EXPORT_VERSION
+        if stale:
+            shutil.rmtree(directory, ignore_errors=True)
+            os.makedirs(onnx_dir, exist_ok=True)
+            export_onnx_model(model_name, directory)
+    return OnnxEmbedder(directory, ONNX_THREADS if threads is None else threads)
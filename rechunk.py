@@ -0,0 +1,141 @@
+"""
+Re-chunking module.
+Caches sentence embeddings per document, so new chunk settings are served
+by re-assembling sentences into chunks and pooling their vectors instead
+of re-embedding the document.
+"""
+
+import json
+import os
+import numpy as np
+from chunking import ChunkTable, iter_sentence_spans
+from dedup import DEDUP_THRESHOLD, find_near_duplicates
+
+class SentenceVectors:
+    def __init__(self, text, sentences, sections, lengths, vectors):
+        """
+        Args:
+            text (str): Document text, sections joined by newlines
+            sentences (List[Tuple[int, int, int]]): (start, end, section) of each sentence
+            sections (List[Tuple[int, Tuple[str, ...]]]): (page, heading path) of each section
+            lengths (np.ndarray): Words or tokens in each sentence
+            vectors (np.ndarray): float32 sentence embeddings, one row per sentence
+        """
+        self.text = text
+        self.sentences = sentences
+        self.sections = sections
+        self.lengths = lengths
+        self.vectors = vectors
+
+    def save(self, directory):
+        """Write the sentences, their sections and vectors (not the text) into directory."""
+        np.save(os.path.join(directory, 'sentences.npy'), np.asarray(self.sentences, dtype=np.int64).reshape(-1, 3))
+        np.save(os.path.join(directory, 'sentence_lengths.npy'), self.lengths)
+        np.save(os.path.join(directory, 'sentence_vectors.npy'), self.vectors)
+        with open(os.path.join(directory, 'sections.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.sections, f)
+
+    @classmethod
+    def load(cls, directory, text):
+        """Read sentence vectors written by save() for the document text."""
+        with open(os.path.join(directory, 'sections.json'), encoding='utf-8') as f:
+            sections = [(page, tuple(path)) for page, path in json.load(f)]
+        sentences = [tuple(row) for row in np.load(os.path.join(directory, 'sentences.npy')).tolist()]
+        return cls(text, sentences, sections, np.load(os.path.join(directory, 'sentence_lengths.npy')),
+                   np.load(os.path.join(directory, 'sentence_vectors.npy')))
+
+    @classmethod
+    def build(cls, sections, embed, tokenizer=None):
+        """
+        Split structural sections (see ingestion.iter_document_sections) into
+        sentences and embed each one. This is the only embedding pass; every
+        later assemble() call reuses the vectors.
+        Args:
+            sections (Iterable[Tuple[str, int, Tuple[str, ...]]]): (text, page, heading path) in order
+            embed (callable): Embeds a list of strings, e.g. embedding.embed_chunks
+            tokenizer: Measure sentences in this tokenizer's tokens instead of words
+        """
+        texts, metadata, sentences = [], [], []
+        offset = 0
+        for number, (section_text, page, path) in enumerate(sections):
+            texts.append(section_text)
+            metadata.append((page, tuple(path)))
+            for start, end in iter_sentence_spans(section_text):
+                sentences.append((offset + start, offset + end, number))
+            offset += len(section_text) + 1
+        text = '\n'.join(texts)
+        strings = [text[start:end] for start, end, _ in sentences]
+        if not strings:
+            return cls(text, [], metadata, np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype='float32'))
+        if tokenizer is not None:
+            ids = tokenizer(strings, add_special_tokens=False, return_attention_mask=False,
+                            return_token_type_ids=False)['input_ids']
+            lengths = np.array([len(sentence_ids) for sentence_ids in ids], dtype=np.int64)
+        else:
+            lengths = np.array([len(string.split()) for string in strings], dtype=np.int64)
+        vectors = np.asarray(embed(strings), dtype='float32')
+        return cls(text, sentences, metadata, lengths, vectors)
+
+    def assemble(self, chunk_size, overlap, dedup_threshold=DEDUP_THRESHOLD):
+        """
+        Pack whole sentences into chunks of at most chunk_size words/tokens
+        (a longer sentence is a chunk on its own), repeating up to overlap
+        words/tokens of trailing sentences at the start of the next chunk.
+        Chunks never cross a section. Each chunk's vector is the
+        length-weighted mean of its sentence vectors, re-normalized.
+        Near-duplicate chunks are collapsed as in ingestion (see dedup.py),
+        their locations kept as sources of the chunk they repeat.
+        Args:
+            chunk_size (int): Most words/tokens per chunk
+            overlap (int): Words/tokens repeated from the previous chunk
+            dedup_threshold (float): Similarity at which a chunk is collapsed; None disables
+        Returns:
+            Tuple[ChunkTable, np.ndarray]: (chunks over the document text, float32 chunk vectors)
+        """
+        ranges = []
+        count = len(self.sentences)
+        first = 0
+        while first < count:
+            section = self.sentences[first][2]
+            last = first + 1
+            total = self.lengths[first]
+            while (last < count and self.sentences[last][2] == section
+                   and total + self.lengths[last] <= chunk_size):
+                total += self.lengths[last]
+                last += 1
+            ranges.append((first, last))
+            if last == count or self.sentences[last][2] != section:
+                first = last
+                continue
+            # Step back over trailing sentences that fit in the overlap, leaving room
+            # for the next chunk to reach at least one new sentence
+            budget = min(overlap, chunk_size - self.lengths[last])
+            following, shared = last, 0
+            while following - 1 > first and shared + self.lengths[following - 1] <= budget:
+                following -= 1
+                shared += self.lengths[following]
+            first = following
+
+        table = ChunkTable()
+        table.add_buffer(self.text, [
+            (self.sentences[first][0], self.sentences[last - 1][1], *self.sections[self.sentences[first][2]])
+            for first, last in ranges
+        ])
+        if not ranges:
+            return table, np.zeros((0, self.vectors.shape[1]), dtype='float32')
+
+        # Sums over any sentence range come from one cumulative sum of weighted vectors
+        weights = np.maximum(self.lengths, 1).astype(np.float64)[:, None]
+        cumulative = np.zeros((count + 1, self.vectors.shape[1]))
+        np.cumsum(self.vectors * weights, axis=0, out=cumulative[1:])
+        bounds = np.array(ranges)
+        pooled = cumulative[bounds[:, 1]] - cumulative[bounds[:, 0]]
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        vectors = (pooled / np.maximum(norms, 1e-12)).astype('float32')
+        if dedup_threshold:
+            keep, duplicates = find_near_duplicates(table, threshold=dedup_threshold)
+            if len(keep) < len(table):
+                table, vectors = table.take(keep), vectors[keep]
+            for position, locations in duplicates.items():
+                table.add_sources(position, locations)
+        return table, vectors
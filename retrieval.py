@@ -6,51 +6,70 @@ import numpy as np
 from typing import List, Tuple
 import re
 
-def retrieve_relevant_chunks(query_embedding, vector_store, top_k=3, min_similarity=0.3):
+def retrieve_relevant_chunks(query_embedding, vector_store, top_k=3, min_similarity=0.3, **filters):
     """
     Retrieve the most relevant chunks with advanced filtering and ranking.
     Args:
-        query_embedding: The query embedding vector
+        query_embedding: The query embedding, a float32 array (passed to the index without a copy)
         vector_store: The vector store containing document chunks
         top_k: Number of chunks to retrieve
         min_similarity: Minimum similarity threshold
+        **filters: Metadata pre-filters (doc_id, pages, heading; see VectorStore.search_ids)
     Returns:
         List[str]: Most relevant chunks
     """
-    if not hasattr(vector_store, 'embeddings') or vector_store.embeddings is None or len(vector_store.embeddings) == 0:
+    chunk_ids = retrieve_relevant_chunk_ids(query_embedding, vector_store, top_k, min_similarity, **filters)
+    return vector_store.get_chunks(chunk_ids)
+
+def retrieve_relevant_chunk_ids(query_embedding, vector_store, top_k=3, min_similarity=0.3, **filters):
+    """
+    Like retrieve_relevant_chunks, but return chunk IDs into vector_store.chunks.
+    Only the candidate chunks are materialized as text, for content scoring.
+    Returns:
+        List[int]: IDs of the most relevant chunks
+    """
+    if getattr(vector_store, 'index', None) is None or vector_store.index.ntotal == 0:
         return []
     
     # Get similarity scores
-    similarities = vector_store.search(query_embedding, top_k=top_k * 2)  # Get more for filtering
+    similarities = vector_store.search_ids(query_embedding, top_k=top_k * 2, **filters)  # Get more for filtering
     
     # Filter by similarity threshold
-    filtered_chunks = []
-    for chunk, score in similarities:
+    filtered_ids = []
+    for chunk_id, score in similarities:
         if score >= min_similarity:
-            filtered_chunks.append((chunk, score))
+            filtered_ids.append((chunk_id, score))
     
     # If we don't have enough chunks above threshold, lower the threshold
-    if len(filtered_chunks) < top_k:
-        filtered_chunks = similarities[:top_k]
+    if len(filtered_ids) < top_k:
+        filtered_ids = similarities[:top_k]
     
     # Advanced ranking: combine similarity with content quality
-    ranked_chunks = advanced_ranking(filtered_chunks, query_embedding)
+    texts = dict(zip((chunk_id for chunk_id, _ in filtered_ids),
+                     vector_store.get_chunks([chunk_id for chunk_id, _ in filtered_ids])))
+    ranked_ids = advanced_ranking(filtered_ids, query_embedding, texts=texts)
     
     # Return top chunks
-    return [chunk for chunk, score in ranked_chunks[:top_k]]
+    return [chunk_id for chunk_id, score in ranked_ids[:top_k]]
 
-def advanced_ranking(chunks_with_scores, query_embedding):
+def advanced_ranking(chunks_with_scores, query_embedding, texts=None):
     """
     Advanced ranking that combines similarity with content quality metrics.
+    When texts is given, chunks_with_scores holds chunk IDs and texts maps
+    each ID to its chunk text.
     """
     ranked = []
     
     for chunk, similarity_score in chunks_with_scores:
+        text = texts[chunk] if texts is not None else chunk
+        
         # Calculate content quality score
-        quality_score = calculate_content_quality(chunk)
+        quality_score = calculate_content_quality(text)
         
         # Calculate diversity score (avoid redundant chunks)
-        diversity_score = calculate_diversity_score(chunk, [c for c, _ in ranked])
+        diversity_score = calculate_diversity_score(
+            text, [texts[c] if texts is not None else c for c, _ in ranked]
+        )
         
         # Combine scores with weights
         final_score = (
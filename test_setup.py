@@ -3,8 +3,18 @@
 Test script to verify the complete Document Q&A pipeline works correctly.
 """
 
+import atexit
+import shutil
 import sys
 import os
+import re
+import tempfile
+
+# Chunk vectors embedded by the tests go to a throwaway cache, not the user's
+# (test_embedding_cache builds its own); set before embedding_cache is imported
+_EMBEDDING_CACHE_DIR = tempfile.mkdtemp(prefix='documind-test-embeddings-')
+os.environ['DOCUMIND_EMBEDDING_CACHE_DIR'] = _EMBEDDING_CACHE_DIR
+atexit.register(shutil.rmtree, _EMBEDDING_CACHE_DIR, ignore_errors=True)
 
 def test_imports():
     """Test if all required modules can be imported."""
@@ -22,6 +32,136 @@ def test_imports():
         print(f"❌ Import error: {e}")
         return False
 
+# Cold import of the pipeline modules, without the embedding model
+IMPORT_BUDGET_SECONDS = 3.0
+
+def test_import_time():
+    """Test that importing the pipeline stays within budget and does not load torch."""
+    print("\nTesting import time...")
+    try:
+        import subprocess
+        
+        # A fresh interpreter, so modules imported by earlier tests do not count
+        code = ("import sys, time; start = time.perf_counter(); "
+                "import embedding, ingest_pipeline, vector_store, retrieval, rag_pipeline; "
+                "print(time.perf_counter() - start, 'torch' in sys.modules)")
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, timeout=120,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        assert result.returncode == 0, result.stderr.strip().splitlines()[-1]
+        elapsed, torch_loaded = result.stdout.split()
+        assert torch_loaded == 'False', "Importing the pipeline loaded torch"
+        assert float(elapsed) < IMPORT_BUDGET_SECONDS, \
+            f"Imports took {float(elapsed):.2f}s, over the {IMPORT_BUDGET_SECONDS}s budget"
+        print(f"✅ Pipeline imports in {float(elapsed):.2f}s without loading the model")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Import time error: {e}")
+        return False
+
+def test_parallel_pdf():
+    """Test that page-parallel PDF extraction matches serial extraction."""
+    print("\nTesting parallel PDF extraction...")
+    try:
+        import pymupdf
+        from ingestion import parse_pdf, PARALLEL_MIN_PAGES
+        
+        # Build a PDF with enough pages to take the parallel path
+        doc = pymupdf.open()
+        for i in range(PARALLEL_MIN_PAGES * 2):
+            page = doc.new_page()
+            page.insert_text((72, 72), f"Page {i} of the parallel extraction test.")
+        data = doc.tobytes()
+        doc.close()
+        
+        progress = []
+        serial_text = parse_pdf(data)
+        parallel_text = parse_pdf(data, parallel=True, max_workers=2,
+                                  progress_callback=lambda done, total: progress.append((done, total)))
+        assert parallel_text == serial_text, "Parallel text differs from serial text"
+        assert progress[-1] == (PARALLEL_MIN_PAGES * 2, PARALLEL_MIN_PAGES * 2), "Progress did not reach the last page"
+        print(f"✅ Parallel extraction matches serial: {progress[-1][1]} pages")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Parallel PDF error: {e}")
+        return False
+
+def test_pdf_backends():
+    """Test PDF backend selection, and that every backend extracts the same text."""
+    print("\nTesting PDF backends...")
+    try:
+        import pymupdf
+        from ingestion import PDF_BACKENDS, parse_pdf, resolve_pdf_backend
+        
+        assert resolve_pdf_backend('auto') == 'pymupdf', "auto did not pick PyMuPDF for plain text"
+        assert resolve_pdf_backend('auto', layout=True) == 'pdfplumber', "auto did not pick pdfplumber for layout"
+        assert resolve_pdf_backend('pdfplumber') == 'pdfplumber', "An explicit backend was not kept"
+        try:
+            resolve_pdf_backend('no-such-backend')
+            raise AssertionError("Unknown backend was accepted")
+        except ValueError:
+            pass
+        
+        doc = pymupdf.open()
+        for i in range(3):
+            page = doc.new_page()
+            page.insert_text((72, 72), f"Page {i} of the backend comparison test.")
+            page.insert_text((72, 100), "Invoices are due within thirty days.")
+        data = doc.tobytes()
+        doc.close()
+        texts = {name: parse_pdf(data, backend=name).split() for name in PDF_BACKENDS}
+        reference = texts['pymupdf']
+        for name, words in texts.items():
+            assert words == reference, f"{name} text differs from pymupdf: {words} != {reference}"
+        print(f"✅ PDF backends agree: {', '.join(sorted(texts))}")
+        
+        return True
+    except Exception as e:
+        print(f"❌ PDF backends error: {e}")
+        return False
+
+def test_text_extraction():
+    """Test format sniffing and the fast HTML extractor."""
+    print("\nTesting text extraction...")
+    try:
+        import io
+        from ingestion import detect_format, parse_document
+        
+        page = b"<!DOCTYPE html><html><body><h1>Title</h1><p>Hello <b>world</b><!-- note --> again</p><script>var x;</script></body></html>"
+        assert detect_format("upload", page) == "html", "HTML was not sniffed"
+        assert detect_format("upload", b"%PDF-1.7\n") == "pdf", "PDF was not sniffed"
+        assert detect_format("upload", b"\r\n\x00\x1b\x89junk %PDF-1.4\n") == "pdf", "PDF after junk was not sniffed"
+        assert detect_format("upload", b"Notes on the %PDF-1.7 header\n") == "text", "Text mentioning PDF sniffed as PDF"
+        
+        file = io.BytesIO(page)
+        file.name = "upload"
+        fast_words = parse_document(file, fast=True).split()
+        file.seek(0)
+        bs4_words = parse_document(file, fast=False).split()
+        assert fast_words == bs4_words, f"Fast extractor differs: {fast_words} != {bs4_words}"
+        
+        # Comparisons and autolinks are content, not tags; plain text is never stripped of markup
+        markdown = b"# Notes\n\nPrice is 5 < 6 and x > y, see <https://example.com> or <b>bold</b>.\n"
+        for fast in (True, False):
+            file = io.BytesIO(markdown)
+            file.name = "notes.md"
+            words = parse_document(file, fast=fast).replace(",", " ").replace(".\n", " ").split()
+            assert "6" in words and "x" in words and "https://example.com" in words and "bold" in words, \
+                f"Markdown lost text: {words}"
+        plain = b"Price is 5 < 6 and x > y, mail <a@b.org>; *not* _markdown_\n"
+        assert detect_format("upload", b"Just a note, 5 < 6.\n") == "text", "Plain text was not sniffed"
+        for name in ("notes.txt", "upload"):
+            file = io.BytesIO(plain)
+            file.name = name
+            assert parse_document(file) == plain.decode(), f"Plain text {name} was altered"
+        print(f"✅ Text extraction working: {' '.join(fast_words)}")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Text extraction error: {e}")
+        return False
+
 def test_embedding():
     """Test embedding functionality."""
     print("\nTesting embedding...")
@@ -42,6 +182,290 @@ def test_embedding():
         print(f"❌ Embedding error: {e}")
         return False
 
+def test_embedding_cache():
+    """Test that cached embeddings persist, survive a torn write and only misses are embedded."""
+    print("\nTesting embedding cache...")
+    try:
+        import tempfile
+        import numpy as np
+        import embedding
+        from embedding_cache import EmbeddingCache
+        
+        class CountingModel:
+            encoded = []
+            max_seq_length = 16
+            def tokenizer(self, texts, **kwargs):
+                return {'input_ids': [text.split() for text in texts]}
+            def encode(self, texts, **kwargs):
+                self.encoded.extend(texts)
+                return np.array([[len(text), i, 1.0] for i, text in enumerate(texts)], dtype='float32')
+        
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = EmbeddingCache('test-model', cache_dir)
+            model = CountingModel()
+            saved = embedding._model, embedding.get_embedding_cache
+            embedding._model, embedding.get_embedding_cache = model, lambda name: cache
+            try:
+                chunks = [f"Chunk {i} of the first revision." for i in range(10)]
+                first = embedding.embed_chunks(chunks)
+                revised = chunks[:9] + ["A rewritten   final chunk."]
+                second = embedding.embed_chunks(revised)
+                listed = embedding.embed_chunks(chunks[:2], as_list=True)
+            finally:
+                embedding._model, embedding.get_embedding_cache = saved
+            assert isinstance(second, np.ndarray) and second.dtype == np.float32 and second.flags.c_contiguous, \
+                "embed_chunks did not return a contiguous float32 array"
+            assert np.array_equal(second[:9], first[:9]), "Cached vectors differ from the computed ones"
+            assert listed == first[:2].tolist(), "List output shim is broken"
+            assert len(model.encoded) == 11, f"Expected 11 chunks embedded, got {len(model.encoded)}"
+            
+            # A torn append (vector written, key not) is dropped on reopen
+            with open(cache._file('vectors.f32'), 'ab') as f:
+                f.write(b'\0' * 6)
+            reopened = EmbeddingCache('test-model', cache_dir)
+            vectors = reopened.get_many(["A rewritten final chunk.", "never cached"])
+            assert len(reopened) == 11 and vectors[1] is None and vectors[0][0] == len(revised[9]), \
+                "Cache did not persist across reopening"
+            
+            small = EmbeddingCache('test-model', cache_dir, max_bytes=8 * (3 * 4 + 16))
+            small.get_many(["Chunk 0 of the first revision."])
+            small.put_many(["one more", "and another"], np.ones((2, 3)))
+            assert len(small) == 6 and small.get_many(["Chunk 0 of the first revision."])[0] is not None, \
+                "Eviction did not keep the most recently used rows"
+            
+            # Two processes sharing the cache: rows come from the files, not each one's own count
+            first, second = EmbeddingCache('shared', cache_dir), EmbeddingCache('shared', cache_dir)
+            first.put_many(["alpha"], [[1.0, 0.0]])
+            second.put_many(["beta"], [[0.0, 1.0]])
+            first.put_many(["gamma"], [[1.0, 1.0]])
+            assert second.get_many(["beta"])[0].tolist() == [0.0, 1.0] and \
+                second.get_many(["gamma"])[0].tolist() == [1.0, 1.0] and \
+                first.get_many(["beta"])[0].tolist() == [0.0, 1.0], "Processes' rows overlap"
+            first.max_bytes = 2 * (2 * 4 + 16)
+            first.put_many(["delta"], [[2.0, 2.0]])
+            assert second.get_many(["delta"])[0].tolist() == [2.0, 2.0] and \
+                second.get_many(["alpha"])[0] is None, "Compaction by another process was not picked up"
+        print(f"✅ Embedding cache working: {len(model.encoded)} of 20 chunks embedded, rest read from cache")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Embedding cache error: {e}")
+        return False
+
+def test_document_cache():
+    """Test that cached documents round-trip with their chunk metadata and the least recently used are evicted."""
+    print("\nTesting document cache...")
+    try:
+        import tempfile
+        import time
+        import numpy as np
+        from chunking import ChunkTable
+        from doc_cache import DocumentCache
+        from rechunk import SentenceVectors
+        
+        sections = [("Opening section about invoices and their totals. " * 4, 0, ("Billing",)),
+                    ("Closing section about refunds. " * 4, 1, ("Billing", "Refunds"))]
+        chunks = ChunkTable.from_sections(sections, chunk_size=8, overlap=2)
+        chunks.add_sources(1, [(3, ("Appendix",))])
+        embeddings = np.random.default_rng(0).random((len(chunks), 8), dtype=np.float32)
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = DocumentCache(tmp)
+            assert cache.get("doc-a") is None, "Missing key was found"
+            sentence_vectors = SentenceVectors.build(sections, lambda strings: np.ones((len(strings), 4)))
+            cache.put("doc-a", "\n".join(text for text, _, _ in sections), chunks, embeddings, sentence_vectors)
+            text, cached_chunks, cached_embeddings, cached_vectors = cache.get("doc-a")
+            assert text == sentence_vectors.text and list(cached_chunks) == list(chunks), "Text or chunks changed"
+            assert [cached_chunks.locations(i) for i in range(len(chunks))] == \
+                [chunks.locations(i) for i in range(len(chunks))], "Chunk metadata changed"
+            assert np.array_equal(cached_embeddings, embeddings), "Embeddings changed"
+            cached_table, cached_pooled = cached_vectors.assemble(8, 2)
+            table, pooled = sentence_vectors.assemble(8, 2)
+            assert list(cached_table) == list(table) and np.array_equal(cached_pooled, pooled), "Sentence vectors changed"
+            
+            # Room for two entries: reading doc-a makes doc-b the least recently used
+            entry = os.path.join(tmp, "doc-a")
+            entry_bytes = sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+            cache.max_bytes = 2 * entry_bytes + entry_bytes // 2
+            cache.put("doc-b", text, chunks, embeddings, sentence_vectors)
+            now = time.time()
+            os.utime(entry, (now - 20, now - 20))
+            os.utime(os.path.join(tmp, "doc-b"), (now - 10, now - 10))
+            cache.get("doc-a")
+            cache.put("doc-c", text, chunks, embeddings, sentence_vectors)
+            assert cache.get("doc-b") is None and cache.get("doc-a") and cache.get("doc-c"), \
+                "Eviction did not drop the least recently used entry"
+        print(f"✅ Document cache working: {len(chunks)} chunks round-tripped, least recently used entry evicted")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Document cache error: {e}")
+        return False
+
+def test_query_cache():
+    """Test the query-embedding LRU and that warmed-up questions never reach the model."""
+    print("\nTesting query embedding cache...")
+    try:
+        import time
+        import numpy as np
+        import embedding
+        from embedding_cache import QueryEmbeddingCache
+        
+        cache = QueryEmbeddingCache(max_entries=2, ttl=0.2)
+        cache.put('m', "first  question", [1.0])
+        cache.put('m', "second question", [2.0])
+        cache.put('m', "pinned question", [3.0], pin=True)
+        assert cache.get('m', " first question ").tolist() == [1.0], "Normalized query missed the cache"
+        assert cache.get('other-model', "first question") is None, "Cache is not keyed by model"
+        cache.put('m', "third question", [4.0])
+        assert cache.get('m', "second question") is None, "Least recently used entry was not evicted"
+        time.sleep(0.3)
+        assert cache.get('m', "first question") is None, "Expired entry was returned"
+        assert cache.get('m', "pinned question").tolist() == [3.0], "Pinned entry was evicted"
+        assert cache.stats() == {'hits': 2, 'misses': 3, 'entries': 2}, f"Unexpected stats {cache.stats()}"
+        
+        class CountingModel:
+            encoded = []
+            def encode(self, texts, **kwargs):
+                self.encoded.extend(texts)
+                return np.ones((len(texts), 3), dtype='float32')
+        
+        model = CountingModel()
+        saved = embedding._model, embedding.query_cache
+        embedding._model, embedding.query_cache = model, QueryEmbeddingCache()
+        try:
+            questions = ["Summarize this document.", "What are the key points?"]
+            embedding.warmup(background=False, queries=questions)
+            warmed = len(model.encoded)
+            for _ in range(3):
+                for question in questions:
+                    embedding.embed_query(question)
+            embedding.embed_query("A new question?")
+            embedding.embed_query("A new   question?")
+        finally:
+            embedding._model, embedding.query_cache = saved
+        assert warmed == 2 and len(model.encoded) == 3, f"Model embedded {model.encoded}"
+        print("✅ Query cache working: quick questions served without the model after warmup")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Query cache error: {e}")
+        return False
+
+def test_query_batcher():
+    """Test that concurrent queries are embedded together in micro-batches and get their own vectors."""
+    print("\nTesting query micro-batching...")
+    try:
+        import time
+        import numpy as np
+        from concurrent.futures import ThreadPoolExecutor
+        import embedding
+        from embedding_cache import QueryEmbeddingCache
+        
+        class SlowModel:
+            calls = []
+            def encode(self, texts, **kwargs):
+                if "fail" in texts:
+                    raise RuntimeError("model failed")
+                self.calls.append(len(texts))
+                time.sleep(0.02)
+                return np.array([[len(text), float(text.split()[-1])] for text in texts], dtype='float32')
+        
+        model = SlowModel()
+        batcher = embedding.QueryBatcher(max_batch=16, max_wait=0.005)
+        saved = embedding._model, embedding.query_cache, embedding.query_batcher
+        embedding._model, embedding.query_cache, embedding.query_batcher = model, QueryEmbeddingCache(), batcher
+        try:
+            questions = [f"question {i % 40}" for i in range(50)]
+            with ThreadPoolExecutor(max_workers=50) as executor:
+                vectors = list(executor.map(embedding.embed_query, questions))
+            try:
+                batcher.submit("fail").result(timeout=5)
+                raise AssertionError("Model error was not passed to the caller")
+            except RuntimeError:
+                pass
+        finally:
+            embedding._model, embedding.query_cache, embedding.query_batcher = saved
+        assert all(vector[1] == i % 40 for i, vector in enumerate(vectors)), "A query got another query's vector"
+        stats = batcher.stats()
+        assert stats['requests'] <= 51 and stats['batches'] < 50 and stats['max_batch_size'] <= 16, \
+            f"Queries were not batched: {stats}"
+        assert stats['queue_depth'] == 0, f"Queries left in the queue: {stats}"
+        print(f"✅ Query batching working: {sum(model.calls)} queries embedded in {len(model.calls)} forward passes "
+              f"(mean batch {stats['mean_batch_size']:.1f}, max queue depth {stats['max_queue_depth']})")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Query batching error: {e}")
+        return False
+
+def test_embedding_engine():
+    """Test that length-bucketed batches fit the token budget and preserve input order."""
+    print("\nTesting embedding engine...")
+    try:
+        import numpy as np
+        from embedding_engine import encode_bucketed, plan_batches
+        
+        class WordModel:
+            max_seq_length = 64
+            batches = []
+            def tokenizer(self, texts, **kwargs):
+                return {'input_ids': [text.split()[:self.max_seq_length] for text in texts]}
+            def encode(self, texts, batch_size=32, **kwargs):
+                self.batches.append(len(texts))
+                return np.array([[len(text.split()), float(text.split()[0])] for text in texts])
+        
+        rng = np.random.default_rng(0)
+        texts = [" ".join([str(i)] + ["word"] * int(rng.integers(0, 60))) for i in range(500)]
+        lengths = [min(len(text.split()), 64) for text in texts]
+        batches = plan_batches(lengths, token_budget=512)
+        assert sorted(np.concatenate(batches).tolist()) == list(range(500)), "Batches lose or repeat texts"
+        assert all(len(b) * max(lengths[i] for i in b) <= 512 for b in batches), "A batch exceeds the token budget"
+        model = WordModel()
+        embeddings = encode_bucketed(model, texts, token_budget=512)
+        assert embeddings.dtype == np.float32 and embeddings[:, 1].tolist() == list(range(500)), \
+            "Embeddings are not in input order"
+        print(f"✅ Embedding engine working: 500 texts in {len(model.batches)} batches of "
+              f"{min(model.batches)}-{max(model.batches)}")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Embedding engine error: {e}")
+        return False
+
+# Smallest cosine similarity allowed between int8 ONNX and torch embeddings of the same text
+ONNX_MIN_COSINE = 0.98
+
+def test_onnx_backend():
+    """Test that the int8 ONNX Runtime backend stays within ONNX_MIN_COSINE of the torch embeddings."""
+    print("\nTesting ONNX backend...")
+    try:
+        import importlib.util
+        import tempfile
+        import numpy as np
+        from sentence_transformers import SentenceTransformer
+        from embedding import MODEL_NAME
+        from onnx_backend import load_onnx_model
+        
+        if importlib.util.find_spec('onnxruntime') is None or importlib.util.find_spec('onnx') is None:
+            print("⏭️  ONNX backend skipped: install requirements-onnx.txt to test it")
+            return True
+        texts = ["What is machine learning?", "The quarterly report shows revenue grew by 12 percent.",
+                 "Photosynthesis converts light energy into chemical energy. " * 20, "a"]
+        with tempfile.TemporaryDirectory() as onnx_dir:
+            onnx_model = load_onnx_model(MODEL_NAME, onnx_dir=onnx_dir, threads=1)
+            quantized = onnx_model.encode(texts)
+        reference = SentenceTransformer(MODEL_NAME, device='cpu').encode(texts)
+        cosine = (quantized * reference).sum(axis=1) / (
+            np.linalg.norm(quantized, axis=1) * np.linalg.norm(reference, axis=1))
+        assert quantized.dtype == np.float32 and quantized.shape == reference.shape, "ONNX embeddings have the wrong shape"
+        assert cosine.min() >= ONNX_MIN_COSINE, f"ONNX embeddings drift too far: cosine {cosine.min():.4f}"
+        print(f"✅ ONNX backend matches torch: cosine min {cosine.min():.4f}, mean {cosine.mean():.4f}")
+        
+        return True
+    except Exception as e:
+        print(f"❌ ONNX backend error: {e}")
+        return False
+
 def test_chunking():
     """Test text chunking functionality."""
     print("\nTesting chunking...")
@@ -58,6 +482,485 @@ def test_chunking():
         print(f"❌ Chunking error: {e}")
         return False
 
+def test_streaming_chunks():
+    """Test that the incremental chunker matches chunk_text on paged input."""
+    print("\nTesting streaming chunking...")
+    try:
+        from chunking import chunk_text, iter_chunks
+        
+        pages = [f"Page {i} talks about topic {i} in some detail. " * 7 for i in range(5)]
+        expected = chunk_text('\n'.join(pages), chunk_size=30, overlap=5)
+        streamed = list(iter_chunks(iter(pages), chunk_size=30, overlap=5))
+        assert streamed == expected, "Streamed chunks differ from chunk_text"
+        print(f"✅ Streaming chunker matches chunk_text: {len(streamed)} chunks")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Streaming chunking error: {e}")
+        return False
+
+def test_normalizer():
+    """Test that streaming normalization of pages matches normalizing the whole text."""
+    print("\nTesting text normalization...")
+    try:
+        from utils import TextNormalizer, clean_text, normalize_sections
+        
+        pages = ["Page 1\n\nThe \ufb01nal  report on inter-\nnational\x00 trade\tis com-",
+                 "plete.\x0c\n\n\nSee  Appendix-\nB for   details."]
+        assert clean_text("\n".join(pages)) == \
+            "Page 1 The final report on international trade is complete. See Appendix- B for details.", \
+            "clean_text did not normalize"
+        sections = list(normalize_sections((text, page, ()) for page, text in enumerate(pages)))
+        assert sections == [("Page 1\n\nThe final report on international trade is", 0, ()),
+                            ("complete.\n\nSee Appendix-\nB for details.", 1, ())], \
+            f"Unexpected sections {sections}"
+        normalizer = TextNormalizer(paragraphs=False)
+        streamed = " ".join(filter(None, [normalizer.feed(page) for page in pages] + [normalizer.finish()]))
+        assert streamed == clean_text("\n".join(pages)), "Streaming output differs from clean_text"
+        print(f"✅ Normalizer working: {len(pages)} pages normalized incrementally")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Normalizer error: {e}")
+        return False
+
+def test_chunk_table():
+    """Test that chunk offsets cover the same words as chunk_text and survive store edits."""
+    print("\nTesting chunk table...")
+    try:
+        import numpy as np
+        from chunking import ChunkTable, chunk_text
+        from vector_store import VectorStore
+        
+        text = "\n".join(f"Paragraph {i} covers section {i % 4} of the manual." for i in range(60))
+        table = ChunkTable.from_text(text, chunk_size=40, overlap=8)
+        expected = chunk_text(text, chunk_size=40, overlap=8)
+        assert [' '.join(chunk.split()) for chunk in table] == expected, "Chunk spans differ from chunk_text"
+        assert len(table.buffers) == 1, "Chunks did not share the source text buffer"
+        
+        vs = VectorStore()
+        vs.add_embeddings(table, np.random.rand(len(table), 384).astype('float32'), doc_id="manual")
+        vs.add_embeddings(["An unrelated note."], np.random.rand(1, 384).astype('float32'), doc_id="note")
+        chunk_id, _ = vs.search_ids(vs.index.reconstruct(1), top_k=1)[0]
+        assert chunk_id == 1 and vs.chunks.location(chunk_id)[3] == "manual", "Search did not return the chunk ID"
+        vs.remove_document("manual")
+        assert list(vs.chunks) == ["An unrelated note."] and len(vs.chunks.buffers) == 1, \
+            "Removed document's buffer was kept"
+        print(f"✅ Chunk table working: {len(table)} chunks over one {len(text)}-character buffer")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Chunk table error: {e}")
+        return False
+
+def test_structured_chunks():
+    """Test that chunks stay within headings and searches can pre-filter by them."""
+    print("\nTesting structure-aware chunking...")
+    try:
+        import io
+        import numpy as np
+        from chunking import ChunkTable
+        from ingestion import iter_document_sections
+        from vector_store import VectorStore
+        
+        markdown = ("# Guide\n\n" + "Setup steps are listed here. " * 20 +
+                    "\n\n## Section 4: Results\n\n" + "The results table shows 42 runs. " * 20 +
+                    "\n\n```bash\n# a comment, not a heading\n```\n")
+        file = io.BytesIO(markdown.encode('utf-8'))
+        file.name = "guide.md"
+        _, sections = iter_document_sections(file)
+        table = ChunkTable.from_sections(sections, chunk_size=25, overlap=5)
+        paths = {table.heading(i) for i in range(len(table))}
+        assert paths == {("Guide",), ("Guide", "Section 4: Results")}, f"Unexpected heading paths {paths}"
+        for i in range(len(table)):
+            other_section = "Setup steps" if table.heading(i)[-1].startswith("Section 4") else "results table"
+            assert other_section not in table[i], "A chunk straddles a heading"
+        
+        vs = VectorStore()
+        vs.add_embeddings(table, np.random.rand(len(table), 384).astype('float32'), doc_id="guide")
+        results = vs.search_ids(np.random.rand(384), top_k=len(table), heading="section 4")
+        assert results and all(table.heading(i)[-1] == "Section 4: Results" for i, _ in results), \
+            "Heading filter returned chunks from other sections"
+        print(f"✅ Structure-aware chunking working: {len(results)} of {len(table)} chunks searched for 'section 4'")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Structure-aware chunking error: {e}")
+        return False
+
+def test_rechunk():
+    """Test that new chunk settings are served from cached sentence vectors."""
+    print("\nTesting re-chunking without re-embedding...")
+    try:
+        import numpy as np
+        from rechunk import SentenceVectors
+        
+        calls = []
+        def embed(sentences):
+            calls.append(len(sentences))
+            vectors = np.random.default_rng(0).random((len(sentences), 8))
+            return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        
+        sections = [(" ".join(f"Sentence {i} of part {p} has six words." for i in range(30)), p, (f"Part {p}",))
+                    for p in range(3)]
+        vectors = SentenceVectors.build(sections, embed)
+        for chunk_size, overlap in ((20, 0), (50, 10), (200, 40)):
+            chunks, embeddings = vectors.assemble(chunk_size, overlap)
+            assert len(chunks) == len(embeddings), "Chunk and vector counts differ"
+            assert all(len(chunk.split()) <= chunk_size for chunk in chunks), "A chunk is over the size limit"
+            assert all(f"part {chunks.page(i)} " in chunks[i] for i in range(len(chunks))), \
+                "A chunk crosses a section"
+            assert np.allclose(np.linalg.norm(embeddings, axis=1), 1.0), "Pooled vectors are not normalized"
+        assert calls == [90], f"Sentences were embedded {len(calls)} times"
+        
+        # A repeated section collapses into its first occurrence, as in ingestion
+        repeated = SentenceVectors.build(sections + [(sections[0][0], 3, ("Appendix",))], embed)
+        chunks, embeddings = repeated.assemble(20, 0)
+        assert len(chunks) == len(embeddings) == len(vectors.assemble(20, 0)[0]), "Repeated chunks were not collapsed"
+        assert (3, ("Appendix",)) in chunks.locations(0), "Collapsed chunk lost its location"
+        print(f"✅ Re-chunking working: 3 chunk settings served from one pass over {calls[0]} sentences")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Re-chunking error: {e}")
+        return False
+
+def test_dedup():
+    """Test that near-duplicate chunks collapse into one with every source location."""
+    print("\nTesting near-duplicate chunk elimination...")
+    try:
+        from chunking import ChunkTable
+        from dedup import NearDuplicateIndex, collapse_near_duplicates
+        
+        footer = "Confidential. This report is provided for internal use only and may not be redistributed."
+        sections = []
+        for p in range(6):
+            body = " ".join(f"Page {p} discusses topic {p * 10 + i} in its own words." for i in range(12))
+            sections.append((body, p, ()))
+            sections.append((footer + (" Page %d." % p), p, ("Footer",)))
+        table = ChunkTable.from_sections(sections, chunk_size=200, overlap=0)
+        kept, duplicates = collapse_near_duplicates(table, threshold=0.7)
+        assert len(kept) == len(table) - 5, f"Expected 5 footers collapsed, got {len(table) - len(kept)}"
+        [(position, locations)] = duplicates.items()
+        assert kept[position].startswith("Confidential") and [page for page, _ in locations] == [1, 2, 3, 4, 5], \
+            "Duplicate locations were not recorded on the first footer"
+        
+        # Batches sharing an index catch duplicates of earlier batches
+        index = NearDuplicateIndex(threshold=0.7)
+        first, _ = collapse_near_duplicates(table.take(range(4)), index)
+        rest, later = collapse_near_duplicates(table.take(range(4, len(table))), index)
+        assert len(first) + len(rest) == len(kept) and set(later) == {position}, \
+            "Duplicates across batches were not collapsed"
+        
+        # A bounded index only remembers its most recent chunks, but keeps counting positions
+        window = NearDuplicateIndex(threshold=0.7, max_items=1)
+        windowed, recent = collapse_near_duplicates(table, window)
+        assert len(windowed) == len(table) and not recent and len(window) == len(table), \
+            "A chunk dropped from the window was still matched"
+        print(f"✅ Dedup working: {len(table)} chunks -> {len(kept)} embeddings")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Dedup error: {e}")
+        return False
+
+def test_token_chunking():
+    """Test that token chunks fit the embedding model window exactly."""
+    print("\nTesting token-aware chunking...")
+    try:
+        from chunking import ChunkTable
+        from embedding import get_tokenizer, max_chunk_tokens
+        
+        tokenizer = get_tokenizer()
+        window = max_chunk_tokens()
+        text = "\n\n".join(f"Section {i}: internationalization of tokenizers, measured in word-pieces." * 6
+                           for i in range(40))
+        table = ChunkTable.from_text(text, chunk_size=window, overlap=32, tokenizer=tokenizer)
+        sizes = [len(tokenizer(chunk, add_special_tokens=False)['input_ids']) for chunk in table]
+        assert max(sizes) <= window, f"A chunk has {max(sizes)} tokens, over the {window}-token window"
+        assert table.location(0)[0] == 0 and table.location(len(table) - 1)[1] == len(text), \
+            "Chunks do not cover the whole text"
+        print(f"✅ Token chunking working: {len(table)} chunks of at most {max(sizes)}/{window} tokens")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Token chunking error: {e}")
+        return False
+
+def test_bounded_memory():
+    """Test that spilling, chunking and deduplicating a large document stays under the memory ceiling, and failures clean up."""
+    print("\nTesting memory-bounded ingestion...")
+    try:
+        import subprocess
+        import tempfile
+        
+        limit_mb = 64
+        # Run in a fresh process so peak RSS only reflects this ingestion. VmHWM is used where
+        # available because ru_maxrss carries the parent's peak across fork/exec on Linux.
+        # Embeddings are stubbed and discarded, so the peak covers spilling, chunking and dedup.
+        script = f"""
+import os, resource, sys, tempfile
+import numpy as np
+import ingest_pipeline
+def peak_mb():
+    try:
+        with open('/proc/self/status') as status:
+            return next(int(line.split()[1]) for line in status if line.startswith('VmHWM')) / 1024
+    except (OSError, StopIteration):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+class DiscardingStore:
+    def add_embeddings(self, chunks, embeddings, doc_id=None, append=False):
+        pass
+    def add_chunk_sources(self, doc_id, duplicates):
+        pass
+ingest_pipeline.embed_chunks = lambda chunks, **kwargs: np.zeros((len(chunks), 8), dtype=np.float32)
+path = os.path.join(tempfile.mkdtemp(), 'large.txt')
+with open(path, 'w', encoding='utf-8') as f:
+    for i in range(400_000):
+        f.write(f"Line {{i}} of a very large document that would not fit the memory ceiling. " * 2 + "\\n")
+        if i % 2000 == 0:
+            f.write("Boilerplate repeated through the document, to be embedded only once.\\n" * 80)
+before = peak_mb()
+with open(path, 'rb') as f:
+    stats = ingest_pipeline.ingest_document(f, DiscardingStore(), memory_limit_mb={limit_mb})
+os.remove(path)
+growth_mb = peak_mb() - before
+print(stats['characters'], stats['chunks'], stats['duplicates'], growth_mb)
+"""
+        result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+        characters, chunks, duplicates, growth_mb = result.stdout.split()[-4:]
+        assert int(characters) > 50_000_000 and int(chunks) > 0, "Document was not fully ingested"
+        assert int(duplicates) > 0, "Repeated boilerplate was not collapsed"
+        assert float(growth_mb) < limit_mb, f"Peak RSS grew {float(growth_mb):.1f} MB, over the {limit_mb} MB ceiling"
+        
+        # A corrupt PDF fails without leaving its temporary copy behind
+        import io
+        from ingest_pipeline import ingest_document
+        from vector_store import VectorStore
+        saved_tempdir = tempfile.tempdir
+        with tempfile.TemporaryDirectory() as tmp:
+            tempfile.tempdir = tmp
+            try:
+                for _ in range(3):
+                    file = io.BytesIO(b"%PDF-1.7\n" + b"not really a PDF " * 1000)
+                    file.name = "broken.pdf"
+                    try:
+                        ingest_document(file, VectorStore(), memory_limit_mb=limit_mb)
+                        raise AssertionError("Corrupt PDF was ingested")
+                    except AssertionError:
+                        raise
+                    except Exception:
+                        pass
+            finally:
+                tempfile.tempdir = saved_tempdir
+            assert os.listdir(tmp) == [], f"Temporary files left behind: {os.listdir(tmp)}"
+        print(f"✅ Ingested {int(characters) / 1e6:.0f}M characters ({duplicates} duplicates collapsed) "
+              f"with {float(growth_mb):.1f} MB peak growth (ceiling {limit_mb} MB)")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Memory-bounded ingestion error: {e}")
+        return False
+
+def test_ingest_pipeline():
+    """Test streaming ingestion with a stub model: batches match one-shot chunking, dedup spans batches, errors surface."""
+    print("\nTesting ingestion pipeline...")
+    try:
+        import io
+        import zlib
+        import numpy as np
+        import ingest_pipeline
+        from chunking import ChunkTable
+        from dedup import collapse_near_duplicates
+        from ingestion import iter_document_sections
+        from vector_store import VectorStore
+        
+        def stub_embed(chunks, **kwargs):
+            # Deterministic vector per chunk text, so results can be compared across runs
+            return np.stack([np.random.default_rng(zlib.crc32(chunk.encode())).normal(size=16)
+                             for chunk in chunks]).astype('float32')
+        
+        def upload(data, name="doc.md"):
+            file = io.BytesIO(data)
+            file.name = name
+            return file
+        
+        # Long sections overlap across batch boundaries; every fifth one is a repeated disclaimer
+        document = "\n\n".join(
+            f"# Part {i}\n\n" + ("This disclaimer repeats word for word in every fifth part of it." if i % 5 == 4 else
+                                  " ".join(f"Part {i} sentence {j} covers topic {i * 7 + j}." for j in range(6)))
+            for i in range(20)).encode()
+        _, sections = iter_document_sections(upload(document))
+        expected, expected_sources = collapse_near_duplicates(
+            ChunkTable.from_sections(sections, chunk_size=12, overlap=3))
+        for position, locations in expected_sources.items():
+            expected.add_sources(position, locations)
+        
+        calls = []
+        def failing_embed(chunks, **kwargs):
+            calls.append(len(chunks))
+            if len(calls) == 3:
+                raise RuntimeError("model failed")
+            return stub_embed(chunks)
+        
+        saved = ingest_pipeline.embed_chunks
+        ingest_pipeline.embed_chunks = stub_embed
+        try:
+            vs = VectorStore()
+            stats = ingest_pipeline.ingest_document(upload(document), vs, chunk_size=12, overlap=3,
+                                                    doc_id="doc", batch_size=4)
+            # Reduced after 8 vectors, so the store only holds projections of most of them
+            reduced = VectorStore(reduce_dim=4, reduction='pca', train_size=8)
+            kept = ingest_pipeline.ingest_document(upload(document), reduced, chunk_size=12, overlap=3,
+                                                   doc_id="doc", batch_size=4, keep_text=True,
+                                                   sentence_vectors=True)
+            ingest_pipeline.embed_chunks = failing_embed
+            try:
+                ingest_pipeline.ingest_document(upload(document), VectorStore(), chunk_size=12, overlap=3,
+                                                doc_id="doc", batch_size=4)
+                raise AssertionError("Embedding error was not raised")
+            except RuntimeError as e:
+                assert str(e) == "model failed", f"Unexpected error {e!r}"
+        finally:
+            ingest_pipeline.embed_chunks = saved
+        
+        chunks, embeddings = vs.get_document("doc")
+        assert list(chunks) == list(expected), "Batched chunks differ from chunking the document at once"
+        assert [chunks.locations(i) for i in range(len(chunks))] == \
+            [expected.locations(i) for i in range(len(expected))] and expected_sources, \
+            "Pages, headings or collapsed duplicates were placed at the wrong rows"
+        assert stats['chunks'] == len(expected) and stats['duplicates'] == sum(map(len, expected_sources.values()))
+        assert np.array_equal(embeddings, stub_embed(list(chunks))), "Embeddings were stored at the wrong rows"
+        
+        reduced_chunks, _ = reduced.get_document("doc")
+        assert reduced.reduced and np.array_equal(kept['embeddings'], stub_embed(list(reduced_chunks))), \
+            "Returned embeddings are not the ones the model computed"
+        sentences = kept['sentence_vectors']
+        assert sentences.text == kept['text'] and len(sentences.vectors) == len(sentences.sentences) > len(chunks), \
+            "Sentence vectors were not built with the document"
+        print(f"✅ Ingestion pipeline working: {stats['chunks']} chunks indexed in batches of 4, "
+              f"{stats['duplicates']} duplicates collapsed across batches")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Ingestion pipeline error: {e}")
+        return False
+
+def test_ingestion_job():
+    """Test that a document can be searched while a background job is still indexing it, and job errors."""
+    print("\nTesting background ingestion job...")
+    try:
+        import io
+        import threading
+        import time
+        import numpy as np
+        import ingest_pipeline
+        from ingest_pipeline import IngestionJob
+        from vector_store import VectorStore
+        
+        release = threading.Event()
+        def blocking_embed(chunks, **kwargs):
+            # The first batch is indexed at once, the rest wait until released
+            if blocking_embed.calls and not release.wait(timeout=10):
+                raise RuntimeError("test was not released")
+            blocking_embed.calls += 1
+            return np.array([[len(chunk), 1.0] for chunk in chunks], dtype='float32')
+        blocking_embed.calls = 0
+        
+        def failing_embed(chunks, **kwargs):
+            raise RuntimeError("model failed")
+        
+        def upload():
+            file = io.BytesIO("\n\n".join(f"Paragraph {i} about item {i}." for i in range(60)).encode())
+            file.name = "doc.txt"
+            return file
+        
+        saved = ingest_pipeline.embed_chunks
+        ingest_pipeline.embed_chunks = blocking_embed
+        try:
+            vs = VectorStore()
+            job = IngestionJob(upload(), vs, chunk_size=8, overlap=2, doc_id="doc", batch_size=4)
+            deadline = time.time() + 10
+            while not vs.has_document("doc") and time.time() < deadline:
+                time.sleep(0.01)
+            results = vs.search_ids([30.0, 1.0], top_k=3, doc_id="doc")
+            assert not job.done and 0 < len(results) <= 4, "Partly indexed document could not be searched"
+            release.set()
+            assert job.wait(timeout=10) and job.error is None, f"Job did not finish cleanly: {job.error}"
+            assert vs.documents["doc"] == job.stats['chunks'] > 4, "Job did not index the whole document"
+            
+            ingest_pipeline.embed_chunks = failing_embed
+            failed = IngestionJob(upload(), VectorStore(), chunk_size=8, overlap=2, doc_id="doc", batch_size=4)
+            assert failed.wait(timeout=10) and isinstance(failed.error, RuntimeError) and failed.stats is None, \
+                "Job error was not recorded"
+        finally:
+            release.set()
+            ingest_pipeline.embed_chunks = saved
+        print(f"✅ Background ingestion working: searched {len(results)} chunks mid-index, "
+              f"{job.stats['chunks']} indexed in the end")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Background ingestion error: {e}")
+        return False
+
+class WordEncoding(dict):
+    def word_ids(self, i):
+        return list(range(len(self['offset_mapping'][i])))
+
+class WordTokenizer:
+    """Whitespace "tokens" with the fast-tokenizer interface the chunker uses; module-level so workers can unpickle it."""
+    def __call__(self, texts, **kwargs):
+        offsets = [[match.span() for match in re.finditer(r'\S+', text)] for text in texts]
+        return WordEncoding(offset_mapping=offsets, input_ids=[[0] * len(o) for o in offsets])
+
+def test_bulk_ingest():
+    """Test that bulk ingestion with a stub model indexes a directory and a re-run only adds new files."""
+    print("\nTesting bulk ingestion...")
+    try:
+        import tempfile
+        import numpy as np
+        import embedding
+        import bulk_ingest
+        from vector_store import VectorStore
+        
+        def stub_embed(chunks, **kwargs):
+            return np.array([[len(chunk), chunk.count(" "), 1.0] for chunk in chunks], dtype='float32')
+        
+        def write(directory, name, topic):
+            with open(os.path.join(directory, name), "w", encoding="utf-8") as f:
+                f.write("\n\n".join(f"{topic} note {i} explains detail {i * 3} at some length." for i in range(12)))
+        
+        # Parser workers are sent the stub tokenizer; only this process embeds
+        saved = embedding.embed_chunks
+        embedding.embed_chunks = stub_embed
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                source, output = os.path.join(tmp, "docs"), os.path.join(tmp, "index")
+                os.makedirs(source)
+                for i, topic in enumerate(["Invoices", "Contracts", "Payroll"]):
+                    write(source, f"doc{i}.txt", topic)
+                first = bulk_ingest.ingest(source, output, workers=2, chunk_size=16, overlap=4,
+                                           checkpoint_every=1, tokenizer=WordTokenizer())
+                write(source, "doc3.md", "Travel")
+                second = bulk_ingest.ingest(source, output, workers=2, chunk_size=16, overlap=4,
+                                            tokenizer=WordTokenizer())
+                store = VectorStore.load(output)
+        finally:
+            embedding.embed_chunks = saved
+        assert first['documents'] == 3 and first['failed'] == 0, f"First run did not index every file: {first}"
+        assert second['documents'] == 1 and second['skipped'] == 3, f"Re-run did not skip indexed files: {second}"
+        assert len(store.documents) == 4 and store.index.ntotal == sum(store.documents.values()) == \
+            first['chunks'] + second['chunks'], "Resumed index has missing or duplicate chunks"
+        assert store.model_id == embedding.MODEL_ID, "Index does not record its embedding model"
+        print(f"✅ Bulk ingestion working: {first['chunks']} chunks indexed, re-run added only the new file")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Bulk ingestion error: {e}")
+        return False
+
 def test_vector_store():
     """Test vector store functionality."""
     print("\nTesting vector store...")
@@ -92,6 +995,144 @@ def test_vector_store():
         print(f"❌ Vector store error: {e}")
         return False
 
+def test_dimension_reduction():
+    """Test PCA and truncation of stored vectors: fitted per corpus, queries projected, recall reported."""
+    print("\nTesting dimension reduction...")
+    try:
+        import tempfile
+        import numpy as np
+        from vector_store import VectorStore
+        
+        # 64-dim vectors that mostly vary along 8 directions
+        rng = np.random.default_rng(0)
+        vectors = (rng.normal(size=(1200, 8)) @ rng.normal(size=(8, 64)) +
+                   0.05 * rng.normal(size=(1200, 64))).astype('float32')
+        vs = VectorStore(reduce_dim=8, reduction='pca', train_size=1000)
+        for start in range(0, 1200, 300):
+            vs.add_embeddings([f"chunk {i}" for i in range(start, start + 300)], vectors[start:start + 300],
+                              doc_id=f"doc {start // 300}")
+            assert vs.reduced == (vs.index.ntotal >= 1000), "PCA was fitted before train_size vectors"
+        assert vs.reduced and vs.index.ntotal == 1200, "PCA was not fitted after train_size vectors"
+        assert vs.reduction_recall >= 0.8, f"PCA recall@10 too low: {vs.reduction_recall}"
+        assert vs.search_ids(vectors[1100], top_k=1)[0][0] == 1100, "Query was not projected like the chunks"
+        vs.remove_document("doc 0")
+        chunks, embeddings = vs.get_document("doc 3")
+        assert embeddings.shape == (300, 64) and vs.search_ids(vectors[1100], top_k=1)[0][0] == 800, \
+            "Removal or reconstruction broke the reduced index"
+        with tempfile.TemporaryDirectory() as tmp:
+            vs.save(tmp + "/index")
+            loaded = VectorStore.load(tmp + "/index")
+        assert loaded.reduced and loaded.reduction_recall == vs.reduction_recall, "Reduction lost on reload"
+        
+        normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        truncated = VectorStore(reduce_dim=32, reduction='truncate')
+        truncated.add_embeddings([f"chunk {i}" for i in range(1200)], normalized)
+        recall = truncated.fit_reduction()
+        assert truncated.reduced and truncated.index.ntotal == 1200 and 0 < recall <= 1, "Truncation was not applied"
+        print(f"✅ Dimension reduction working: 64 -> 8 dims by PCA at recall@10 {vs.reduction_recall:.3f}, "
+              f"64 -> 32 by truncation at {recall:.3f}")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Dimension reduction error: {e}")
+        return False
+
+def test_store_persistence():
+    """Test that a saved store reloads memory-mapped with the same chunks and results, and survives an interrupted save."""
+    print("\nTesting vector store persistence...")
+    try:
+        import os
+        import tempfile
+        import numpy as np
+        from chunking import ChunkTable, EncodedText
+        from vector_store import VectorStore
+        
+        sections = [("Café résumé — naïve façade. " * 30, 0, ("Überblick",)),
+                    ("Plain ASCII text about invoices. " * 30, 1, ("Billing", "Invoices")),
+                    ("Emoji 📄 and CJK 文書 mixed in. " * 30, 2, ())]
+        table = ChunkTable.from_sections(sections, chunk_size=20, overlap=4)
+        table.add_sources(1, [(3, ("Appendix",))])
+        rng = np.random.default_rng(0)
+        vs = VectorStore()
+        vs.add_embeddings(table, rng.random((len(table), 16), dtype=np.float32), doc_id="doc-a")
+        vs.add_embeddings(["A note.", "Another note."], rng.random((2, 16), dtype=np.float32), doc_id="doc-b")
+        query = rng.random(16, dtype=np.float32)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "index")
+            vs.save(path)
+            for mmap in (True, False):
+                loaded = VectorStore.load(path, mmap=mmap)
+                assert list(loaded.chunks) == list(vs.chunks), "Chunk texts changed on reload"
+                assert [loaded.chunks.locations(i) for i in range(len(vs.chunks))] == \
+                    [vs.chunks.locations(i) for i in range(len(vs.chunks))], "Chunk metadata changed on reload"
+                assert loaded.search_ids(query, top_k=5) == vs.search_ids(query, top_k=5), "Search results changed"
+                assert isinstance(loaded.chunks.buffers[0], EncodedText) and loaded.documents == vs.documents
+            
+            # A mapped store can be edited and saved over the files it maps
+            loaded.add_embeddings(["Added later."], rng.random((1, 16), dtype=np.float32), doc_id="doc-c")
+            loaded.remove_document("doc-b")
+            loaded.save(path)
+            reloaded = VectorStore.load(path)
+            assert reloaded.chunks[len(table)] == "Added later." and reloaded.index.ntotal == len(table) + 1, \
+                "Edits to a mapped store were lost"
+            
+            # A save interrupted between its two renames leaves only path + '.old'
+            os.rename(path, path + ".old")
+            assert VectorStore.exists(path) and VectorStore.load(path).index.ntotal == len(table) + 1, \
+                "Store was lost between the renames of a save"
+            VectorStore.load(path).save(path)
+            assert os.path.isdir(path) and not os.path.exists(path + ".old"), "Next save did not recover"
+        print(f"✅ Store persistence working: {len(vs.chunks)} chunks reloaded memory-mapped")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Store persistence error: {e}")
+        return False
+
+def test_document_identity():
+    """Test that re-adding the same document does not duplicate chunks."""
+    print("\nTesting document identity...")
+    try:
+        import tempfile
+        import numpy as np
+        from vector_store import VectorStore
+        from utils import document_id
+        
+        chunks = ["First chunk of the document.", "Second chunk of the document."]
+        embeddings = np.random.rand(len(chunks), 384).astype('float32')
+        doc_id = document_id(b"document bytes", 500, 50)
+        
+        vs = VectorStore()
+        assert vs.add_embeddings(chunks, embeddings, doc_id=doc_id)
+        assert not vs.add_embeddings(chunks, embeddings, doc_id=doc_id), "Repeat add was not a no-op"
+        assert vs.index.ntotal == len(chunks), "Chunks were duplicated in the index"
+        
+        # Replacing swaps the old chunks for the new ones
+        assert vs.add_embeddings(chunks[:1], embeddings[:1], doc_id=doc_id, replace=True)
+        assert vs.index.ntotal == 1 and vs.chunks == chunks[:1], "Replace did not drop the old chunks"
+        
+        # The chunk unit and embedding model are part of the identity, and the model of a saved store
+        from embedding import MODEL_ID
+        assert document_id(b"document bytes", 500, 50, model_id=MODEL_ID) == doc_id != \
+            document_id(b"document bytes", 500, 50, model_id=MODEL_ID + "@onnx-int8"), \
+            "Documents embedded by another model share an identity"
+        assert doc_id != document_id(b"document bytes", 500, 50, chunk_unit='tokens'), \
+            "Documents chunked by tokens and by words share an identity"
+        with tempfile.TemporaryDirectory() as tmp:
+            VectorStore(model_id="model-a").save(tmp + "/index")
+            assert VectorStore.load(tmp + "/index", model_id="model-a").model_id == "model-a"
+            try:
+                VectorStore.load(tmp + "/index", model_id="model-b")
+                raise AssertionError("Store built by another model was loaded")
+            except ValueError:
+                pass
+        print(f"✅ Document identity working: {vs.index.ntotal} chunk indexed after re-adds")
+        
+        return True
+    except Exception as e:
+        print(f"❌ Document identity error: {e}")
+        return False
+
 def test_retrieval():
     """Test retrieval functionality."""
     print("\nTesting retrieval...")
@@ -155,9 +1196,33 @@ def main():
     
     tests = [
         test_imports,
+        test_import_time,
+        test_parallel_pdf,
+        test_pdf_backends,
+        test_text_extraction,
         test_embedding,
+        test_embedding_cache,
+        test_document_cache,
+        test_query_cache,
+        test_query_batcher,
+        test_embedding_engine,
+        test_onnx_backend,
         test_chunking,
+        test_streaming_chunks,
+        test_normalizer,
+        test_chunk_table,
+        test_structured_chunks,
+        test_rechunk,
+        test_dedup,
+        test_token_chunking,
+        test_bounded_memory,
+        test_ingest_pipeline,
+        test_ingestion_job,
+        test_bulk_ingest,
         test_vector_store,
+        test_dimension_reduction,
+        test_store_persistence,
+        test_document_identity,
         test_retrieval,
         test_rag_pipeline
     ]
@@ -2,16 +2,175 @@
 Utility functions for the Document Q&A system.
 """
 
+import hashlib
 import re
+import unicodedata
+
+# Control and invisible formatting characters (soft hyphen, zero-width space, BOM)
+_CONTROL = r'\x00-\x08\x0e-\x1b\x7f-\x84\x86-\x9f\u00ad\u200b\ufeff'
+# One regex pass per buffer. The single leading class lets the engine skip
+# straight to candidates; the branches then pick out a hyphen breaking a word
+# across a line, a whitespace run, lone whitespace other than a space (or,
+# keeping paragraphs, a newline), and control characters
+_NORMALIZE_PATTERN = (
+	r'[-\s{control}]'
+	r'(?:(?<=[^\W\d_]-)[^\S\n]*\n[^\S\n]*(?=[^\W\d_])'
+	r'|(?<=\s)\s+'
+	r'|(?<=[^\S {keep}])'
+	r'|(?<=[{control}])[{control}]*)'
+)
+_NORMALIZE = {
+	True: re.compile(_NORMALIZE_PATTERN.format(control=_CONTROL, keep='\\n')),
+	False: re.compile(_NORMALIZE_PATTERN.format(control=_CONTROL, keep='')),
+}
+# A word hyphenated at the very end of a buffer, rejoined with the start of the next one
+_HYPHEN_TAIL = re.compile(r'[^\W\d_]+-\s*\Z')
+_HYPHEN_TAIL_CHARS = 256
+
+class TextNormalizer:
+	def __init__(self, paragraphs=True, dehyphenate=True):
+		"""
+		Incremental text normalizer for page-sized buffers: Unicode NFKC,
+		control-character removal, whitespace collapse and de-hyphenation of
+		words broken across lines, in one regex pass per buffer. Only the
+		buffer being fed is copied, never the whole document.
+		Args:
+			paragraphs (bool): Keep line and paragraph breaks as '\\n' and '\\n\\n'
+				instead of collapsing every whitespace run to one space
+			dehyphenate (bool): Rejoin words hyphenated at a line or page break
+		"""
+		self.paragraphs = paragraphs
+		self.dehyphenate = dehyphenate
+		self._carry = ''
+		self._replacements = {}
+
+	def _space(self, run):
+		if not self.paragraphs:
+			return ' '
+		newlines = run.count('\n')
+		return '\n\n' if newlines > 1 else '\n' if newlines else ' '
+
+	def _replace(self, match):
+		run = match.group()
+		replacement = self._replacements.get(run)
+		if replacement is not None:
+			return replacement
+		if run[0] == '-':
+			# Only a lower-case continuation is the rest of the same word
+			if self.dehyphenate and match.string[match.end()].islower():
+				return ''
+			return '-' + self._space(run[1:])
+		replacement = self._space(run) if run[0].isspace() else ''
+		if len(run) <= 8:
+			# The same few short runs make up most matches
+			self._replacements[run] = replacement
+		return replacement
+
+	def _normalize(self, text):
+		if not text.isascii() and not unicodedata.is_normalized('NFKC', text):
+			text = unicodedata.normalize('NFKC', text)
+		return _NORMALIZE[self.paragraphs].sub(self._replace, text).strip()
+
+	def feed(self, text):
+		"""
+		Normalize the next buffer (typically a page).
+		A word hyphenated at the end of the buffer is held back and joined
+		with the start of the next buffer, or returned by finish().
+		Returns:
+			str: The normalized buffer, without leading or trailing whitespace
+		"""
+		if self._carry:
+			text = self._carry + text
+			self._carry = ''
+		if self.dehyphenate:
+			tail = _HYPHEN_TAIL.search(text, max(0, len(text) - _HYPHEN_TAIL_CHARS))
+			if tail:
+				self._carry = text[tail.start():].rstrip() + '\n'
+				text = text[:tail.start()]
+		return self._normalize(text)
+
+	def finish(self):
+		"""
+		Returns:
+			str: The normalized text still held back after the last buffer
+		"""
+		carry, self._carry = self._carry, ''
+		return self._normalize(carry)
+
+def normalize_sections(sections, **options):
+	"""
+	Normalize a stream of (text, *metadata) sections with one TextNormalizer.
+	A hyphenated word split across two sections moves to the second one.
+	Args:
+		sections (Iterable[Tuple[str, ...]]): Section text followed by any metadata
+		**options: Passed to TextNormalizer
+	Yields:
+		Tuple[str, ...]: Sections with normalized text and unchanged metadata
+	"""
+	normalizer = TextNormalizer(**options)
+	previous = None
+	for text, *metadata in sections:
+		current = (normalizer.feed(text), *metadata)
+		if previous is not None:
+			yield previous
+		previous = current
+	if previous is not None:
+		tail = normalizer.finish()
+		if tail:
+			previous = (' '.join(filter(None, (previous[0], tail))), *previous[1:])
+		yield previous
 
 def clean_text(text):
 	"""
 	Basic text cleaning: removes extra whitespace and non-printable characters.
+	Also applies Unicode NFKC and rejoins words hyphenated across lines.
 	Args:
 		text (str): Input text
 	Returns:
 		str: Cleaned text
 	"""
-	text = re.sub(r'\s+', ' ', text)  # Collapse whitespace
-	text = re.sub(r'[\x00-\x1f\x7f-\x9f]', '', text)  # Remove non-printable chars
-	return text.strip()
+	normalizer = TextNormalizer(paragraphs=False)
+	return ' '.join(filter(None, (normalizer.feed(text), normalizer.finish())))
+
+
+def parse_page_ranges(text):
+	"""
+	Parse a page selection such as "3-5, 8" typed by a user.
+	Args:
+		text (str): Comma-separated page numbers and ranges, counting from 1
+	Returns:
+		Set[int]: Selected pages, counting from 0 as chunk metadata does
+	Raises:
+		ValueError: If the selection is malformed
+	"""
+	pages = set()
+	for part in text.split(','):
+		part = part.strip()
+		if not part:
+			continue
+		first, _, last = part.partition('-')
+		first, last = int(first), int(last or first)
+		if first < 1 or last < first:
+			raise ValueError(f"Invalid page range: {part}")
+		pages.update(range(first - 1, last))
+	return pages
+
+
+def document_id(data, chunk_size, overlap, chunk_unit='words', model_id=None):
+	"""
+	Content-addressed identity of a document as it will be indexed.
+	Args:
+		data (bytes): Raw uploaded file contents
+		chunk_size (int): Chunk size used to split the document
+		overlap (int): Chunk overlap used to split the document
+		chunk_unit (str): 'words' or 'tokens', the unit of chunk_size and overlap, or
+			'pooled-tokens' for token-sized chunks pooled from sentence vectors (see rechunk.py)
+		model_id (str): Embedding model and backend (defaults to embedding.MODEL_ID)
+	Returns:
+		str: Hex SHA-256 of the bytes plus the chunking parameters and model
+	"""
+	if model_id is None:
+		from embedding import MODEL_ID as model_id
+	digest = hashlib.sha256(data)
+	digest.update(f"|chunk_size={chunk_size}|overlap={overlap}|unit={chunk_unit}|model={model_id}".encode('utf-8'))
+	return digest.hexdigest()
@@ -4,46 +4,345 @@ Handles storage and retrieval of embeddings using FAISS/ChromaDB/etc.
 """
 
 
+import json
+import os
+import shutil
+import threading
 import faiss
 import numpy as np
+from chunking import ChunkTable
+
+# Version of the on-disk layout written by VectorStore.save (chunk texts in a
+# memory-mappable text.bin); load refuses any other
+LAYOUT_VERSION = 1
+
+# Optional dimension reduction of stored vectors (see VectorStore.fit_reduction):
+# 'pca' projects onto a faiss PCAMatrix fitted on the corpus, 'truncate' keeps the
+# leading dimensions of a Matryoshka-trained model; REDUCE_DIM=0 stores full vectors
+REDUCTION = os.getenv('DOCUMIND_REDUCTION', 'pca')
+REDUCE_DIM = int(os.getenv('DOCUMIND_REDUCE_DIM', '0'))
+# Vectors indexed at full dimension before the reduction is fitted automatically
+REDUCE_TRAIN_SIZE = int(os.getenv('DOCUMIND_REDUCE_TRAIN_SIZE', '4096'))
+# Neighbours compared, for up to RECALL_QUERIES stored vectors, when a fit reports its recall
+RECALL_K = 10
+RECALL_QUERIES = 256
+
+def recall_at_k(baseline, candidate, queries, k=RECALL_K, exclude=None):
+    """
+    Fraction of each query's k nearest neighbours in baseline that candidate also returns.
+    Args:
+        baseline (faiss.Index): Reference index, e.g. over full-dimension vectors
+        candidate (faiss.Index): Index over the same vectors, in the same order
+        queries (np.ndarray): float32 query vectors of the baseline's dimension
+        exclude (Sequence[int]): Row of each query when queries are stored
+            vectors, so a query is not counted as its own neighbour
+    Returns:
+        float: Mean recall@k
+    """
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    extra = 0 if exclude is None else 1
+    k = min(k, baseline.ntotal - extra)
+    if k <= 0 or len(queries) == 0:
+        return 1.0
+    _, expected = baseline.search(queries, k + extra)
+    _, found = candidate.search(queries, k + extra)
+    total = 0
+    for i in range(len(queries)):
+        skip = None if exclude is None else exclude[i]
+        want = [row for row in expected[i] if row != skip][:k]
+        got = [row for row in found[i] if row != skip][:k]
+        total += len(set(want) & set(got))
+    return total / (k * len(queries))
 
 class VectorStore:
-    def __init__(self):
+    def __init__(self, reduce_dim=REDUCE_DIM, reduction=REDUCTION, train_size=REDUCE_TRAIN_SIZE, model_id=None):
         """
         Initialize the vector store (in-memory FAISS index and chunk mapping).
+        All methods are safe to call while another thread is still adding,
+        so a document can be queried while it is being indexed.
+        The index holds the only copy of the vectors. With reduce_dim set,
+        vectors are indexed at full dimension until train_size of them are
+        stored (or fit_reduction is called), then reduced to reduce_dim; the
+        index projects queries the same way.
+        Args:
+            reduce_dim (int): Dimension of stored vectors; 0 keeps them whole
+            reduction (str): 'pca' or 'truncate' (for Matryoshka models)
+            train_size (int): Vectors indexed before the reduction is fitted
+            model_id (str): Embedding model and backend the vectors come from
+                (see embedding.MODEL_ID); saved, and checked by load
+        Raises:
+            ValueError: If reduction is not 'pca' or 'truncate'
         """
-        self.embeddings = None  # Will be a numpy array
-        self.chunks = []        # List of text chunks
-        self.index = None       # FAISS index
+        if reduction not in ('pca', 'truncate'):
+            raise ValueError(f"Unknown dimension reduction: {reduction}")
+        self.chunks = ChunkTable()      # Chunk offsets into shared text buffers; row = chunk ID
+        self.index = None               # FAISS index
+        self.documents = {}             # doc_id -> number of chunks indexed for it
+        self.reduce_dim = reduce_dim
+        self.reduction = reduction
+        self.train_size = train_size
+        self.model_id = model_id
+        self.reduction_recall = None    # recall@RECALL_K of the fitted reduction
+        self._index_mapped = False      # index vectors are a read-only memory map (see load)
+        self._lock = threading.RLock()
+
+    @property
+    def reduced(self):
+        """True once stored vectors are dimension-reduced."""
+        return isinstance(self.index, faiss.IndexPreTransform)
+
+    @property
+    def chunk_doc_ids(self):
+        """doc_id of each chunk (None when added anonymously)."""
+        return [self.chunks.doc_id(i) for i in range(len(self.chunks))]
 
-    def add_embeddings(self, chunks, embeddings):
+    def has_document(self, doc_id):
+        """
+        Check whether a document (see utils.document_id) is already indexed.
+        """
+        return doc_id in self.documents
+
+    def add_embeddings(self, chunks, embeddings, doc_id=None, replace=False, append=False):
         """
         Add text chunks and their embeddings to the store.
+        chunks is a ChunkTable (its text buffers are shared, not copied)
+        or a list of strings; embeddings is a float32 array, used without a
+        copy when contiguous (nested lists are converted). Adding a doc_id that is already indexed is a no-op, or replaces
+        the previous chunks when replace=True. append=True extends a
+        document that is being indexed batch by batch.
+        Returns:
+            bool: True if the chunks were added
+        """
+        with self._lock:
+            if doc_id is not None and doc_id in self.documents and not append:
+                if not replace:
+                    return False
+                self.remove_document(doc_id)
+            if doc_id is not None:
+                self.documents[doc_id] = self.documents.get(doc_id, 0) + len(chunks)
+            if len(chunks) == 0:
+                return True
+            embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+            if self.index is None:
+                self.index = faiss.IndexFlatL2(embeddings.shape[1])
+            self.chunks.extend(chunks, doc_id)
+            self._writable_index().add(embeddings)
+            if self.reduce_dim and not self.reduced and self.index.ntotal >= self.train_size:
+                self.fit_reduction()
+            return True
+
+    def _writable_index(self):
+        """Copy a memory-mapped index into memory before it is modified."""
+        if self._index_mapped:
+            self.index = faiss.deserialize_index(faiss.serialize_index(self.index))
+            self._index_mapped = False
+        return self.index
+
+    def fit_reduction(self):
+        """
+        Fit the dimension reduction on the vectors indexed so far and re-index
+        them reduced; every later vector and query is projected the same way.
+        Runs by itself once train_size vectors are stored; calling it earlier
+        reduces a smaller corpus, at the cost of a fit on fewer vectors.
+        The reduction is fitted once. Its recall@RECALL_K against the full
+        vectors, over up to RECALL_QUERIES stored vectors used as queries,
+        is kept in reduction_recall.
+        Returns:
+            float: recall@k of the fit, or None when reduction is off, already
+                fitted or (for PCA) there are no more vectors than reduce_dim
+        """
+        with self._lock:
+            if not self.reduce_dim or self.index is None or self.reduced:
+                return None
+            dim = self.index.d
+            if self.reduce_dim >= dim or (self.reduction == 'pca' and self.index.ntotal <= self.reduce_dim):
+                return None
+            vectors = self.index.reconstruct_n(0, self.index.ntotal)
+            if self.reduction == 'pca':
+                index = faiss.IndexPreTransform(faiss.PCAMatrix(dim, self.reduce_dim),
+                                                faiss.IndexFlatL2(self.reduce_dim))
+                index.train(vectors)
+            else:
+                # Matryoshka: keep the leading dimensions, then re-normalize
+                index = faiss.IndexPreTransform(faiss.NormalizationTransform(self.reduce_dim),
+                                                faiss.IndexFlatL2(self.reduce_dim))
+                index.prepend_transform(faiss.RemapDimensionsTransform(dim, self.reduce_dim, False))
+            index.add(vectors)
+            self._index_mapped = False
+            sample = np.unique(np.linspace(0, len(vectors) - 1, min(RECALL_QUERIES, len(vectors))).astype(np.int64))
+            self.reduction_recall = recall_at_k(self.index, index, vectors[sample], RECALL_K, exclude=sample)
+            self.index = index
+            return self.reduction_recall
+
+    def add_chunk_sources(self, doc_id, duplicates):
+        """
+        Record where collapsed near-duplicates of a document's chunks were found.
+        Args:
+            duplicates (Dict[int, List[Tuple]]): (page, heading path) locations by the
+                chunk's position within the document (see dedup.collapse_near_duplicates)
+        """
+        with self._lock:
+            rows = self.chunks.rows(doc_id)
+            for position, locations in duplicates.items():
+                self.chunks.add_sources(rows[position], locations)
+
+    def get_document(self, doc_id):
+        """
+        Return the chunks and embeddings indexed for a document.
+        Embeddings are read back from the index; once it is reduced they are
+        reconstructed at full dimension from the reduced vectors (approximately).
+        Returns:
+            Tuple[ChunkTable, np.ndarray]: (chunks with their page/heading metadata, float32 embeddings)
         """
-        embeddings = np.array(embeddings).astype('float32')
-        if self.embeddings is None:
-            self.embeddings = embeddings
-            self.chunks = list(chunks)
-            self.index = faiss.IndexFlatL2(embeddings.shape[1])
-            self.index.add(embeddings)
-        else:
-            self.embeddings = np.vstack([self.embeddings, embeddings])
-            self.chunks.extend(chunks)
-            self.index.add(embeddings)
+        with self._lock:
+            rows = self.chunks.rows(doc_id)
+            if not rows:
+                return ChunkTable(), np.zeros((0, self.index.d if self.index else 0), dtype='float32')
+            return self.chunks.take(rows), self.index.reconstruct_batch(np.asarray(rows, dtype=np.int64))
 
-    def search(self, query_embedding, top_k=5):
+    def remove_document(self, doc_id):
+        """
+        Drop every chunk of a document; later chunk IDs shift down to stay dense.
+        Returns:
+            bool: True if the document was indexed
+        """
+        with self._lock:
+            if doc_id not in self.documents:
+                return False
+            del self.documents[doc_id]
+            removed = set(self.chunks.rows(doc_id))
+            if not removed:
+                return True
+            keep = [i for i in range(len(self.chunks)) if i not in removed]
+            self.chunks = self.chunks.take(keep)
+            # Flat indexes compact in order on removal, matching take(keep)
+            self._writable_index().remove_ids(faiss.IDSelectorBatch(np.fromiter(sorted(removed), dtype=np.int64)))
+            return True
+
+    def search_ids(self, query_embedding, top_k=5, doc_id=None, pages=None, heading=None):
+        """
+        Retrieve the IDs of the top-k most similar chunks for a query embedding.
+        IDs index self.chunks and stay valid until a document is removed.
+        doc_id, pages and heading pre-filter by chunk metadata (see
+        ChunkTable.filter_rows) so only matching chunks are scanned.
+        Returns list of tuples: (chunk_id, similarity_score)
+        """
+        with self._lock:
+            if self.index is None or len(self.chunks) == 0:
+                return []
+            query = np.ascontiguousarray(query_embedding, dtype=np.float32).reshape(1, -1)
+            if doc_id is None and pages is None and heading is None:
+                distances, indices = self.index.search(query, top_k)
+            else:
+                rows = self.chunks.filter_rows(doc_id=doc_id, pages=pages, heading=heading)
+                if len(rows) == 0:
+                    return []
+                selector = faiss.IDSelectorBatch(rows)
+                distances, indices = self.index.search(
+                    query, min(top_k, len(rows)), params=faiss.SearchParameters(sel=selector)
+                )
+            results = []
+            for i, idx in enumerate(indices[0]):
+                if 0 <= idx < len(self.chunks):
+                    # Convert distance to similarity score (lower distance = higher similarity)
+                    similarity = 1.0 / (1.0 + distances[0][i])
+                    results.append((int(idx), similarity))
+            return results
+
+    def get_chunks(self, chunk_ids):
+        """
+        Materialize the text of the given chunks.
+        Returns:
+            List[str]: Chunk texts, in the order of chunk_ids
+        """
+        with self._lock:
+            return [self.chunks[i] for i in chunk_ids]
+
+    def search(self, query_embedding, top_k=5, **filters):
         """
         Retrieve top-k most similar chunks for a query embedding.
+        Accepts the same metadata filters as search_ids.
         Returns list of tuples: (chunk, similarity_score)
         """
-        if self.index is None or self.embeddings is None or len(self.chunks) == 0:
-            return []
-        query = np.array(query_embedding).astype('float32').reshape(1, -1)
-        distances, indices = self.index.search(query, top_k)
-        results = []
-        for i, idx in enumerate(indices[0]):
-            if idx < len(self.chunks):
-                # Convert distance to similarity score (lower distance = higher similarity)
-                similarity = 1.0 / (1.0 + distances[0][i])
-                results.append((self.chunks[idx], similarity))
-        return results
+        with self._lock:
+            return [(self.chunks[i], score) for i, score in self.search_ids(query_embedding, top_k, **filters)]
+
+    def save(self, path):
+        """
+        Write the index, chunks and document ids to a directory:
+        meta.json (layout version, model, documents, reduction and chunk metadata),
+        index.faiss, and the chunk table as text.bin and rows.bin (see ChunkTable.write).
+        The directory is replaced by renames, so a crash mid-save leaves the
+        previous copy intact (as path + '.old' if it came between the renames,
+        which load and exists fall back to); saving over the directory a store
+        was loaded from (memory-mapped or not) is safe.
+        """
+        with self._lock:
+            tmp = path.rstrip(os.sep) + '.tmp'
+            shutil.rmtree(tmp, ignore_errors=True)
+            os.makedirs(tmp)
+            if self.index is not None:
+                faiss.write_index(self.index, os.path.join(tmp, 'index.faiss'))
+            chunks = self.chunks.write(tmp)
+            with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump({'version': LAYOUT_VERSION, 'model': self.model_id,
+                           'count': len(self.chunks), 'documents': self.documents,
+                           'reduction': {'method': self.reduction, 'dim': self.reduce_dim,
+                                         'train_size': self.train_size, 'recall': self.reduction_recall},
+                           'chunks': chunks}, f)
+        old = path.rstrip(os.sep) + '.old'
+        if os.path.isdir(path):
+            shutil.rmtree(old, ignore_errors=True)
+            os.rename(path, old)
+        os.rename(tmp, path)
+        shutil.rmtree(old, ignore_errors=True)
+
+    @staticmethod
+    def _saved_path(path):
+        """The directory holding the last completed save: path, or path.old when a save stopped between renames."""
+        old = path.rstrip(os.sep) + '.old'
+        if not os.path.isdir(path) and os.path.isdir(old):
+            return old
+        return path
+
+    @classmethod
+    def exists(cls, path):
+        """Check whether a store was saved at path (see save)."""
+        return os.path.isdir(cls._saved_path(path))
+
+    @classmethod
+    def load(cls, path, mmap=True, model_id=None):
+        """
+        Load a store written by save().
+        With mmap=True the index vectors and chunk texts are memory-mapped
+        rather than read, so even a large store opens at once and its pages
+        load as searches touch them (and are shared by every process that
+        maps the same files). A mapped index is copied into memory the first
+        time a document is added or removed.
+        With model_id given, the store must have been built by that embedding
+        model; a store saved without a model_id takes the one given.
+        Raises:
+            ValueError: If the layout version is not supported, or the store
+                was built by another embedding model
+        """
+        path = cls._saved_path(path)
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        version = meta.get('version')
+        if version != LAYOUT_VERSION:
+            raise ValueError(f"Unsupported vector store layout version {version} in {path}")
+        saved_model = meta['model']
+        if model_id is not None and saved_model is not None and saved_model != model_id:
+            raise ValueError(f"Vector store in {path} was built with embedding model {saved_model}, not {model_id}")
+        model_id = saved_model or model_id
+        reduction = meta['reduction']
+        store = cls(reduce_dim=reduction['dim'], reduction=reduction['method'], train_size=reduction['train_size'],
+                    model_id=model_id)
+        store.reduction_recall = reduction['recall']
+        store.chunks = ChunkTable.read(path, meta['chunks'], mmap_text=mmap)
+        store.documents = meta['documents']
+        index_path = os.path.join(path, 'index.faiss')
+        if os.path.exists(index_path):
+            store.index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP_IFC if mmap else 0)
+            store._index_mapped = mmap
+        return store